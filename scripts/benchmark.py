@@ -0,0 +1,224 @@
+### SUB-FUNCTIONS ###
+def define_scales():
+    # fixture sizes per scale: GKG files x records, Lens pages x records for patents and journals
+    return {'small': {'gkg_files': 4, 'gkg_records': 500, 'lens_pages': 2, 'lens_records': 500},
+            'medium': {'gkg_files': 16, 'gkg_records': 2000, 'lens_pages': 4, 'lens_records': 2500},
+            'large': {'gkg_files': 48, 'gkg_records': 5000, 'lens_pages': 10, 'lens_records': 5000}}
+
+def build_tree(root, seed, scale, base_config):
+    """Creates a throwaway copy of the repository layout with the scripts, config and synthetic raw data.
+
+    Returns:
+        Tuple of (scripts folder, GKG fixture folder, GKG files as (filename, timestamp, size), after, before).
+    """
+    import os, shutil
+    import numpy as np
+    from datetime import datetime, timedelta
+    from src.benchmark_fixtures import write_gkg_files, write_lens_pages, patent_record, journal_record
+
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    shutil.copytree(os.path.join(repo, 'scripts'), os.path.join(root, 'scripts'), ignore=shutil.ignore_patterns('__pycache__'))
+    shutil.copy(os.path.join(repo, 'regex_terms.ini'), root)
+    data = os.path.join(root, 'data')
+    for folder in ['raw', 'processed', 'filtered']:
+        for source in ['gdelt', 'patents', 'journals']:
+            os.makedirs(os.path.join(data, folder, source))
+    os.makedirs(os.path.join(data, 'dashboard'))
+    os.makedirs(os.path.join(data, 'meta', 'process_log'))
+    for lookup in ['countries_filtered.csv', 'fips_country_codes.csv', 'country_code_gdp.csv']:
+        shutil.copy(os.path.join(repo, 'data', 'meta', lookup), os.path.join(data, 'meta'))
+    for log in ['processed_patents.csv', 'processed_journals.csv']:
+        with open(os.path.join(data, 'meta', 'process_log', log), 'w') as f:
+            f.write('processed files\n')
+    open(os.path.join(data, 'filtered', 'gdelt', 'ingested_files.csv'), 'w').close()
+    # metrics are kept as JSON only, the harness reads the row counts from them
+    config = base_config
+    if not config.has_section('METRICS'):
+        config.add_section('METRICS')
+    config['METRICS']['formats'] = 'json'
+    config['METRICS']['profiler'] = 'none'
+    with open(os.path.join(root, 'config.ini'), 'w') as f:
+        config.write(f)
+
+    ### Synthetic data ###
+    sizes = define_scales()[scale]
+    rng = np.random.default_rng(seed)
+    start, end = datetime(2023, 1, 1), datetime(2023, 1, 31)
+    gkg_folder = os.path.join(root, 'gkg_fixtures')
+    gkg_files = write_gkg_files(gkg_folder, rng, sizes['gkg_files'], sizes['gkg_records'], start)
+    write_lens_pages(os.path.join(data, 'raw', 'patents'), 'patents', patent_record, rng, sizes['lens_pages'], sizes['lens_records'], start, end)
+    # one page as a full JSON response, the format of older raw files
+    write_lens_pages(os.path.join(data, 'raw', 'patents'), 'patents_json', patent_record, rng, 1, sizes['lens_records'], start, end, fmt='json')
+    write_lens_pages(os.path.join(data, 'raw', 'journals'), 'journals', journal_record, rng, sizes['lens_pages'], sizes['lens_records'], start, end)
+    # every GKG file falls on the first day
+    return os.path.join(root, 'scripts'), gkg_folder, gkg_files, f'{start:%Y-%m-%d}', f'{start + timedelta(days=1):%Y-%m-%d}'
+
+def run_script(scripts_folder, args, log_file):
+    """Runs one entry point in its own process and measures it.
+
+    Returns:
+        Dict with the exit code, wall seconds and the peak resident memory of the process in MiB
+        (None where os.wait4 is unavailable).
+    """
+    import os, sys, time, subprocess
+    start = time.perf_counter()
+    with open(log_file, 'a') as log:
+        log.write(f"\n$ {' '.join(args)}\n")
+        log.flush()
+        process = subprocess.Popen([sys.executable] + args, cwd=scripts_folder, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak = usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+        else:
+            process.wait()
+            peak = None
+    return {'returncode': process.returncode, 'wall_seconds': time.perf_counter() - start, 'peak_rss_mb': peak}
+
+def metrics_files(metrics_folder, run_name):
+    import os, glob
+    return {filepath: os.stat(filepath).st_mtime_ns for filepath in glob.glob(os.path.join(metrics_folder, f'{run_name}_*.json'))}
+
+def read_rows(metrics_folder, run_name, before):
+    """Counts the rows handled by one run of an entry point, from the metrics file it wrote (see src.metrics).
+
+    Metrics files are named to the second, so they are read after every run rather than once per stage.
+
+    Args:
+        before (dict): metrics_files() from before the run.
+    Returns:
+        Rows read, or rows written for scripts that only count their output.
+    """
+    import json
+    rows = 0
+    for filepath, mtime in metrics_files(metrics_folder, run_name).items():
+        if before.get(filepath) != mtime:
+            with open(filepath, 'r') as f:
+                run = json.load(f)
+            rows += run['rows_in'] or run['rows_out']
+    return rows
+
+def define_stages(after, before):
+    # stages in the order they run, each a list of script invocations. Filter stages run once per input file
+    import os, glob
+    def filter_args(source, folder, pattern):
+        def args(scripts_folder):
+            files = sorted(glob.glob(os.path.join(scripts_folder, '..', 'data', folder, pattern)))
+            return [['tech_filter.py', '--source', source, '--input_filename', os.path.basename(file)] for file in files]
+        return args
+    gkg_filename = f'gdelt_gkg_{after}_{before}.csv.gz'
+    return [('gdelt_ingestion', 'gdelt_ingestion', lambda _: [['gdelt_ingestion.py', '--after', after, '--before', before, '--no-update_master']]),
+            ('gdelt_syndication', 'gdelt_syndication', lambda _: [['gdelt_syndication.py']]),
+            ('tech_filter_gdelt', 'tech_filter', lambda _: [['tech_filter.py', '--source', 'GDELT', '--input_filename', gkg_filename]]),
+            ('gdelt_append', 'gdelt_append', lambda _: [['gdelt_append.py']]),
+            ('patent_cleaning', 'patent_cleaning', lambda _: [['patent_cleaning.py']]),
+            ('journal_cleaning', 'journal_cleaning', lambda _: [['journal_cleaning.py']]),
+            ('tech_filter_patents', 'tech_filter', filter_args('LENS_API.PATENTS', os.path.join('processed', 'patents'), '*_data.parquet')),
+            ('tech_filter_journals', 'tech_filter', filter_args('LENS_API.JOURNALS', os.path.join('processed', 'journals'), '*.parquet'))]
+
+def compare(results, baselines, tolerance):
+    """Flags stages that are slower or use more memory than their baseline by more than the tolerance.
+
+    Returns:
+        List of regression messages, empty if every stage is within its baseline.
+    """
+    regressions = []
+    for stage, result in results.items():
+        baseline = baselines.get(stage)
+        if baseline is None:
+            continue
+        if result['rows_per_second'] < baseline['rows_per_second'] * (1 - tolerance):
+            regressions.append(f"{stage}: {result['rows_per_second']:.0f} rows/s is below the baseline of {baseline['rows_per_second']:.0f} rows/s")
+        if (result['peak_rss_mb'] is not None) and (baseline.get('peak_rss_mb') is not None) and (result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance)):
+            regressions.append(f"{stage}: peak memory {result['peak_rss_mb']:.0f} MiB is above the baseline of {baseline['peak_rss_mb']:.0f} MiB")
+    return regressions
+
+### MAIN PROGRAM ###
+def main(scale='small', seed=0, stages=None, update_baseline=False, keep=False):
+    # import libraries
+    import os, json, shutil, tempfile
+    import configparser
+    from datetime import datetime
+    from src.benchmark_fixtures import write_master_list, serve_folder
+    # get config settings
+    config_file = '../config.ini'
+    settings = configparser.ConfigParser(inline_comment_prefixes="#")
+    settings.read(config_file)
+    baseline_file = settings['BENCHMARK']['baseline_file']
+    results_folder = settings['BENCHMARK']['results_folder']
+    tolerance = float(settings['BENCHMARK']['tolerance'])
+
+    ### Fixtures ###
+    root = tempfile.mkdtemp(prefix='benchmark_')
+    print(f'Building {scale} fixtures in {root}')
+    base_config = configparser.ConfigParser(inline_comment_prefixes="#")
+    base_config.read(config_file)
+    scripts_folder, gkg_folder, gkg_files, after, before = build_tree(root, seed, scale, base_config)
+    # GDELT files are downloaded from a local stand-in for data.gdeltproject.org
+    server, base_url = serve_folder(gkg_folder)
+    write_master_list(os.path.join(root, 'data', 'meta', 'gdelt_gkg_masterfilelist.csv'), gkg_files, base_url)
+
+    ### Run stages ###
+    log_file = os.path.join(root, 'benchmark.log')
+    metrics_folder = os.path.join(root, 'data', 'meta', 'metrics')
+    results = {}
+    try:
+        for stage, run_name, make_args in define_stages(after, before):
+            if (stages is not None) and (stage not in stages):
+                continue
+            runs = []
+            for args in make_args(scripts_folder):
+                before = metrics_files(metrics_folder, run_name)
+                runs.append(run_script(scripts_folder, args, log_file))
+                runs[-1]['rows'] = read_rows(metrics_folder, run_name, before)
+            if not runs or any(run['returncode'] != 0 for run in runs):
+                print(f'{stage} failed, see {log_file}')
+                keep = True
+                break
+            wall = sum(run['wall_seconds'] for run in runs)
+            rows = sum(run['rows'] for run in runs)
+            peaks = [run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None]
+            results[stage] = {'rows': rows, 'wall_seconds': wall, 'rows_per_second': rows / wall if wall else 0.0,
+                              'peak_rss_mb': max(peaks) if peaks else None}
+            print(f"{stage}: {rows} rows in {wall:.2f}s ({results[stage]['rows_per_second']:.0f} rows/s), peak memory {results[stage]['peak_rss_mb'] or 0:.0f} MiB")
+    finally:
+        server.shutdown()
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    ### Save results ###
+    os.makedirs(results_folder, exist_ok=True)
+    with open(os.path.join(results_folder, f'benchmark_{scale}_{datetime.now():%Y%m%d_%H%M%S}.json'), 'w') as f:
+        json.dump({'scale': scale, 'seed': seed, 'stages': results}, f, indent=2)
+
+    ### Compare with baselines ###
+    baselines = {}
+    if os.path.isfile(baseline_file):
+        with open(baseline_file, 'r') as f:
+            baselines = json.load(f)
+    regressions = compare(results, baselines.get(scale, {}), tolerance)
+    for regression in regressions:
+        print(f'Regression: {regression}')
+    if update_baseline:
+        baselines[scale] = dict(baselines.get(scale, {}), **results)
+        with open(baseline_file, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f'Baselines for {scale} saved to {baseline_file}')
+    return results, regressions
+
+### SCRIPT TO RUN WHEN CALLED STANDALONE ###
+if __name__=='__main__':
+    # input arguments
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', default='small', choices=list(define_scales()), help='size of the synthetic fixtures')
+    parser.add_argument('--seed', default=0, type=int, help='seed for the synthetic fixtures')
+    parser.add_argument('--stages', nargs='+', default=None, help='run only these stages, later stages need the outputs of earlier ones')
+    parser.add_argument('--update_baseline', action='store_true', help='save the results as the new baselines for this scale')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary tree with the fixtures, outputs and logs')
+    args = parser.parse_args()
+
+    # run main, a non-zero exit code marks a regression or a failed stage
+    results, regressions = main(args.scale, args.seed, args.stages, args.update_baseline, args.keep)
+    sys.exit(1 if regressions or (len(results) == 0) else 0)
@@ -0,0 +1,75 @@
+### SUB-FUNCTIONS ###
+def define_name_sources(settings):
+    # where organisation names come from: files to read, and how to get the names out of each file
+    import os
+    from src import schemas
+    from gdelt_append import create_dimension_df
+
+    def gdelt_names(filepath):
+        df = schemas.read_csv(filepath, 'gkg', usecols=['GKGRECORDID', 'V2Organizations'])
+        return create_dimension_df(df.dropna(subset=['V2Organizations']), 'V2Organizations', ['org_name', 'text_position'], ',', 1)['org_name']
+
+    def patent_names(filepath):
+        return schemas.read_parquet(filepath, 'patent_parties', columns=['name'])['name']
+
+    def journal_names(filepath):
+        return schemas.read_parquet(filepath, 'journals', columns=['institution'])['institution']
+
+    def folder(data_folder, source, pattern):
+        return os.path.join(settings['DEFAULT'][data_folder], settings[source]['subfolder'], pattern)
+
+    return {'GDELT': {'files': folder('filtered_data_folder', 'GDELT', '*_filtered.csv'), 'names': gdelt_names},
+            'LENS_API.PATENTS': {'files': folder('processed_data_folder', 'LENS_API.PATENTS', '*_applicants.parquet'), 'names': patent_names},
+            'LENS_API.JOURNALS': {'files': folder('processed_data_folder', 'LENS_API.JOURNALS', '*.parquet'), 'names': journal_names}}
+
+### MAIN PROGRAM ###
+def main(sources, save_option=None, settings=None):
+    # import libraries
+    import os, glob
+    import configparser
+    from src import metrics, schemas, storage
+    from src.entity_resolution import EntityIndex
+    # read settings from config file, unless the pipeline passed in the settings it read
+    if settings is None:
+        settings = configparser.ConfigParser(inline_comment_prefixes="#")
+        settings.read('../config.ini')
+    index = EntityIndex(settings['ENTITY_RESOLUTION']['index_folder'], threshold=float(settings['ENTITY_RESOLUTION']['threshold']),
+                        n=int(settings['ENTITY_RESOLUTION']['ngram']), max_block_size=int(settings['ENTITY_RESOLUTION']['max_block_size']))
+
+    ### Resolve the names in files not seen yet ###
+    name_sources = define_name_sources(settings)
+    for source in sources:
+        new_files = [filepath for filepath in sorted(glob.glob(name_sources[source]['files'])) if not index.is_processed(source, os.path.basename(filepath))]
+        print(f'{len(new_files)} new {source} files')
+        with metrics.stage(source):
+            for filepath in new_files:
+                names = name_sources[source]['names'](filepath)
+                metrics.add_rows(rows_in=len(names))
+                metrics.add_bytes(read=filepath)
+                new_keys = index.update(names, source)
+                index.mark_processed(source, os.path.basename(filepath))
+                print(f'{os.path.basename(filepath)}: {len(names)} names, {new_keys} new')
+    index.save()
+
+    ### Save organisation mentions per entity and source for the dashboard ###
+    entities_df = index.canonical()
+    print(f"{len(index.names_df)} names resolved to {entities_df['entity_id'].nunique()} organisations")
+    output_filepath = os.path.join(settings['DEFAULT']['dashboard_data_folder'], 'organisations.parquet')
+    schemas.write_parquet(entities_df, output_filepath, 'organisations')
+    metrics.add_rows(rows_out=len(entities_df))
+    storage.save(output_filepath, ('GDRIVE.FOLDER_IDS', 'gdelt_data'), save_option)
+    return entities_df
+
+### SCRIPT TO RUN WHEN CALLED STANDALONE ###
+if __name__=='__main__':
+    # input arguments
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', nargs='+', default=['GDELT', 'LENS_API.PATENTS', 'LENS_API.JOURNALS'], choices=['GDELT', 'LENS_API.PATENTS', 'LENS_API.JOURNALS'], help='sources to read organisation names from')
+    parser.add_argument('--save', default=None, type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
+    args = parser.parse_args()
+
+    # run main
+    from src.metrics import run_metrics
+    with run_metrics('entity_resolution'):
+        main(args.source, args.save)
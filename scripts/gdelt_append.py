@@ -31,17 +31,19 @@ def create_dimension_df(df, input_col, output_cols, delim, duplicate_index):
     return out_df.set_axis(output_cols, axis=1)
 
 ### MAIN PROGRAM ###
-def main(gdrive_cred_file , gdrive_folder_id, save_option):
+def main(gdrive_folder_id, save_option, settings=None):
     ### Initialise ###
     # import libraries
-    import os, glob
+    import os, ast, glob
     import configparser
     import pandas as pd
-    from src.google_drive import create_gdrive_client, upload_file
-    # read settings from config file
-    config_file = '../config.ini'
-    settings = configparser.ConfigParser(inline_comment_prefixes="#")
-    settings.read(config_file)
+    from src import metrics, schemas, storage
+    from src.geo_grid import grid_counts, merge_grid
+    from src.country_rollup import load_fips_codes, country_counts, merge_rollup
+    # read settings from config file, unless the pipeline passed in the settings it read
+    if settings is None:
+        settings = configparser.ConfigParser(inline_comment_prefixes="#")
+        settings.read('../config.ini')
     input_path = os.path.join(settings['DEFAULT']['filtered_data_folder'], settings['GDELT']['subfolder'])
     output_path = os.path.join(settings['DEFAULT']['dashboard_data_folder'])
 
@@ -58,35 +60,62 @@ def main(gdrive_cred_file , gdrive_folder_id, save_option):
     # read all unread files
     new_df_list = []
     for filename in new_files:
-        df = pd.read_csv(filename)
+        df = schemas.read_csv(filename, 'gkg')
+        metrics.add_rows(rows_in=len(df))
+        metrics.add_bytes(read=filename)
         new_df_list.append(df)
     # combine
     record_df = pd.concat(new_df_list, axis=0)
 
     ### Parse dimension features ###
     dims = define_dimension_cols()
-    for dim in dims:
-        dim['df'] = create_dimension_df(record_df, dim['input'], dim['outputs'], dim['delim'], dim['duplicate_index'])
+    with metrics.stage('parse_dimensions'):
+        for dim in dims:
+            dim['df'] = schemas.cast(create_dimension_df(record_df, dim['input'], dim['outputs'], dim['delim'], dim['duplicate_index']),
+                                     f"gdelt_{dim['dimension']}")
     # catagorise technologies
-    record_df['tech'] = record_df[['quantum', 'semiconductors', 'cell-based meats', 'hydrogen power', 'personalised medicine']].idxmax(1)
+    tech_cols = ['quantum', 'semiconductors', 'cell-based meats', 'hydrogen power', 'personalised medicine']
+    record_df['tech'] = record_df[tech_cols].idxmax(1)
+
+    # the rollup and the grid record the files they have added under one batch name
+    batch = ';'.join(sorted(os.path.basename(filename) for filename in new_files))
+
+    ### Add the batch to the technology x country x month rollup ###
+    # location countries are FIPS codes, mapped to ISO codes to match the Lens sources and GDP table
+    with metrics.stage('country_rollup'):
+        locations_df = next(dim['df'] for dim in dims if dim['dimension'] == 'locations')
+        country_df = locations_df[['record_id', 'country_code']].assign(country_code=locations_df['country_code'].map(load_fips_codes()))
+        country_df = country_df.merge(record_df[['GKGRECORDID', 'DATE'] + tech_cols].rename(columns={'GKGRECORDID': 'record_id'}), on='record_id')
+        country_df['DATE'] = pd.to_datetime(country_df['DATE'].astype(str), format='%Y%m%d%H%M%S', errors='coerce')
+        rollup_filepath = os.path.join(output_path, 'gdelt_country_rollup.parquet')
+        merge_rollup(country_counts(country_df, 'record_id', 'country_code', 'DATE', tech_cols), rollup_filepath, batch)
+        storage.save(rollup_filepath, gdrive_folder_id, save_option)
+
     # select columns for main records table
     select_cols = {'GKGRECORDID':'record_id', 'DATE':'date', 'SourceCommonName':'domain', 'DocumentIdentifier':'url', 'tech':'technology'}
-    record_df = record_df.rename(columns=select_cols)[select_cols.values()]
+    record_df = schemas.cast(record_df.rename(columns=select_cols)[select_cols.values()], 'gdelt_records')
 
     ### Append new data to files ###  
     dims.append({'dimension': 'record', 'df': record_df})
     print(len(dims))
+    # queued files must not change, so uploads of an earlier append have to finish first
+    storage.wait([os.path.join(output_path, f'gdelt_{dim["dimension"]}.csv') for dim in dims])
     for dim in dims:
         output_filepath = os.path.join(output_path, f'gdelt_{dim["dimension"]}.csv')
         dim['df'].to_csv(output_filepath, mode='a', index=False)
+        metrics.add_rows(rows_out=len(dim['df']))
         
-        ### Save data as CSV in Google Drive ###
-        if (save_option == 'gdrive'):
-            # authenticate and create Google Drive client
-            gdrive = create_gdrive_client(gdrive_cred_file)
-            # upload file to Google Drive
-            upload_file(gdrive, gdrive_folder_id, output_filepath)
-            print('Data saved in Google Drive')
+        ### Upload to Google Drive or Azure in the background ###
+        storage.save(output_filepath, gdrive_folder_id, save_option)
+
+    ### Count location mentions per grid cell, technology and day ###
+    # map views read these cells instead of binning every location point
+    with metrics.stage('grid'):
+        grid_filepath = os.path.join(output_path, 'gdelt_grid.parquet')
+        grid_rows = merge_grid(grid_counts(locations_df, record_df, ast.literal_eval(settings['GDELT']['grid_zooms'])), grid_filepath, batch)
+        if grid_rows is not None:
+            print(f'Grid saved with {grid_rows} cells')
+        storage.save(grid_filepath, gdrive_folder_id, save_option)
 
     ### Append files to ingested log ###
     new_files_df = pd.DataFrame(new_files, columns=['filenames'])
@@ -98,10 +127,11 @@ if __name__=='__main__':
     # input arguments
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('--gdrive_cred_file', default=r'../auth/gdrive_credentials.txt', help='path to Google Drive credentials file')
     parser.add_argument('--gdrive_folder_id', default='1zsKuXBfbf9rowN32mOpkpVbZJFGAgPQA', help='Google Drive folder ID')
     parser.add_argument('--save', default=None, type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
     args = parser.parse_args()
 
     # run main
-    main(args.gdrive_cred_file , args.gdrive_folder_id, args.save)
\ No newline at end of file
+    from src.metrics import run_metrics
+    with run_metrics('gdelt_append'):
+        main(args.gdrive_folder_id, args.save)
\ No newline at end of file
@@ -26,34 +26,22 @@ def update_master_file(csv_filepath):
     master_df.to_csv(csv_filepath, index=None)
     return master_df
 
-def define_gkg_header(mode='all'):
-    if mode=='all':
-        return ['GKGRECORDID','DATE','SourceCollectionIdentifier','SourceCommonName',\
-                'DocumentIdentifier', 'Counts', 'V2Counts', 'Themes', 'V2Themes', 'Locations', \
-                'V2Locations','Persons','V2Persons','Organizations','V2Organizations','V2Tone',\
-                'Dates','GCAM','SharingImage','RelatedImages','SocialImageEmbeds',\
-                'SocialVideoEmbeds','Quotations','AllNames','Amounts','TranslationInfo','Extras']
-    elif mode=='usecols':
-        return ['GKGRECORDID','DATE','SourceCollectionIdentifier','SourceCommonName',\
-                'DocumentIdentifier','Counts','V2Counts','V2Locations','V2Persons',\
-                'V2Organizations','Dates','SharingImage','RelatedImages','SocialImageEmbeds',\
-                'SocialVideoEmbeds','Quotations','AllNames','Amounts','TranslationInfo','Extras']
-    else:
-        return
-    
 ### MAIN PROGRAM ###
-def main(before, after, update_master=True, save_option='local'):
+def main(before, after, update_master=True, save_option='local', settings=None):
     ### Initialise ###
     # import libraries
     import os
     import configparser
     import pandas as pd
     from tqdm import tqdm
+    import time
     import urllib
-    from src.google_drive import create_gdrive_client, upload_file
-    config_file = '../config.ini'
-    settings = configparser.ConfigParser(inline_comment_prefixes="#")
-    settings.read(config_file)
+    from src import metrics, schemas, storage
+    from src.schemas import define_gkg_header
+    # read settings from config file, unless the pipeline passed in the settings it read
+    if settings is None:
+        settings = configparser.ConfigParser(inline_comment_prefixes="#")
+        settings.read('../config.ini')
 
     ### Master file list ###
     # define filepath for master list
@@ -79,16 +67,22 @@ def main(before, after, update_master=True, save_option='local'):
     gkg_header = define_gkg_header('all')
     http_err_count = 0
     # for each URL in master list range
-    for url in tqdm(filtered_master_df['url'].to_list(), desc="Downloading files"):
-        # read zipped CSV file, select only required columns
-        try:
-            file_df = pd.read_csv(url, compression='zip', encoding='utf-8', encoding_errors='replace', \
-                                sep='\t', names=gkg_header, usecols=define_gkg_header('usecols'))
-        # skip if http error
-        except urllib.error.HTTPError as err:
-            http_err_count += 1
-        # append into dataframe
-        gkg_df = pd.concat([gkg_df, file_df])
+    with metrics.stage('download'):
+        for url in tqdm(filtered_master_df['url'].to_list(), desc="Downloading files"):
+            # read zipped CSV file, select only required columns
+            start = time.perf_counter()
+            try:
+                file_df = schemas.read_csv(url, 'gkg', compression='zip', encoding='utf-8', encoding_errors='replace', \
+                                           sep='\t', names=gkg_header, usecols=define_gkg_header('usecols'))
+            # skip if http error
+            except urllib.error.HTTPError as err:
+                metrics.record_http('GET', url, err.code, time.perf_counter() - start)
+                http_err_count += 1
+                continue
+            metrics.record_http('GET', url, 200, time.perf_counter() - start)
+            metrics.add_rows(rows_in=len(file_df))
+            # append into dataframe
+            gkg_df = pd.concat([gkg_df, file_df])
     if http_err_count > 0:
         print(f'{http_err_count} files skipped due to HTTP errors')
 
@@ -98,20 +92,25 @@ def main(before, after, update_master=True, save_option='local'):
     print(f'Saving GKG data as {gkg_csv_filename}')
     filepath = settings['DEFAULT']['raw_data_folder'] + settings['GDELT']['subfolder']
     # save in compressed format
-    gkg_df.to_csv(filepath + gkg_csv_filename, index=None, compression='infer')
+    with metrics.stage('save'):
+        gkg_df.to_csv(filepath + gkg_csv_filename, index=None, compression='infer')
+        metrics.add_rows(rows_out=len(gkg_df))
+        metrics.add_bytes(written=filepath + gkg_csv_filename)
 
-    ### Save data as CSV in Google Drive ###
-    if (save_option is not None):
-        if (save_option == 'gdrive'):
-            # authenticate and create Google Drive client
-            gdrive = create_gdrive_client(settings['GDRIVE']['credentials'])
-            gdrive_folder_id = settings['GDRIVE.RAWDATA.FOLDER_IDS']['gdelt_data']
-            # upload file to Google Drive
-            upload_file(gdrive, gdrive_folder_id, filepath + gkg_csv_filename)
-            print('Data saved in Google Drive')
-        if (save_option == 'azure'):
-            print('Save to Azure has not been configured. Action skipped')
-    
+    ### Decode tone, counts and amounts once into a typed sidecar file ###
+    if len(gkg_df) > 0:
+        from src.gkg_decode import decode_gkg
+        numeric_filename = gkg_csv_filename.replace('.csv.gz', '_numeric.parquet')
+        with metrics.stage('decode'):
+            schemas.write_table(decode_gkg(gkg_df), filepath + numeric_filename)
+            metrics.add_bytes(written=filepath + numeric_filename)
+        print(f'Saved tone, counts and amounts as {numeric_filename}')
+        storage.save(filepath + numeric_filename, ('GDRIVE.RAWDATA.FOLDER_IDS', 'gdelt_data'), save_option)
+
+    ### Upload to Google Drive or Azure in the background ###
+    storage.save(filepath + gkg_csv_filename, ('GDRIVE.RAWDATA.FOLDER_IDS', 'gdelt_data'), save_option)
+
+    return gkg_csv_filename, gkg_df
 
 def get_month():
     from datetime import date
@@ -154,4 +153,6 @@ if __name__=='__main__':
             after = args.after
 
         # run main
-        main(before, after, args.update_master, args.save)
\ No newline at end of file
+        from src.metrics import run_metrics
+        with run_metrics('gdelt_ingestion'):
+            main(before, after, args.update_master, args.save)
\ No newline at end of file
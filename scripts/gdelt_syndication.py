@@ -0,0 +1,66 @@
+### SUB-FUNCTIONS ###
+def define_syndication_cols():
+    # GKG fields a record's URL key and signature are made of
+    return ['GKGRECORDID', 'DATE', 'DocumentIdentifier', 'V2Persons', 'V2Organizations', 'Quotations']
+
+### MAIN PROGRAM ###
+def main(save_option=None, handed_over=None, settings=None):
+    """Clusters the records of raw GKG files not seen yet with the syndicated copies of the same article.
+
+    Args:
+        save_option (str): see config.ini.
+        handed_over (tuple): optional (filename, pd.DataFrame) of a file already in memory, from gdelt_ingestion.
+        settings (ConfigParser): optional parsed config.ini, read from the file if None.
+    Returns:
+        pd.DataFrame link table of the new records, see src.syndication.SyndicationIndex.add().
+    """
+    # import libraries
+    import os, glob
+    import configparser
+    import pandas as pd
+    from src import metrics, schemas, storage
+    from src.syndication import SyndicationIndex
+    # read settings from config file, unless the pipeline passed in the settings it read
+    if settings is None:
+        settings = configparser.ConfigParser(inline_comment_prefixes="#")
+        settings.read('../config.ini')
+    index = SyndicationIndex(settings['SYNDICATION']['index_folder'], max_distance=int(settings['SYNDICATION']['max_distance']),
+                             window_days=float(settings['SYNDICATION']['window_days']), min_features=int(settings['SYNDICATION']['min_features']))
+
+    ### Cluster the records of files not seen yet ###
+    input_path = os.path.join(settings['DEFAULT']['raw_data_folder'], settings['GDELT']['subfolder'])
+    new_files = [filepath for filepath in sorted(glob.glob(os.path.join(input_path, '*.csv.gz'))) if not index.is_processed(os.path.basename(filepath))]
+    print(f'{len(new_files)} new GDELT files')
+    links = []
+    for filepath in new_files:
+        filename = os.path.basename(filepath)
+        with metrics.stage('cluster'):
+            if (handed_over is not None) and (handed_over[0] == filename):
+                gkg_df = handed_over[1][define_syndication_cols()]
+            else:
+                gkg_df = schemas.read_csv(filepath, 'gkg', usecols=define_syndication_cols())
+                metrics.add_bytes(read=filepath)
+            metrics.add_rows(rows_in=len(gkg_df))
+            links_df = index.add(gkg_df)
+            index.save(filename, links_df)
+            metrics.add_rows(rows_out=int((links_df['match'] == 'representative').sum()))
+        print(f"{filename}: {len(links_df)} records, {(links_df['match'] != 'representative').sum()} syndicated copies")
+        storage.save(index.links_path(filename), ('GDRIVE.RAWDATA.FOLDER_IDS', 'gdelt_data'), save_option)
+        links.append(links_df)
+    if new_files:
+        storage.save(index.clusters_path, ('GDRIVE.RAWDATA.FOLDER_IDS', 'gdelt_data'), save_option)
+    print(f'{len(index.signatures)} articles in the syndication index')
+    return pd.concat(links, ignore_index=True) if links else None
+
+### SCRIPT TO RUN WHEN CALLED STANDALONE ###
+if __name__=='__main__':
+    # input arguments
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', default=None, type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
+    args = parser.parse_args()
+
+    # run main
+    from src.metrics import run_metrics
+    with run_metrics('gdelt_syndication'):
+        main(args.save)
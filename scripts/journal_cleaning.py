@@ -6,7 +6,9 @@ import os
 import json
 import pandas as pd
 import configparser
-from src.author_info import extract_author_info
+from src.author_info import extract_author_columns
+from src.jsonl import read_jsonl
+from src import metrics, schemas, storage
 
 ## load config.ini
 config_file = '../config.ini'
@@ -21,71 +23,74 @@ dest_folder = settings['DEFAULT']['processed_data_folder'] + settings['LENS_API.
 def append_processed_files_to_log(files):
     df = pd.read_csv('../data/meta/process_log/processed_journals.csv')
     new_df = pd.DataFrame(pd.concat([df['processed files'], files]), columns=['processed files'])
-    new_df.to_csv('../data/meta/process_log/processed_journals.csv')
+    new_df.to_csv('../data/meta/process_log/processed_journals.csv', index=False)
     return
 
-def clean_journal(files):
-    # Initialize an empty list to store DataFrames from each file
-    dfs = []
-
-    # Loop through each JSON file and read it into a DataFrame
-    for json_file in files:
-        # Read the JSON data from the file
-        with open(json_file, 'r') as json_data:
-            data = json.load(json_data)
-            content = data['data']
-
-            # Convert the JSON content into a DataFrame
-            df = pd.DataFrame.from_dict(content)
-            # Append the DataFrame to the list
-            dfs.append(df)
-        
-        
-
-    # Concatenate all DataFrames in the list into a single DataFrame
-    df = pd.concat(dfs, ignore_index=True)
-    df['date_published'] = pd.to_datetime(df['date_published'], format = 'ISO8601')
-    # Apply the function to create the "author", "institution", and "country" columns
-    df[['author', 'institution', 'country']] = df.apply(extract_author_info, axis=1).apply(pd.Series)
+def read_journal_records(json_file):
+    # jsonl files hold one record per line
+    if '.jsonl' in json_file:
+        return list(read_jsonl(json_file))
+    # Read the JSON data from the file, raw responses hold the records under 'data'
+    with open(json_file, 'r') as json_data:
+        data = json.load(json_data)
+    return data['data']
+
+def clean_journal_file(json_file):
+    """Cleans a single raw Lens scholarly response into a typed Arrow table.
+
+    Args:
+        json_file (str): path to a raw response file.
+    Returns:
+        pyarrow.Table with the columns of the 'journals' schema in src.schemas.
+    """
+    content = read_journal_records(json_file)
+
+    # Convert the JSON content into a DataFrame, adding any fields missing from every record
+    df = pd.DataFrame.from_dict(content)
+    df = df.reindex(columns=['lens_id', 'title', 'abstract', 'date_published', 'authors', 'fields_of_study', 'keywords'])
+    df['date_published'] = pd.to_datetime(df['date_published'], format = 'ISO8601').dt.date
+    # Extract the "author", "institution", "country_code" and "country" columns in a single pass
+    author_df = extract_author_columns(df['authors'])
+    df[author_df.columns] = author_df
     # drop authors column
     df.drop(['authors'], axis=1, inplace=True)
-    # Convert the list of strings into a single string, separated by commas
-    df['fields_of_study'] = df['fields_of_study'].apply(lambda x: ', '.join(x) if isinstance(x, list) else '')
-    df['keywords'] = df['keywords'].apply(lambda x: ', '.join(x) if isinstance(x, list) else '')
-    df['date_published'] = df['date_published'].dt.date
 
+    # list columns are converted natively by Arrow, missing values become nulls
+    return schemas.to_table(df, 'journals')
 
-    ## save to dest folder
-    first_dt = df['date_published'].min()
-    last_dt = df['date_published'].max()
-    filename = dest_folder + f'journals_{first_dt}_to_{last_dt}.csv'
-    df.to_csv(filename, index = False)
-    print(f'Saved {filename}')
+def clean_journal(files):
+    """Streams raw journal files into a Parquet dataset in the processed folder, one part per raw file.
 
-    ## after reading, add file to processed log
-    append_processed_files_to_log(files)
+    Memory use is bounded by the largest raw file. Each file is added to the processed log as soon as
+    its part is written, so an interrupted run picks up from the next unprocessed file.
 
-    return filename
+    Args:
+        files (iterable[str]): raw files to process.
+    Returns:
+        List of written Parquet filepaths.
+    """
+    import pyarrow.parquet as pq
+    filenames = []
 
+    # Loop through each JSON file and write it as its own part of the dataset
+    for json_file in files:
+        with metrics.stage('clean_file'):
+            table = clean_journal_file(json_file)
 
-def save_data_gdrive(file):
-    from src.google_drive import create_gdrive_client, upload_file
-    from journal_cleaning import clean_journal
+            ## save to dest folder
+            filename = dest_folder + Path(json_file).name.split('.')[0] + '.parquet'
+            pq.write_table(table, filename)
+            metrics.add_rows(rows_out=table.num_rows)
+            metrics.add_bytes(read=json_file, written=filename)
+        filenames.append(filename)
+        print(f'Saved {filename}')
+        del(table)
 
-    #get google drive info
-    gdrive_cred_file = settings['GDRIVE']['credentials']
-    gdrive_folder_id = settings['GDRIVE.FOLDER_IDS']['journal_data']
+        ## after writing, add file to processed log
+        append_processed_files_to_log(pd.Series([json_file]))
 
-    # authenticate and create Google Drive client
-    gdrive = create_gdrive_client(gdrive_cred_file)
-    # upload file to Google Drive
-    upload_file(gdrive, gdrive_folder_id, file)
-    print('Data saved in Google Drive')
-    return
+    return filenames
 
-def save_data_azure(file):
-    print('Save to Azure has not been configured. Action skipped')
-    return
 
 ## read the processed log and compare against files in folder.
 ## return the files that have not yet been processed
@@ -106,13 +111,11 @@ def identify_new_files():
 
 def main(save_to = None):
     files = identify_new_files()
-    filename = clean_journal(files)
+    filenames = clean_journal(files)
 
-    if save_to is not None:
-            if save_to == 'gdrive':
-                save_data_gdrive(filename)
-            if save_to == 'azure':
-                save_data_azure(filename)
+    ## upload in the background if save option is gdrive or azure
+    for filename in filenames:
+        storage.save(filename, ('GDRIVE.FOLDER_IDS', 'journal_data'), save_to)
 
 
     return
@@ -125,4 +128,5 @@ if __name__ == "__main__":
     parser.add_argument('--save', dest='save_to', type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
     args = parser.parse_args()
 
-    main(args.save_to)
\ No newline at end of file
+    with metrics.run_metrics('journal_cleaning'):
+        main(args.save_to)
\ No newline at end of file
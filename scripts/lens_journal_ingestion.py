@@ -9,6 +9,9 @@ auth_json = '../auth/api_auth.json'
 q_type = 'Journal'                               ## set the publication types to retrieve, see https://docs.api.lens.org/response-scholar.html                                     ## set empty year
 q_size = 50000                                   ## set the number of journals to return each query. For paid licences change this number to 1,000 - 10,000
 max_limit = 999999                               ## set the limit on the number of results to query for. This will override the max results if lower.
+authkey = None
+lens_client = None
+save_to = None                                   ## where raw pages are saved besides the local folder, see valid_save_options in config.ini
  
 
 # Define the filters for match
@@ -21,18 +24,35 @@ filters_dict = {
 
 
 ###
-# Get API authorisation code from file.
+# Get API authorisation code from file. The file is only read on the first call.
 ###
 def get_auth():
     global authkey
 
-    api_auth = open(auth_json, "r")
-    authkey = json.load(api_auth)['lens']
-    api_auth.close()
+    if authkey is None:
+        api_auth = open(auth_json, "r")
+        authkey = json.load(api_auth)['lens']
+        api_auth.close()
 
     return authkey
 
-def build_query(filters_dict, start_from, start_d, end_d):
+###
+# Shared Lens client: one pooled session and rate limiter for every request in the run
+###
+def get_lens_client():
+    from src.lens_client import get_client
+    global lens_client
+
+    if lens_client is None:
+        config_file = '../config.ini'
+        settings = configparser.ConfigParser(inline_comment_prefixes="#")
+        settings.read(config_file)
+        lens_client = get_client(get_auth(), int(settings['LENS_API']['rate_limit']), int(settings['LENS_API']['max_retries']),
+                                 pool_size=int(settings['LENS_API']['max_workers']))
+
+    return lens_client
+
+def build_query(filters_dict, start_from, start_d, end_d, size = None):
     # Initialize the query conditions list
     query_conditions = []
 
@@ -71,7 +91,7 @@ def build_query(filters_dict, start_from, start_d, end_d):
     # Build the final query
     query = {
         "query": query_must,
-        "sort": [{"date_published": "asc"}], # sort with date published
+        "sort": [{"date_published": "asc"}, {"lens_id": "asc"}], # sort with date published, lens_id breaks ties for watermarks
         "include": ["lens_id", 
                 "title", 
                 "abstract", 
@@ -81,27 +101,60 @@ def build_query(filters_dict, start_from, start_d, end_d):
                 "keywords"
                 ],
         "from": start_from, 
-        "size": q_size  # Number of results per page (adjust as needed)
+        "size": q_size if size is None else size  # Number of results per page (adjust as needed)
     }
     
     return query
 
-def get_response(start_d, end_d, start_from = 0):
+def get_response(start_d, end_d, start_from = 0, size = None):
     
-    query = build_query(filters_dict, start_from, start_d, end_d)
-    headers = {'Authorization': get_auth(), 'Content-Type': 'application/json'}
-    response = requests.post(search_url, data=json.dumps(query), headers=headers)
+    query = build_query(filters_dict, start_from, start_d, end_d, size)
+    response = get_lens_client().post(search_url, json.dumps(query), stream=True)
 
     return response
 
-def ingest_journals(start_d, end_d):
+def post_query(body):
+    response = get_lens_client().post(search_url, json.dumps(body), stream=True)
+
+    return response
+
+###
+# Stream a response page to compressed jsonl and return its paging info
+###
+def save_journal_page(response, filename, keep = None):
+    from src import metrics, storage
+    from src.jsonl import write_response_jsonl
+
+    meta = write_response_jsonl(response, filename, keep)
+    metrics.add_rows(rows_in=meta['records'], rows_out=meta['written'])
+    if meta['written'] > 0:
+        metrics.add_bytes(written=filename)
+        print("saved results to: " + filename)
+        ## upload in the background if save option is gdrive or azure
+        storage.save(filename, ('GDRIVE.RAWDATA.FOLDER_IDS', 'journal_data'), save_to)
+
+    return meta
+
+###
+# With a watermark store, records at or before the watermark are skipped, the page offset is
+# checkpointed after each page and the watermark is advanced once the range is complete.
+###
+def ingest_journals(start_d, end_d, store = None):
     import configparser
     config_file = '../config.ini'
     settings = configparser.ConfigParser(inline_comment_prefixes="#")
     settings.read(config_file)
 
     start_from = 0
+    last = (None, None)
     max_results = None
+    if store is not None:
+        store.begin('offset', start_d, end_d)
+        position = store.load_checkpoint()
+        if position is not None:
+            start_from = position['start_from']
+            last = (position['last_date_published'], position['last_lens_id'])
+            print(f"Resuming from result {start_from}")
     ## check if there are more results to query || or if this is the first query
     ## Condition 1: results is None - make a request
     ## Condition 2: keep querying if the results is lower than max_results, or max_limit
@@ -110,55 +163,95 @@ def ingest_journals(start_d, end_d):
         print(response)
 
         if response.status_code != requests.codes.ok:
-            print("Error: " + response.status_code)
+            print("Error: " + str(response.status_code))
             print(response.text)
             return
         else:
             ## save results
             filepath = settings['DEFAULT']['raw_data_folder'] + settings['LENS_API.JOURNALS']['subfolder']
-            response_json = response.json()
-            filename = filepath + f"journals_{start_d}_to_{end_d}_from_{start_from}.json"
-            f = open(filename, "w", encoding='utf-8')
-            f.write(response.text)
-            f.close()
-
-            print("saved results to: " + filename)
+            filename = filepath + f"journals_{start_d}_to_{end_d}_from_{start_from}.{settings['LENS_API']['raw_format']}"
+            meta = save_journal_page(response, filename, None if store is None else store.is_new)
             
             ## get results info
-            max_results = response_json['total']
-            start_from = start_from + response_json['results']
+            max_results = meta['total']
+            start_from = start_from + meta['records']
+            if meta['records'] == 0:
+                break
+            last = (meta['last_date_published'], meta['last_lens_id'])
+            if store is not None:
+                store.save_checkpoint({'start_from': start_from, 'last_date_published': last[0], 'last_lens_id': last[1]})
 
             ## if max_results exists limit, set limit
             if (max_results > max_limit):
                 max_results = max_limit
 
-    return
+    if store is not None:
+        store.advance(*last)
 
-def save_journal_data_gdrive():
-    from src.google_drive import create_gdrive_client, upload_file
-    from journal_cleaning import clean_journal
+    return start_from
+
+###
+#   Page through the results with a scroll cursor, saving each page as it arrives.
+#   The cursor is checkpointed after every page so an interrupted run resumes where it stopped.
+#   With a watermark store the cursor is checkpointed in the store and the watermark advanced on completion.
+###
+def ingest_journals_scroll(start_d, end_d, store = None):
+    from src.lens_scroll import scroll_pages, FileCheckpoint
     config_file = '../config.ini'
     settings = configparser.ConfigParser(inline_comment_prefixes="#")
     settings.read(config_file)
+    filepath = settings['DEFAULT']['raw_data_folder'] + settings['LENS_API.JOURNALS']['subfolder']
 
-    # calling function to save csv to processed folder
-    csv_filename = clean_journal()
-    print("saved CSV file to local processed folder")
-    
-    #get google drive info
-    gdrive_cred_file = settings['GDRIVE']['credentials']
-    gdrive_folder_id = settings['GDRIVE.RAWDATA.FOLDER_IDS']['journal_data']
-    
-    # authenticate and create Google Drive client
-    gdrive = create_gdrive_client(gdrive_cred_file)
-    # upload file to Google Drive
-    upload_file(gdrive, gdrive_folder_id, csv_filename)
-    print('Data saved in Google Drive')
-    return
+    query = build_query(filters_dict, 0, start_d, end_d)
+    if store is not None:
+        store.begin('scroll', start_d, end_d)
+        checkpoint = store
+    else:
+        checkpoint = FileCheckpoint(filepath + f".journals_{start_d}_to_{end_d}.scroll")
+
+    def save_page(response, page):
+        filename = filepath + f"journals_{start_d}_to_{end_d}_scroll_{page}.{settings['LENS_API']['raw_format']}"
+        return save_journal_page(response, filename, None if store is None else store.is_new)
+
+    position = scroll_pages(post_query, query, save_page, checkpoint, max_limit=max_limit)
+    if position is None:
+        return
+    if store is not None:
+        store.advance(position['last_date_published'], position['last_lens_id'])
+
+    return position['fetched']
+
+###
+#   Count-only probe: request the smallest page and read the total number of matching journals
+###
+def count_journals(start_d, end_d):
+    response = get_response(start_d, end_d, size=1)
+    response.raise_for_status()
+    return response.json()['total']
+
+###
+#   Split the date range into windows that each fit within the result window and ingest them concurrently.
+#   Each window is saved the same way as a serial run.
+###
+def ingest_journals_sharded(start_d, end_d, workers):
+    from src.lens_planner import plan_windows, fetch_windows
+    config_file = '../config.ini'
+    settings = configparser.ConfigParser(inline_comment_prefixes="#")
+    settings.read(config_file)
+    result_window = int(settings['LENS_API']['result_window'])
+
+    windows = plan_windows(start_d, end_d, count_journals, min(result_window, max_limit))
+    planned = sum(window[2] for window in windows)
+    print(f"Planned {len(windows)} date windows with {planned} results, fetching with {workers} workers")
+
+    fetched = fetch_windows(windows, ingest_journals, workers)
+    if None in fetched:
+        print("Error: one or more date windows failed, see errors above")
+        return
+    if sum(fetched) != planned:
+        print(f"Warning: ingested {sum(fetched)} results but {planned} were planned")
 
-def save_journal_data_azure():
-    print('Save to Azure has not been configured. Action skipped')
-    return
+    return sum(fetched)
 
 def get_month():
     from datetime import date
@@ -170,19 +263,26 @@ def get_month():
 
 def main():
     import configparser
+    global search_url
+    global save_to
     config_file = '../config.ini'
     settings = configparser.ConfigParser(inline_comment_prefixes="#")
     settings.read(config_file)
+    search_url = settings['LENS_API.JOURNALS']['scholarly_search']
 
     # Define the command-line argument parser
     parser = argparse.ArgumentParser(description='Extract journal data from Lens.org.')
-    parser.add_argument('--after', type=str, required=True, help='Start date of the date range (format: YYYY-MM-DD)')
-    parser.add_argument('--before', type=str, required=True, help='End date of the date range (format: YYYY-MM-DD)')
+    parser.add_argument('--after', type=str, help='Start date of the date range (format: YYYY-MM-DD)')
+    parser.add_argument('--before', type=str, help='End date of the date range (format: YYYY-MM-DD)')
     parser.add_argument('--month', action='store_true', help = 'set search range to last month (default value)')
     parser.add_argument('--save', dest='save_to', type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
+    parser.add_argument('--scroll', action='store_true', help = "page through results with a scroll cursor, resuming from the last checkpoint if interrupted")
+    parser.add_argument('--incremental', action='store_true', help = "only fetch journals newer than the last ingested record, resuming an unfinished run. --after sets the start of the first run, --before the end (default today)")
+    parser.add_argument('--workers', nargs='?', const=int(settings['LENS_API']['max_workers']), type=int, help = "split the date range into windows under the result window and fetch them concurrently. Defaults to max_workers in config.ini")
     args = parser.parse_args()
     start_d = None
     end_d = None
+    save_to = args.save_to
     
     ## select period to ingest:
     ## check number of date options used are valid.
@@ -195,7 +295,14 @@ def main():
     ## If both month and before/after are used together, return error message
     if (d > 1):
         print("cannot use --month (last month) together with --before & --after. Refer to documentation for guidance.")
-    
+        return
+    ## check both after and before were added
+    elif (args.after is None) != (args.before is None):
+        print("--before and --after must be used together.")
+        return
+    elif args.incremental and args.workers is not None:
+        print("--incremental cannot be used together with --workers. Use --scroll for large incremental runs.")
+        return
     else:
         # set before and after
         # trigger: --month used, or no selection was picked.
@@ -204,23 +311,34 @@ def main():
         else:
             end_d = args.before
             start_d = args.after
-    
+
+    ## incremental runs start from the watermark, or resume the unfinished run
+    store = None
+    if args.incremental:
+        from datetime import date
+        from src.watermark import WatermarkStore
+        store = WatermarkStore('journals')
+        if args.before is None:
+            end_d = str(date.today())
+        # the first run starts from last month unless --after is given
+        start_d, end_d = store.resume_range(start_d or get_month()[0], end_d)
 
     print("== Starting ingestion from Lens ==")
     print("from: " + start_d)
     print("to: " + end_d)
-    ingest_journals(start_d, end_d)
+    if args.scroll:
+        ingest_journals_scroll(start_d, end_d, store)
+    elif args.workers is not None:
+        ingest_journals_sharded(start_d, end_d, args.workers)
+    else:
+        ingest_journals(start_d, end_d, store)
 
     print("== Data ingestion completed ==")
 
-    if parser.save_to is not None:
-        if parser.save_to == 'gdrive':
-            save_journal_data_gdrive()
-        if parser.save_to == 'azure':
-            save_journal_data_azure()
-
     return 
 
 ## Execute main
 if __name__ == "__main__":
-    main()
+    from src.metrics import run_metrics
+    with run_metrics('lens_journal_ingestion'):
+        main()
@@ -18,6 +18,11 @@ q_juridictions = []
 q_types = []  
 q_size = 0 
 max_limit = 0 
+result_window = 0
+max_workers = 1
+rate_limit = 50
+max_retries = 5
+raw_format = 'jsonl.gz'
 save_to = ''
 patent_data_folder = ''
 
@@ -37,6 +42,11 @@ def set_config():
     global q_types
     global q_size
     global max_limit
+    global result_window
+    global max_workers
+    global rate_limit
+    global max_retries
+    global raw_format
     global save_to
     global patent_data_folder
 
@@ -45,8 +55,13 @@ def set_config():
     search_url = settings['LENS_API.PATENTS']['patent_search']
     q_juridictions = ast.literal_eval(settings["LENS_API.PATENTS"]["juridictions"])
     q_types = ast.literal_eval(settings['LENS_API.PATENTS']['types'])
-    q_size = settings['LENS_API.PATENTS']['size'] 
-    max_limit = settings['LENS_API.PATENTS']['max_limit'] 
+    q_size = int(settings['LENS_API.PATENTS']['size'])
+    max_limit = int(settings['LENS_API.PATENTS']['max_limit'])
+    result_window = int(settings['LENS_API']['result_window'])
+    max_workers = int(settings['LENS_API']['max_workers'])
+    rate_limit = int(settings['LENS_API']['rate_limit'])
+    max_retries = int(settings['LENS_API']['max_retries'])
+    raw_format = settings['LENS_API']['raw_format']
     patent_data_folder = settings['DEFAULT']['raw_data_folder'] + settings['LENS_API.PATENTS']['subfolder'] 
 
     save_to = settings['DEFAULT']['save_data']
@@ -159,15 +174,24 @@ def build_data(start_d, end_d):
             ]
         }          
     },
-    "sort": [{"date_published": "asc"}],
+    "sort": [{"date_published": "asc"}, {"lens_id": "asc"}],
     '''
     
     data = query_1 + term_builder(q_juridictions[0], q_juridictions[1:]) + term_builder(q_types[0], q_types[1:]) + query_range(start_d, end_d) + query_2 + response_include()
     return data
 
 
-def get_response(data, start_from = 0):
-    size = q_size      
+###
+#   Shared Lens client: one pooled session and rate limiter for every request in the run
+###
+def get_lens_client():
+    from src.lens_client import get_client
+    return get_client(authkey, rate_limit, max_retries, pool_size=max_workers)
+
+
+def get_response(data, start_from = 0, size = None):
+    if size is None:
+        size = q_size
 
     data_suffix = '''
     "from" : %d,
@@ -176,8 +200,15 @@ def get_response(data, start_from = 0):
     ''' % (start_from, size)
 
     data = data + data_suffix
-    headers = {'Authorization': authkey, 'Content-Type': 'application/json'}
-    response = requests.post(search_url, data=data, headers=headers)
+    response = get_lens_client().post(search_url, data, stream=True)
+
+    return response
+
+###
+#   Post a complete request body, used for scroll requests where the body changes between pages
+###
+def post_query(body):
+    response = get_lens_client().post(search_url, json.dumps(body), stream=True)
 
     return response
 
@@ -185,15 +216,25 @@ def get_response(data, start_from = 0):
 #   1) package query and data
 #   2) get response
 #   3) check response code
-#   4) save data as json
+#   4) stream data to compressed jsonl, capturing the paging info in the same pass
 #   5) check if there is more results
 #   6) iterate until no more results
 #   
+#   With a watermark store, records at or before the watermark are skipped, the page offset is
+#   checkpointed after each page and the watermark is advanced once the range is complete.
 ###
-def ingest_patents(start_d, end_d):
+def ingest_patents(start_d, end_d, store = None):
     start_from = 0
+    last = (None, None)
     data = build_data(start_d, end_d)
     max_results = None
+    if store is not None:
+        store.begin('offset', start_d, end_d)
+        position = store.load_checkpoint()
+        if position is not None:
+            start_from = position['start_from']
+            last = (position['last_date_published'], position['last_lens_id'])
+            print(f"Resuming from result {start_from}")
     ## check if there are more results to query || or if this is the first query
     ## Condition 1: results is None - make a request
     ## Condition 2: keep querying if the results is lower than max_results, or max_limit
@@ -201,66 +242,109 @@ def ingest_patents(start_d, end_d):
         response = get_response(data, start_from)
 
         if response.status_code != requests.codes.ok:
-            print("Error: " + response.status_code)
+            print("Error: " + str(response.status_code))
             print(response.text)
             return
         else:
             ## save results
             # 1) create filename
             # 2) call save 
-            filename = f"patents_{start_d}_to_{end_d}_from_{start_from}.json"
-            save_patent_data(response.text, filename)
+            filename = f"patents_{start_d}_to_{end_d}_from_{start_from}.{raw_format}"
+            meta = save_patent_data(response, filename, None if store is None else store.is_new)
             
             ## get results info
-            response_json = response.json()
-            max_results = response_json['total']
-            start_from = start_from + response_json['results']
+            max_results = meta['total']
+            start_from = start_from + meta['records']
+            if meta['records'] == 0:
+                break
+            last = (meta['last_date_published'], meta['last_lens_id'])
+            if store is not None:
+                store.save_checkpoint({'start_from': start_from, 'last_date_published': last[0], 'last_lens_id': last[1]})
 
             ## if max_results exists limit, set limit
             if (max_results > max_limit):
                 max_results = max_limit
 
-    return
+    if store is not None:
+        store.advance(*last)
 
+    return start_from
 
-def save_patent_data(response_text, filename):
-    
-    file_destination = patent_data_folder + filename
-    ## save to local (this option always happens regardless of save_to settting)
-    f = open(file_destination, "w", encoding='utf-8')
-    f.write(response_text)
-    f.close()
-    print("saved results to local folder: " + patent_data_folder + filename)
+###
+#   1) package query and data with a scroll cursor instead of from/size offsets
+#   2) save each page as soon as it arrives and checkpoint the cursor
+#   3) resume from the checkpoint if a previous run was interrupted
+#   With a watermark store the cursor is checkpointed in the store and the watermark advanced on completion.
+###
+def ingest_patents_scroll(start_d, end_d, store = None):
+    from src.lens_scroll import scroll_pages, FileCheckpoint
 
-    ## if save option is gdrive
-    if (save_to == 'gdrive'):
-        save_patent_gdrive(file_destination)
+    query = json.loads(build_data(start_d, end_d) + '"size": %d\n}' % q_size)
+    if store is not None:
+        store.begin('scroll', start_d, end_d)
+        checkpoint = store
+    else:
+        checkpoint = FileCheckpoint(patent_data_folder + f".patents_{start_d}_to_{end_d}.scroll")
 
-    ## if save option is azure
-    if (save_to == 'azure'):
-        save_patent_azure()
+    def save_page(response, page):
+        filename = f"patents_{start_d}_to_{end_d}_scroll_{page}.{raw_format}"
+        return save_patent_data(response, filename, None if store is None else store.is_new)
 
-    return
+    position = scroll_pages(post_query, query, save_page, checkpoint, max_limit=max_limit)
+    if position is None:
+        return
+    if store is not None:
+        store.advance(position['last_date_published'], position['last_lens_id'])
 
-def save_patent_gdrive(file_destination):
-    from src.google_drive import create_gdrive_client, upload_file
-    settings = configparser.ConfigParser(inline_comment_prefixes="#")
-    settings.read(config_file)
-    
-    #get google drive info
-    gdrive_cred_file = settings['GDRIVE']['credentials']
-    gdrive_folder_id = settings['GDRIVE.RAWDATA.FOLDER_IDS']['patent_data']
-    
-    # authenticate and create Google Drive client
-    gdrive = create_gdrive_client(gdrive_cred_file)
-    # upload file to Google Drive
-    upload_file(gdrive, gdrive_folder_id, file_destination)
-    print('Data saved in Google Drive')
-    return
+    return position['fetched']
+
+###
+#   Count-only probe: request the smallest page and read the total number of matching patents
+###
+def count_patents(start_d, end_d):
+    response = get_response(build_data(start_d, end_d), size=1)
+    response.raise_for_status()
+    return response.json()['total']
+
+###
+#   1) split the date range into windows that each fit within the result window
+#   2) ingest the windows concurrently, each window is saved the same way as a serial run
+#   3) check the ingested totals match the planned totals
+###
+def ingest_patents_sharded(start_d, end_d, workers):
+    from src.lens_planner import plan_windows, fetch_windows
+
+    windows = plan_windows(start_d, end_d, count_patents, min(result_window, max_limit))
+    planned = sum(window[2] for window in windows)
+    print(f"Planned {len(windows)} date windows with {planned} results, fetching with {workers} workers")
+
+    fetched = fetch_windows(windows, ingest_patents, workers)
+    if None in fetched:
+        print("Error: one or more date windows failed, see errors above")
+        return
+    if sum(fetched) != planned:
+        print(f"Warning: ingested {sum(fetched)} results but {planned} were planned")
+
+    return sum(fetched)
 
-def save_patent_azure():
-    print('Save to Azure has not been configured. Action skipped')
-    return
+
+def save_patent_data(response, filename, keep = None):
+    from src import metrics, storage
+    from src.jsonl import write_response_jsonl
+
+    file_destination = patent_data_folder + filename
+    ## save to local (this option always happens regardless of save_to settting)
+    meta = write_response_jsonl(response, file_destination, keep)
+    metrics.add_rows(rows_in=meta['records'], rows_out=meta['written'])
+    if meta['written'] == 0:
+        return meta
+    metrics.add_bytes(written=file_destination)
+    print("saved results to local folder: " + patent_data_folder + filename)
+
+    ## upload in the background if save option is gdrive or azure
+    storage.save(file_destination, ('GDRIVE.RAWDATA.FOLDER_IDS', 'patent_data'), save_to)
+
+    return meta
 
 ########### HELPER FUNCTIONS
 
@@ -277,6 +361,8 @@ def invalid_args(error):
             print("--before and --after must be used together.")
         case 4:
             print("invalid save option detected. See valid options in config.ini")
+        case 5:
+            print("--incremental cannot be used together with --workers. Use --scroll for large incremental runs.")
     return
 
 ##
@@ -308,6 +394,9 @@ def main():
     parser.add_argument('--before', dest='before', type=lambda d: datetime.strptime(d, '%Y-%m-%d'), help = 'date input must use the format YYYY-MM-DD')
     parser.add_argument('--after', dest='after', type=lambda d: datetime.strptime(d, '%Y-%m-%d'), help = 'date input must use the format YYYY-MM-DD')
     parser.add_argument('--save', dest='save_to', type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
+    parser.add_argument('--scroll', action='store_true', help = "page through results with a scroll cursor, resuming from the last checkpoint if interrupted")
+    parser.add_argument('--incremental', action='store_true', help = "only fetch patents newer than the last ingested record, resuming an unfinished run. --after sets the start of the first run, --before the end (default today)")
+    parser.add_argument('--workers', nargs='?', const=max_workers, type=int, help = "split the date range into windows under the result window and fetch them concurrently. Defaults to max_workers in config.ini")
 
     pa = parser.parse_args()
 
@@ -353,6 +442,12 @@ def main():
         else:
             set_save_option(pa.save_to)                     ## if valid, override the default save option
 
+    ##### ERROR 5
+    ## incremental runs checkpoint a single stream of pages
+    if pa.incremental and pa.workers is not None:
+        invalid_args(5)
+        return
+
 
     ##
     #   Part 2:
@@ -370,11 +465,25 @@ def main():
         end_d = str(pa.before.date())
     elif d_range == False:
         start_d, end_d = get_prev_month()
+
+    ## incremental runs start from the watermark, or resume the unfinished run
+    store = None
+    if pa.incremental:
+        from src.watermark import WatermarkStore
+        store = WatermarkStore('patents')
+        if not d_range:
+            end_d = str(date.today())
+        start_d, end_d = store.resume_range(start_d, end_d)
     
     print("== Starting ingestion from Lens ==")
     print("from: " + start_d)
     print("to: " + end_d)
-    ingest_patents(start_d, end_d)
+    if pa.scroll:
+        ingest_patents_scroll(start_d, end_d, store)
+    elif pa.workers is not None:
+        ingest_patents_sharded(start_d, end_d, pa.workers)
+    else:
+        ingest_patents(start_d, end_d, store)
     
     print("== Data ingestion completed ==")
 
@@ -391,5 +500,7 @@ def main():
 
 ## Execute main
 if __name__ == "__main__":
+    from src.metrics import run_metrics
     set_config()
-    main()
\ No newline at end of file
+    with run_metrics('lens_patent_ingestion'):
+        main()
\ No newline at end of file
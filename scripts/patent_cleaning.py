@@ -1,11 +1,13 @@
 ## Libraries
+import os
 import glob
 from pathlib import Path
 import configparser
 import argparse
 
-# - to extract gz files
-import gzip
+# - to extract gz and zst files
+from src.jsonl import open_jsonl
+from src import metrics, schemas, storage
 import json
 
 # - to convert json to dataframe
@@ -41,29 +43,6 @@ def append_processed_files_to_log(files):
     return
 
 
-def save_data_gdrive(patents_data, patents_classifications, patents_applicants, patents_inventors):
-    from src.google_drive import create_gdrive_client, upload_file
-    from journal_cleaning import clean_journal
-
-    #get google drive info
-    gdrive_cred_file = settings['GDRIVE']['credentials']
-    gdrive_folder_id = settings['GDRIVE.FOLDER_IDS']['patent_data']
-
-    # authenticate and create Google Drive client
-    gdrive = create_gdrive_client(gdrive_cred_file)
-    # upload file to Google Drive
-    upload_file(gdrive, gdrive_folder_id, patents_data)
-    upload_file(gdrive, gdrive_folder_id, patents_classifications)
-    upload_file(gdrive, gdrive_folder_id, patents_applicants)
-    upload_file(gdrive, gdrive_folder_id, patents_inventors)
-    print('Data saved in Google Drive')
-
-    return
-
-def save_data_azure(patents_data, patents_classifications, patents_applicants, patents_inventors):
-    print('Save to Azure has not been configured. Action skipped')
-    return
-
 def main(save_to = None):
     files = identify_new_files()
 
@@ -74,10 +53,10 @@ def main(save_to = None):
         patents_inventors = []
         file_ext = Path(file).suffix
 
-        if (file_ext =='.gz'):
-            f = gzip.open(file, 'rt', encoding="ascii", errors="ignore")
+        if (file_ext in ['.gz', '.zst', '.jsonl']):
+            f = open_jsonl(file)
         if (file_ext =='.json'):
-            file_reader = open(file, encoding="ascii", errors="ignore")
+            file_reader = open(file, encoding="utf-8")
             data = json.load(file_reader)
             if "data" in data:
                 f = data['data']
@@ -90,7 +69,7 @@ def main(save_to = None):
         
         for line in f:
             patent = ''
-            if (file_ext =='.gz'):
+            if (file_ext in ['.gz', '.zst', '.jsonl']):
                 patent = json.loads(line)
             if (file_ext =='.json'):
                 patent = line
@@ -115,7 +94,7 @@ def main(save_to = None):
                 app_data = {
                     'lens_id': patent['lens_id'],
                     'patent_id': patent['doc_key'],
-                    'residence': applicant.get('residence', 'NA'),
+                    'residence': applicant.get('residence'),          ## missing residence is saved as null, 'NA' is Namibia
                     'name': applicant['extracted_name']['value']
                 }
                 patents_applicants.append(app_data)
@@ -125,7 +104,7 @@ def main(save_to = None):
                     inv_data = {
                         'lens_id': patent['lens_id'],
                         'patent_id': patent['doc_key'],
-                        'residence': inventor.get('residence', 'NA'),
+                        'residence': inventor.get('residence'),
                         'name': inventor['extracted_name']['value']
                     }
                     patents_inventors.append(inv_data)
@@ -146,27 +125,22 @@ def main(save_to = None):
             del(line)
 
         ## save data to parquet
-        filename = Path(Path(file).stem).stem
+        filename = Path(file).name.split('.')[0]
         path = settings['DEFAULT']['processed_data_folder'] + settings['LENS_API.PATENTS']['subfolder']
 
-        pd.DataFrame(patents_data).to_parquet(path + filename + "_data.parquet", index=False)
-        pd.DataFrame(patents_classifications).to_parquet(path + filename + "_classifications.parquet", index=False)
-        pd.DataFrame(patents_applicants).to_parquet(path + filename + "_applicants.parquet", index=False)
-        pd.DataFrame(patents_inventors).to_parquet(path + filename + "_inventors.parquet", index=False)
+        schemas.write_parquet(pd.DataFrame(patents_data), path + filename + "_data.parquet", 'patent_data')
+        schemas.write_parquet(pd.DataFrame(patents_classifications), path + filename + "_classifications.parquet", 'patent_classifications')
+        schemas.write_parquet(pd.DataFrame(patents_applicants), path + filename + "_applicants.parquet", 'patent_parties')
+        schemas.write_parquet(pd.DataFrame(patents_inventors), path + filename + "_inventors.parquet", 'patent_parties')
+        metrics.add_rows(rows_out=len(patents_data))
+        metrics.add_bytes(read=file, written=sum(os.path.getsize(path + filename + suffix) for suffix in
+                                                 ["_data.parquet", "_classifications.parquet", "_applicants.parquet", "_inventors.parquet"]))
 
         print(f'Saved data, classifications, applicants, inventors for {filename}')
 
-        if save_to is not None:
-            if save_to == 'gdrive':
-                save_data_gdrive(path + filename + "_data.parquet", 
-                                 path + filename + "_classifications.parquet", 
-                                 path + filename + "_applicants.parquet", 
-                                 path + filename + "_inventors.parquet")
-            if save_to == 'azure':
-                save_data_azure(path + filename + "_data.parquet", 
-                                 path + filename + "_classifications.parquet", 
-                                 path + filename + "_applicants.parquet", 
-                                 path + filename + "_inventors.parquet")
+        ## upload in the background if save option is gdrive or azure
+        for suffix in ["_data.parquet", "_classifications.parquet", "_applicants.parquet", "_inventors.parquet"]:
+            storage.save(path + filename + suffix, ('GDRIVE.FOLDER_IDS', 'patent_data'), save_to)
 
         del(patents_data)
         del(patents_classifications)
@@ -188,4 +162,5 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
 
-    main(args.save_to)
+    with metrics.run_metrics('patent_cleaning'):
+        main(args.save_to)
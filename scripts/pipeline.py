@@ -0,0 +1,181 @@
+### SUB-FUNCTIONS ###
+def unfiltered_files(settings, source, folder, pattern, suffix='_filtered.csv'):
+    # lists input files of tech_filter that have no filtered output yet
+    import os, glob
+    filtered_path = os.path.join(settings['DEFAULT']['filtered_data_folder'], settings[source]['subfolder'])
+    input_path = os.path.join(settings['DEFAULT'][folder], settings[source]['subfolder'])
+    return [os.path.basename(filepath) for filepath in sorted(glob.glob(os.path.join(input_path, pattern)))
+            if not os.path.isfile(os.path.join(filtered_path, os.path.basename(filepath).split('.')[0] + suffix))]
+
+def define_stages(settings, after, before, save_option, topic_sources, topic_mode):
+    """Declares the pipeline stages and the order they depend on each other.
+
+    Args:
+        settings (ConfigParser): parsed config.ini.
+        after (str): start date as YYYY-MM-DD, for GDELT and for the first incremental Lens run.
+        before (str): end date as YYYY-MM-DD for GDELT.
+        save_option (str): where each script saves its outputs, see config.ini.
+        topic_sources (list[str]): sources to topic model.
+        topic_mode (str): topic modelling mode, see topic_modelling.py.
+    Returns:
+        List of src.pipeline.Stage.
+    """
+    import os
+    from datetime import date
+    from src.pipeline import Stage
+    raw = settings['DEFAULT']['raw_data_folder']
+    processed = settings['DEFAULT']['processed_data_folder']
+    filtered = settings['DEFAULT']['filtered_data_folder']
+    filter_code = ['tech_filter.py', 'src/regex.py', '../regex_terms.ini']
+
+    ### GDELT ###
+    def gdelt_ingest(upstream):
+        import gdelt_ingestion
+        return gdelt_ingestion.main(before, after, update_master=True, save_option=save_option, settings=settings)
+
+    def gdelt_syndication_index(upstream):
+        import gdelt_syndication
+        return gdelt_syndication.main(save_option, handed_over=upstream.get('gdelt_ingestion'), settings=settings)
+
+    def gdelt_filter(upstream):
+        import tech_filter
+        # the newly downloaded records are filtered in memory, any other unfiltered files are read from disk
+        handed_over = upstream.get('gdelt_ingestion')
+        for filename in unfiltered_files(settings, 'GDELT', 'raw_data_folder', '*.csv.gz'):
+            df = handed_over[1] if (handed_over is not None) and (handed_over[0] == filename) else None
+            tech_filter.main('GDELT', filename, None, save_option, df=df, settings=settings)
+
+    def gdelt_dimensions(upstream):
+        import gdelt_append
+        gdelt_append.main(settings['GDRIVE.FOLDER_IDS']['gdelt_data'], save_option, settings=settings)
+
+    ### Lens ###
+    def lens_patents_ingest(upstream):
+        import lens_patent_ingestion
+        from src.watermark import WatermarkStore
+        lens_patent_ingestion.set_config()
+        # the pipeline's save option replaces the save_data default set by set_config()
+        lens_patent_ingestion.set_save_option(save_option)
+        store = WatermarkStore('patents')
+        start_d, end_d = store.resume_range(after, str(date.today()))
+        return lens_patent_ingestion.ingest_patents(start_d, end_d, store)
+
+    def lens_journals_ingest(upstream):
+        import lens_journal_ingestion
+        from src.watermark import WatermarkStore
+        lens_journal_ingestion.search_url = settings['LENS_API.JOURNALS']['scholarly_search']
+        lens_journal_ingestion.save_to = save_option
+        store = WatermarkStore('journals')
+        start_d, end_d = store.resume_range(after, str(date.today()))
+        return lens_journal_ingestion.ingest_journals(start_d, end_d, store)
+
+    def patents_clean(upstream):
+        import patent_cleaning
+        patent_cleaning.main(save_option)
+
+    def journals_clean(upstream):
+        import journal_cleaning
+        journal_cleaning.main(save_option)
+
+    def patents_filter(upstream):
+        import tech_filter
+        for filename in unfiltered_files(settings, 'LENS_API.PATENTS', 'processed_data_folder', '*_data.parquet'):
+            tech_filter.main('LENS_API.PATENTS', filename, None, save_option, settings=settings)
+
+    def journals_filter(upstream):
+        import tech_filter
+        for filename in unfiltered_files(settings, 'LENS_API.JOURNALS', 'processed_data_folder', '*.parquet'):
+            tech_filter.main('LENS_API.JOURNALS', filename, None, save_option, settings=settings)
+
+    ### Organisations ###
+    def organisations(upstream):
+        import entity_resolution
+        entity_resolution.main(['GDELT', 'LENS_API.PATENTS', 'LENS_API.JOURNALS'], save_option, settings=settings)
+
+    ### Topic modelling ###
+    def topics(upstream):
+        import topic_modelling
+        topic_modelling.main(topic_sources, save_option, topic_mode, settings=settings)
+
+    def folder(root, source, pattern='*'):
+        return os.path.join(root, settings[source]['subfolder'], pattern)
+
+    filter_stages = {'GDELT': 'gdelt_filter', 'LENS_API.PATENTS': 'patents_filter', 'LENS_API.JOURNALS': 'journals_filter'}
+    return [Stage('gdelt_ingestion', gdelt_ingest, code=['gdelt_ingestion.py'], config_sections=['GDELT'],
+                  params={'after': after, 'before': before}),
+            Stage('gdelt_syndication', gdelt_syndication_index, deps=['gdelt_ingestion'], inputs=[folder(raw, 'GDELT', '*.csv.gz')],
+                  code=['gdelt_syndication.py', 'src/syndication.py'], config_sections=['SYNDICATION']),
+            # filtering drops the syndicated copies found by gdelt_syndication
+            Stage('gdelt_filter', gdelt_filter, deps=['gdelt_ingestion', 'gdelt_syndication'], inputs=[folder(raw, 'GDELT')], code=filter_code,
+                  config_sections=['GDELT', 'SYNDICATION']),
+            Stage('gdelt_append', gdelt_dimensions, deps=['gdelt_filter'], inputs=[folder(filtered, 'GDELT', '*_filtered.csv')],
+                  code=['gdelt_append.py'], config_sections=['GDELT']),
+            # Lens ingestion is incremental from the watermark, so it runs at most once a day
+            Stage('patents_ingestion', lens_patents_ingest, code=['lens_patent_ingestion.py'],
+                  config_sections=['LENS_API', 'LENS_API.PATENTS'], params={'after': after, 'day': str(date.today())}),
+            Stage('patents_cleaning', patents_clean, deps=['patents_ingestion'], inputs=[folder(raw, 'LENS_API.PATENTS')],
+                  code=['patent_cleaning.py']),
+            Stage('patents_filter', patents_filter, deps=['patents_cleaning'], inputs=[folder(processed, 'LENS_API.PATENTS', '*_data.parquet')],
+                  code=filter_code),
+            Stage('journals_ingestion', lens_journals_ingest, code=['lens_journal_ingestion.py'],
+                  config_sections=['LENS_API', 'LENS_API.JOURNALS'], params={'after': after, 'day': str(date.today())}),
+            Stage('journals_cleaning', journals_clean, deps=['journals_ingestion'], inputs=[folder(raw, 'LENS_API.JOURNALS')],
+                  code=['journal_cleaning.py', 'src/author_info.py']),
+            Stage('journals_filter', journals_filter, deps=['journals_cleaning'], inputs=[folder(processed, 'LENS_API.JOURNALS', '*.parquet')],
+                  code=filter_code),
+            Stage('entity_resolution', organisations, deps=['gdelt_filter', 'patents_cleaning', 'journals_cleaning'],
+                  inputs=[folder(filtered, 'GDELT', '*_filtered.csv'), folder(processed, 'LENS_API.PATENTS', '*_applicants.parquet'),
+                          folder(processed, 'LENS_API.JOURNALS', '*.parquet')],
+                  code=['entity_resolution.py', 'src/entity_resolution.py'], config_sections=['ENTITY_RESOLUTION']),
+            # runs on its own because the embedding engine forks worker processes
+            Stage('topic_modelling', topics, deps=[filter_stages[source] for source in topic_sources],
+                  inputs=[folder(filtered, source) for source in topic_sources], code=['topic_modelling.py'],
+                  config_sections=['TOPIC_MODELLING'], params={'sources': topic_sources, 'mode': topic_mode}, exclusive=True)]
+
+### MAIN PROGRAM ###
+def main(after, before, stages=None, force=False, workers=4, save_option=None, topic_sources=None, topic_mode='fit'):
+    # import libraries
+    import configparser
+    from src import storage
+    from src.pipeline import Pipeline
+    # get config settings once for every stage
+    config_file = '../config.ini'
+    settings = configparser.ConfigParser(inline_comment_prefixes="#")
+    settings.read(config_file)
+
+    pipeline = Pipeline(define_stages(settings, after, before, save_option, topic_sources or ['LENS_API.PATENTS', 'LENS_API.JOURNALS'], topic_mode),
+                        settings, max_workers=workers)
+    status = pipeline.run(stages, force=force)
+    # wait for the background uploads of every stage, see src.storage
+    failed_uploads = storage.flush()
+    print('== Pipeline summary ==')
+    for name, result in status.items():
+        print(f'{name}: {result}')
+    # outputs that only exist locally fail the run, so it is not mistaken for a complete one
+    if failed_uploads:
+        raise RuntimeError(f'{failed_uploads} uploads failed, see the errors above')
+    return status
+
+### SCRIPT TO RUN WHEN CALLED STANDALONE ###
+if __name__=='__main__':
+    # input arguments
+    import argparse
+    from gdelt_ingestion import get_month
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--after', help='date input in the format YYYY-MM-DD, defaults to the start of last month')
+    parser.add_argument('--before', help='date input in the format YYYY-MM-DD, defaults to the end of last month')
+    parser.add_argument('--stages', nargs='+', default=None, help='run only these stages and the stages they depend on')
+    parser.add_argument('--force', action='store_true', help='run stages even if their inputs, code and config are unchanged')
+    parser.add_argument('--workers', default=4, type=int, help='most stages to run at once')
+    parser.add_argument('--save', default=None, type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
+    parser.add_argument('--topic_source', nargs='+', default=None, choices=['GDELT', 'LENS_API.PATENTS', 'LENS_API.JOURNALS'], help='sources to topic model, defaults to patents and journals')
+    parser.add_argument('--topic_mode', default='fit', choices=['fit', 'sample', 'incremental'], help='see topic_modelling.py')
+    args = parser.parse_args()
+    if (args.after is None) != (args.before is None):
+        parser.error('--after and --before must be used together')
+    after, before = (args.after, args.before) if args.after is not None else get_month()
+
+    # run main
+    from src.metrics import run_metrics
+    with run_metrics('pipeline'):
+        main(after, before, args.stages, args.force, args.workers, args.save, args.topic_source, args.topic_mode)
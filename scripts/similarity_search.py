@@ -0,0 +1,96 @@
+### SUB-FUNCTIONS ###
+def open_index(settings, source):
+    # opens the nearest-neighbour index of one corpus, see src.ann_index.NeighbourIndex
+    import os
+    from src.ann_index import NeighbourIndex
+    from topic_modelling import define_corpora
+    folder = os.path.join(settings['SIMILARITY_SEARCH']['index_folder'], define_corpora()[source]['name'])
+    return NeighbourIndex(folder, M=int(settings['SIMILARITY_SEARCH']['hnsw_m']),
+                          ef_construction=int(settings['SIMILARITY_SEARCH']['hnsw_ef_construction']),
+                          ef=int(settings['SIMILARITY_SEARCH']['hnsw_ef_search']))
+
+def create_embedding_engine(settings, workers=None):
+    from src.embedding_engine import EmbeddingEngine
+    return EmbeddingEngine(settings['TOPIC_MODELLING']['embedding_model'],
+                           workers=int(settings['TOPIC_MODELLING']['embedding_workers']) if workers is None else workers,
+                           batch_size=int(settings['TOPIC_MODELLING']['embedding_batch_size']),
+                           backend=settings['TOPIC_MODELLING']['embedding_backend'])
+
+def build_index(settings, source, embedding_engine, embedding_cache):
+    # adds documents that are not indexed yet, embeddings come from the shared cache so only new texts are encoded
+    from topic_modelling import define_corpora
+    corpus = define_corpora()[source]
+    joined_df = corpus['loader'](settings)
+    index = open_index(settings, source)
+    new_df = joined_df.loc[~joined_df.index.astype(str).isin(index.labels)]
+    print(f"{len(new_df)} new documents to index for {corpus['name']} ({len(index)} indexed)")
+    if len(new_df) == 0:
+        return
+    embeddings = embedding_cache.encode(new_df[corpus['text']].astype('str').to_list(), embedding_engine.encode)
+    index.add(new_df.index.astype(str).to_list(), embeddings)
+    index.save()
+
+### MAIN PROGRAM ###
+def main(command, sources, text=None, doc_id=None, k=10):
+    # import libraries
+    import time
+    import configparser
+    from src.embedding_cache import EmbeddingCache
+    # get config settings
+    config_file = '../config.ini'
+    settings = configparser.ConfigParser(inline_comment_prefixes="#")
+    settings.read(config_file)
+    model_name = settings['TOPIC_MODELLING']['embedding_model']
+    embedding_cache = EmbeddingCache(settings['TOPIC_MODELLING']['embedding_cache'], model_name, settings['TOPIC_MODELLING']['embedding_dtype'],
+                                     backend=settings['TOPIC_MODELLING']['embedding_backend'])
+
+    ### Build or update the indexes ###
+    if command == 'build':
+        embedding_engine = create_embedding_engine(settings)
+        for source in sources:
+            build_index(settings, source, embedding_engine, embedding_cache)
+        return
+
+    ### Query ###
+    indexes = {source: open_index(settings, source) for source in sources}
+    if doc_id is not None:
+        # use the stored vector of an indexed document
+        query_vector = next((index.vector(doc_id) for index in indexes.values() if doc_id in index), None)
+        if query_vector is None:
+            print(f'{doc_id} is not in the {", ".join(sources)} index')
+            return
+    else:
+        # ad hoc query texts are read from the cache but never added to it, the cache is shared with topic modelling
+        query_vector = embedding_cache.get(text)
+        if query_vector is None:
+            query_vector = create_embedding_engine(settings, workers=1).encode([text])[0]
+
+    start = time.perf_counter()
+    results = []
+    for source, index in indexes.items():
+        # over-fetch by one so the query document itself can be dropped
+        results += [(source, result_id, similarity) for result_id, similarity in index.query(query_vector[None, :], k + 1)[0] if result_id != doc_id]
+    results = sorted(results, key=lambda result: result[2], reverse=True)[:k]
+    print(f'Search took {(time.perf_counter() - start) * 1000:.1f} ms')
+    for source, result_id, similarity in results:
+        print(f'{similarity:.3f}  {source}  {result_id}')
+    return results
+
+### SCRIPT TO RUN WHEN CALLED STANDALONE ###
+if __name__=='__main__':
+    # input arguments
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build', 'query'], help='build adds new documents to the indexes, query finds similar documents')
+    parser.add_argument('--source', nargs='+', default=['LENS_API.PATENTS', 'LENS_API.JOURNALS'], choices=['GDELT', 'LENS_API.PATENTS', 'LENS_API.JOURNALS'], help='indexes to build or search')
+    parser.add_argument('--text', default=None, help='find documents similar to this text')
+    parser.add_argument('--id', default=None, help='find documents similar to this indexed document, e.g. a lens_id')
+    parser.add_argument('-k', default=10, type=int, help='number of results')
+    args = parser.parse_args()
+    if (args.command == 'query') and ((args.text is None) == (args.id is None)):
+        parser.error('query requires one of --text or --id')
+
+    # run main
+    from src.metrics import run_metrics
+    with run_metrics('similarity_search'):
+        main(args.command, args.source, args.text, args.id, args.k)
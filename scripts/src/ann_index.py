@@ -0,0 +1,118 @@
+import os
+import json
+import numpy as np
+from src import schemas
+
+class NeighbourIndex:
+    """Persisted HNSW index for cosine nearest-neighbour search over document embeddings (requires hnswlib).
+
+    Documents are identified by their id (e.g. lens_id). Integer labels in the index are positions in the
+    list of ids, which is stored next to the index and only ever appended to, so new documents can be
+    added without rebuilding.
+
+    Args:
+        folder (str): folder holding the index files, created if missing.
+        M (int): HNSW graph degree, higher is more accurate and uses more memory.
+        ef_construction (int): candidate list size while inserting.
+        ef (int): candidate list size while searching, must be at least the number of neighbours returned.
+
+    Files:
+        meta.json: dimension of the vectors.
+        index.bin: hnswlib index.
+        ids.txt: document id of each label, one per line.
+    """
+    def __init__(self, folder, M=16, ef_construction=200, ef=64):
+        self.folder = folder
+        self.index_path = os.path.join(folder, 'index.bin')
+        self.ids_path = os.path.join(folder, 'ids.txt')
+        self.meta_path = os.path.join(folder, 'meta.json')
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.index = None
+        self.ids = []
+        os.makedirs(folder, exist_ok=True)
+        if os.path.isfile(self.meta_path) and os.path.isfile(self.ids_path):
+            self.load()
+        self.labels = {doc_id: label for label, doc_id in enumerate(self.ids)}
+
+    def load(self):
+        import hnswlib
+        with open(self.ids_path, 'r', encoding='utf-8') as f:
+            self.ids = f.read().splitlines()
+        with open(self.meta_path, 'r') as f:
+            meta = json.load(f)
+        self.index = hnswlib.Index(space='cosine', dim=meta['dim'])
+        self.index.load_index(self.index_path, max_elements=len(self.ids))
+        self.index.set_ef(self.ef)
+
+    def save(self):
+        # the index is written before the ids, so every listed id has a saved vector. Vectors left without an id
+        # by an interruption are never returned and are overwritten by the next add
+        self.index.save_index(self.index_path)
+        with open(self.meta_path, 'w') as f:
+            json.dump({'dim': self.index.dim}, f)
+        with schemas.atomic_write(self.ids_path, encoding='utf-8') as f:
+            f.write(''.join(doc_id + '\n' for doc_id in self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.labels
+
+    def add(self, ids, embeddings):
+        """Adds documents that are not in the index yet.
+
+        Args:
+            ids (list[str]): document ids.
+            embeddings (np.ndarray): one row per id.
+        Returns:
+            Number of documents added.
+        """
+        import hnswlib
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        new_rows, seen = [], set()
+        for i, doc_id in enumerate(ids):
+            doc_id = str(doc_id)
+            if (doc_id not in self.labels) and (doc_id not in seen):
+                new_rows.append(i)
+                seen.add(doc_id)
+        if not new_rows:
+            return 0
+
+        if self.index is None:
+            self.index = hnswlib.Index(space='cosine', dim=embeddings.shape[1])
+            self.index.init_index(max_elements=len(new_rows), ef_construction=self.ef_construction, M=self.M)
+            self.index.set_ef(self.ef)
+        elif self.index.get_max_elements() < len(self.ids) + len(new_rows):
+            self.index.resize_index(len(self.ids) + len(new_rows))
+        labels = np.arange(len(self.ids), len(self.ids) + len(new_rows))
+        self.index.add_items(embeddings[new_rows], labels)
+        for i in new_rows:
+            self.labels[str(ids[i])] = len(self.ids)
+            self.ids.append(str(ids[i]))
+        return len(new_rows)
+
+    def vector(self, doc_id):
+        """Returns the stored embedding of a document, or None if it is not indexed."""
+        if doc_id not in self.labels:
+            return None
+        return np.asarray(self.index.get_items([self.labels[doc_id]]), dtype=np.float32)[0]
+
+    def query(self, embeddings, k=10):
+        """Finds the nearest documents to each query embedding.
+
+        Args:
+            embeddings (np.ndarray): one query per row.
+            k (int): number of neighbours per query.
+        Returns:
+            List with one list of (doc_id, cosine similarity) tuples per query, most similar first.
+        """
+        if not self.ids:
+            return [[] for _ in range(len(embeddings))]
+        k = min(k, len(self.ids))
+        self.index.set_ef(max(self.ef, k))
+        labels, distances = self.index.knn_query(np.asarray(embeddings, dtype=np.float32), k=k)
+        return [[(self.ids[label], float(1 - distance)) for label, distance in zip(row_labels, row_distances) if label < len(self.ids)]
+                for row_labels, row_distances in zip(labels, distances)]
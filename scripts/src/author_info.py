@@ -1,24 +1,48 @@
-import json
+import functools
 import pycountry
 import pandas as pd
 
-# Define a function to extract and format the author name
-def extract_author_info(row):
-    authors = row['authors']
-    
-    if isinstance(authors, list) and len(authors) > 0:
-        last_author = authors[-1]
-        first_name = last_author.get('first_name', '')
-        last_name = last_author.get('last_name', '')
-        affiliations = last_author.get('affiliations', [])
-        
-        if affiliations:
-            institution = affiliations[0].get('name', '')
-            country_code = affiliations[0].get('country_code', '')
-            try:
-                country_name = pycountry.countries.get(alpha_2=country_code).name
-            except AttributeError:
-                country_name = ''
-            return f"{first_name} {last_name}", institution, country_name
-        
-    return '', '', ''
\ No newline at end of file
+@functools.lru_cache(maxsize=None)
+def lookup_country_name(country_code):
+    # pycountry name of an ISO alpha-2 code, cached so each code is only resolved once
+    try:
+        return pycountry.countries.get(alpha_2=country_code).name
+    except (AttributeError, LookupError):
+        return ''
+
+def extract_author_columns(authors, country_names=None):
+    """Extracts the last author, their first institution and country from a column of Lens 'authors' lists.
+
+    Args:
+        authors (pd.Series): column of lists of author dicts, as returned by the Lens scholarly API.
+        country_names (dict): optional country code to country name lookup, codes missing from it are looked up
+            in pycountry. Defaults to the pycountry names.
+    Returns:
+        DataFrame with 'author', 'institution', 'country_code' and 'country' columns, aligned to the input index.
+        Records without authors or affiliations get empty strings.
+    """
+    if country_names is None:
+        country_names = {}
+
+    # single pass over the nested lists, collecting plain python lists for each output column
+    names, institutions, codes = [], [], []
+    for record in authors.to_list():
+        name, institution, code = '', '', ''
+        if isinstance(record, list) and len(record) > 0:
+            last_author = record[-1]
+            affiliations = last_author.get('affiliations') or []
+            if affiliations:
+                name = f"{last_author.get('first_name', '')} {last_author.get('last_name', '')}"
+                institution = affiliations[0].get('name', '')
+                code = affiliations[0].get('country_code', '') or ''
+        names.append(name)
+        institutions.append(institution)
+        codes.append(code)
+
+    df = pd.DataFrame({'author': names, 'institution': institutions, 'country_code': codes}, index=authors.index)
+
+    # resolve country names once per unique code rather than once per record
+    unique_names = {code: country_names.get(code) or (lookup_country_name(code) if code else '') for code in df['country_code'].unique()}
+    df['country'] = df['country_code'].map(unique_names)
+
+    return df
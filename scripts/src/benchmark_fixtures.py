@@ -0,0 +1,144 @@
+import os
+import gzip
+import json
+import zipfile
+import threading
+import functools
+from datetime import timedelta
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# text that matches each technology in regex_terms.ini, mixed into a share of the generated records
+TECH_PHRASES = ['quantum computing', 'semiconductor wafer', 'cultured meat', 'green hydrogen', 'precision medicine']
+WORDS = ['method', 'system', 'apparatus', 'device', 'process', 'composition', 'control', 'network', 'sensor', 'module',
+         'energy', 'signal', 'data', 'material', 'layer', 'structure', 'assembly', 'vehicle', 'battery', 'circuit',
+         'protein', 'cell', 'treatment', 'patient', 'analysis', 'production', 'storage', 'transport', 'market', 'policy',
+         'government', 'investment', 'research', 'university', 'company', 'industry', 'growth', 'report', 'launch', 'plant']
+COUNTRIES = [('Australia', 'AS', 'AU', -25.0, 135.0), ('United States', 'US', 'US', 39.8, -98.5), ('United Kingdom', 'UK', 'GB', 54.0, -2.0),
+             ('Germany', 'GM', 'DE', 51.0, 9.0), ('China', 'CH', 'CN', 35.0, 105.0), ('Japan', 'JA', 'JP', 36.0, 138.0),
+             ('South Korea', 'KS', 'KR', 37.0, 127.5), ('India', 'IN', 'IN', 20.0, 77.0)]
+ORGANISATIONS = ['University Of Sydney', 'Intel', 'Samsung Electronics', 'Siemens', 'Csiro', 'Ibm', 'Toyota Motor',
+                 'Massachusetts Institute Of Technology', 'Upside Foods', 'Fortescue']
+PERSONS = ['Alex Morgan', 'Sam Lee', 'Jordan Smith', 'Taylor Chen', 'Casey Patel', 'Robin Nguyen']
+DOMAINS = ['abc.net.au', 'reuters.com', 'bbc.co.uk', 'smh.com.au', 'theguardian.com', 'nytimes.com', 'ft.com', 'afr.com']
+
+def make_text(rng, n_words, tech_rate):
+    words = list(rng.choice(WORDS, size=n_words))
+    if rng.random() < tech_rate:
+        words.insert(int(rng.integers(0, n_words)), str(rng.choice(TECH_PHRASES)))
+    return ' '.join(words)
+
+def gkg_record(rng, record_id, timestamp, tech_rate):
+    """Returns one GKG 2.1 record as a list of the 27 tab-separated fields."""
+    title = make_text(rng, int(rng.integers(5, 12)), tech_rate)
+    domain = str(rng.choice(DOMAINS))
+    locations, counts = [], []
+    for name, fips, _, lat, lon in [COUNTRIES[i] for i in rng.choice(len(COUNTRIES), size=int(rng.integers(1, 4)), replace=False)]:
+        lat, lon = lat + rng.normal(0, 2), lon + rng.normal(0, 2)
+        offset = int(rng.integers(1, 3000))
+        locations.append(f'1#{name}#{fips}#{fips}##{lat:.4f}#{lon:.4f}#{fips}#{offset}#')
+        counts.append(f'KILL#{int(rng.integers(1, 50))}#people#1#{name}#{fips}#{fips}#{lat:.4f}#{lon:.4f}#{fips}#{offset}')
+    orgs = ';'.join(f'{org},{int(rng.integers(1, 3000))}' for org in rng.choice(ORGANISATIONS, size=int(rng.integers(0, 4)), replace=False))
+    persons = ';'.join(f'{person},{int(rng.integers(1, 3000))}' for person in rng.choice(PERSONS, size=int(rng.integers(0, 3)), replace=False))
+    tone = rng.normal(0, 3, size=3)
+    v2tone = f'{tone[0]:.4f},{abs(tone[1]):.4f},{abs(tone[2]):.4f},{abs(tone[1]) + abs(tone[2]):.4f},{rng.uniform(5, 30):.4f},{rng.uniform(0, 3):.4f},{int(rng.integers(100, 2000))}'
+    quote = make_text(rng, int(rng.integers(6, 15)), tech_rate)
+    url = f'https://www.{domain}/news/{timestamp:%Y/%m/%d}/{"-".join(title.split()[:6])}-{record_id}'
+    return [f'{timestamp:%Y%m%d%H%M%S}-{record_id}', f'{timestamp:%Y%m%d%H%M%S}', '1', domain, url,
+            ';'.join(c[:c.rfind('#')] for c in counts) + ';', ';'.join(counts) + ';', '', '', '', ';'.join(locations),
+            '', persons, '', orgs, v2tone, '', '', '', '', '', '',
+            f'{int(rng.integers(1, 3000))}|{len(quote)}||{quote}', ';'.join(filter(None, [persons, orgs])),
+            f'{int(rng.integers(1, 100))},people,{int(rng.integers(1, 3000))};', '', f'<PAGE_TITLE>{title}</PAGE_TITLE>']
+
+def syndicated_copy(rng, record, record_id, timestamp):
+    # the same article republished by another domain, under its own ID, date and URL
+    domain = str(rng.choice(DOMAINS))
+    return [f'{timestamp:%Y%m%d%H%M%S}-{record_id}', f'{timestamp:%Y%m%d%H%M%S}', '1', domain,
+            f'https://www.{domain}/{record[4].split("/", 3)[-1]}'] + record[5:]
+
+def write_gkg_files(folder, rng, n_files, records_per_file, start, tech_rate=0.3, syndication_rate=0.2):
+    """Writes zipped GKG files named like the GDELT originals, one per 15 minutes from start.
+
+    A share of the records are syndicated copies of earlier records, in the same or an earlier file.
+
+    Returns:
+        List of (filename, timestamp, size) tuples.
+    """
+    os.makedirs(folder, exist_ok=True)
+    files, records = [], []
+    for i in range(n_files):
+        timestamp = start + timedelta(minutes=15 * (i + 1))
+        for j in range(records_per_file):
+            record_id = i * records_per_file + j
+            if records and (rng.random() < syndication_rate):
+                records.append(syndicated_copy(rng, records[int(rng.integers(0, len(records)))], record_id, timestamp))
+            else:
+                records.append(gkg_record(rng, record_id, timestamp, tech_rate))
+        rows = ['\t'.join(record) for record in records[-records_per_file:]]
+        filename = f'{timestamp:%Y%m%d%H%M%S}.gkg.csv.zip'
+        with zipfile.ZipFile(os.path.join(folder, filename), 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr(filename[:-4], '\n'.join(rows) + '\n')
+        files.append((filename, timestamp, os.path.getsize(os.path.join(folder, filename))))
+    return files
+
+def write_master_list(filepath, files, base_url):
+    # same columns as gdelt_ingestion.update_master_file() saves
+    import pandas as pd
+    pd.DataFrame({'size': [size for _, _, size in files], 'hash': ['0' * 32] * len(files),
+                  'url': [f'{base_url}/{filename}' for filename, _, _ in files], 'type': ['gkg'] * len(files),
+                  'datetime_str': [f'{timestamp:%Y%m%d%H%M%S}' for _, timestamp, _ in files],
+                  'datetime': [timestamp for _, timestamp, _ in files]}).to_csv(filepath, index=None)
+
+def patent_record(rng, i, published, tech_rate):
+    country = COUNTRIES[int(rng.integers(0, len(COUNTRIES)))]
+    return {'lens_id': f'{i:03d}-{int(rng.integers(0, 999)):03d}-{int(rng.integers(0, 999)):03d}-{int(rng.integers(0, 999)):03d}-{int(rng.integers(0, 999)):03d}',
+            'jurisdiction': str(rng.choice(['US', 'AU'])), 'doc_key': f'US_{10000000 + i}_B2_{published:%Y%m%d}',
+            'date_published': f'{published:%Y-%m-%d}', 'publication_type': 'GRANTED_PATENT',
+            'biblio': {'invention_title': [{'text': make_text(rng, int(rng.integers(4, 10)), tech_rate), 'lang': 'en'}],
+                       'parties': {'applicants': [{'residence': country[2], 'extracted_name': {'value': str(rng.choice(ORGANISATIONS)).upper()}}],
+                                   'inventors': [{'residence': country[2], 'extracted_name': {'value': str(rng.choice(PERSONS))}}]},
+                       'classifications_cpc': {'classifications': [{'symbol': f'H01L{int(rng.integers(1, 99))}/{int(rng.integers(1, 999))}'}]}},
+            'abstract': [{'text': make_text(rng, int(rng.integers(30, 80)), tech_rate), 'lang': 'en'}]}
+
+def journal_record(rng, i, published, tech_rate):
+    country = COUNTRIES[int(rng.integers(0, len(COUNTRIES)))]
+    return {'lens_id': f'{i:03d}-{int(rng.integers(0, 999)):03d}-{int(rng.integers(0, 999)):03d}-{int(rng.integers(0, 999)):03d}-{int(rng.integers(0, 999)):03d}',
+            'title': make_text(rng, int(rng.integers(6, 14)), tech_rate), 'abstract': make_text(rng, int(rng.integers(80, 200)), tech_rate),
+            'date_published': f'{published:%Y-%m-%d}', 'fields_of_study': list(rng.choice(WORDS, size=2)), 'keywords': list(rng.choice(WORDS, size=3)),
+            'authors': [{'first_name': 'Sam', 'last_name': str(rng.choice(PERSONS)).split()[1],
+                         'affiliations': [{'name': str(rng.choice(ORGANISATIONS)), 'country_code': country[2]}]}]}
+
+def write_lens_pages(folder, prefix, make_record, rng, n_pages, records_per_page, start, end, tech_rate=0.3, fmt='jsonl.gz'):
+    """Writes raw Lens pages the way the ingestion scripts save them.
+
+    Args:
+        fmt (str): 'jsonl.gz' for one record per line, or 'json' for a full response body with a 'data' list.
+    Returns:
+        Number of records written.
+    """
+    os.makedirs(folder, exist_ok=True)
+    days = max((end - start).days, 1)
+    for page in range(n_pages):
+        records = [make_record(rng, page * records_per_page + i, start + timedelta(days=int(rng.integers(0, days))), tech_rate)
+                   for i in range(records_per_page)]
+        filepath = os.path.join(folder, f'{prefix}_{start:%Y-%m-%d}_to_{end:%Y-%m-%d}_from_{page * records_per_page}.{fmt}')
+        if fmt == 'json':
+            with open(filepath, 'w') as f:
+                json.dump({'total': n_pages * records_per_page, 'data': records}, f)
+        else:
+            with gzip.open(filepath, 'wt', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record) + '\n' for record in records))
+    return n_pages * records_per_page
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_folder(folder):
+    """Serves a folder over HTTP on a free local port from a background thread.
+
+    Returns:
+        Tuple of (server, base_url). Call server.shutdown() when done.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
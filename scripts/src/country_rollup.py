@@ -0,0 +1,88 @@
+import os
+import json
+import functools
+import numpy as np
+import pandas as pd
+
+@functools.lru_cache(maxsize=None)
+def load_fips_codes(filepath='../data/meta/fips_country_codes.csv'):
+    """Reads the lookup of FIPS 10-4 country codes, used by GDELT locations, to ISO alpha-2 codes.
+
+    Returns:
+        Dictionary of FIPS code to ISO alpha-2 code.
+    """
+    # keep_default_na stops Namibia's 'NA' being read as missing
+    df = pd.read_csv(filepath, keep_default_na=False)
+    return dict(zip(df['fips'], df['code_iso2']))
+
+@functools.lru_cache(maxsize=None)
+def load_gdp(filepath='../data/meta/country_code_gdp.csv'):
+    """Reads GDP in billion USD per country and year.
+
+    Returns:
+        pd.DataFrame with code_iso2, year and gdp_billion_usd columns. Missing values, saved as 0, are dropped.
+    """
+    df = pd.read_csv(filepath, keep_default_na=False)
+    years = [col for col in df.columns if col.isdigit()]
+    gdp_df = df.melt(id_vars='code_iso2', value_vars=years, var_name='year', value_name='gdp_billion_usd')
+    gdp_df['year'] = gdp_df['year'].astype(np.int64)
+    gdp_df['gdp_billion_usd'] = pd.to_numeric(gdp_df['gdp_billion_usd'], errors='coerce')
+    return gdp_df.loc[(gdp_df['code_iso2'] != '') & (gdp_df['gdp_billion_usd'] > 0)].reset_index(drop=True)
+
+def country_counts(df, key, country_col, date_col, tech_cols):
+    """Counts records per technology, country and month.
+
+    A record is counted once for each country it names and each technology it matches.
+
+    Args:
+        df (pd.DataFrame): one row per record and country, with the technology match columns.
+        key (str): record ID column.
+        country_col (str): ISO alpha-2 country code column, empty or missing codes are dropped.
+        date_col (str): publication date column.
+        tech_cols (list[str]): boolean technology match columns.
+    Returns:
+        pd.DataFrame with tech, country_code, month and count columns.
+    """
+    df = df[[key, country_col, date_col] + tech_cols].dropna(subset=[country_col])
+    df = df.loc[df[country_col].astype(str).str.len() > 0].drop_duplicates(subset=[key, country_col])
+    df = df.assign(month=pd.to_datetime(df[date_col], errors='coerce').dt.to_period('M').dt.to_timestamp())
+    long_df = df.melt(id_vars=[country_col, 'month'], value_vars=tech_cols, var_name='tech', value_name='match')
+    long_df = long_df.loc[long_df['match'].astype(bool)].rename(columns={country_col: 'country_code'})
+    return long_df.groupby(['tech', 'country_code', 'month'], observed=True).size().rename('count').reset_index()
+
+def add_gdp(rollup_df, gdp_df):
+    # GDP of the country in the year of each month, the nearest year with data where that year has none
+    # merge_asof needs the country codes in the same dtype on both sides, rollups hold them as categoricals
+    rollup_df = rollup_df.assign(year=rollup_df['month'].dt.year.astype(np.int64),
+                                 country_code=rollup_df['country_code'].astype(gdp_df['code_iso2'].dtype)).sort_values('year')
+    rollup_df = pd.merge_asof(rollup_df, gdp_df.sort_values('year'), on='year', left_by='country_code', right_by='code_iso2', direction='nearest')
+    rollup_df['count_per_billion_gdp'] = rollup_df['count'] / rollup_df['gdp_billion_usd']
+    return rollup_df.drop(columns=['year', 'code_iso2'])
+
+def merge_rollup(counts_df, filepath, batch):
+    """Adds the counts of a new batch to a saved rollup and updates its GDP-normalised measures.
+
+    Existing counts are summed with the new ones rather than recomputed from the source data. The names of
+    the batches already added are kept in the file, so adding the same batch twice changes nothing.
+
+    Args:
+        counts_df (pd.DataFrame): output of country_counts().
+        filepath (str): Parquet rollup to update.
+        batch (str): name of the batch, e.g. the input file name.
+    Returns:
+        Number of rows in the rollup, or None if the batch was already added.
+    """
+    import pyarrow.parquet as pq
+    from src import schemas
+    batches = []
+    if os.path.isfile(filepath):
+        metadata = pq.read_schema(filepath).metadata or {}
+        batches = json.loads(metadata.get(b'batches', b'[]'))
+        if batch in batches:
+            print(f'{batch} is already in {filepath}, skipped')
+            return None
+        saved_df = schemas.read_parquet(filepath, 'country_rollup', columns=['tech', 'country_code', 'month', 'count'])
+        counts_df = pd.concat([saved_df.assign(month=pd.to_datetime(saved_df['month'])), counts_df], ignore_index=True)
+    rollup_df = counts_df.groupby(['tech', 'country_code', 'month'], as_index=False, observed=True)['count'].sum()
+    rollup_df = add_gdp(rollup_df, load_gdp()).sort_values(['tech', 'country_code', 'month'])
+    return schemas.write_parquet(rollup_df, filepath, 'country_rollup', metadata={'batches': json.dumps(batches + [batch])})
@@ -0,0 +1,128 @@
+import zlib
+import numpy as np
+from src.embedding_cache import normalise_text
+
+class UnionFind:
+    """Disjoint sets over the integers 0..n-1, with path halving and union by size."""
+    def __init__(self, n):
+        self.parent = np.arange(n)
+        self.size = np.ones(n, dtype=np.int64)
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return
+        if self.size[i] < self.size[j]:
+            i, j = j, i
+        self.parent[j] = i
+        self.size[i] += self.size[j]
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.parent))], dtype=np.int64)
+
+def exact_groups(texts):
+    """Groups texts that are identical after normalisation (case, unicode form and whitespace).
+
+    Args:
+        texts (list[str]): documents.
+    Returns:
+        Tuple of (representatives, groups): np.ndarray of the position of the first text of each group,
+        and np.ndarray giving the group number of every text.
+    """
+    first = {}
+    groups = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        groups[i] = first.setdefault(normalise_text(text).lower(), len(first))
+    # the first text seen in each group represents it
+    representatives = np.unique(groups, return_index=True)[1]
+    return representatives, groups
+
+def minhash_signatures(texts, num_perm=64, shingle_size=4, seed=0):
+    """Computes MinHash signatures over character shingles.
+
+    Args:
+        texts (list[str]): documents.
+        num_perm (int): number of hash functions.
+        shingle_size (int): characters per shingle.
+        seed (int): seed for the hash functions.
+    Returns:
+        uint64 np.ndarray of shape (len(texts), num_perm).
+    """
+    prime = np.uint64((1 << 61) - 1)
+    rng = np.random.default_rng(seed)
+    # coefficients below 2**29 keep a * crc32 inside 61 bits, so the products never overflow
+    a = rng.integers(1, 1 << 29, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 29, size=num_perm, dtype=np.uint64)
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        text = normalise_text(text).lower()
+        shingles = {text[j:j + shingle_size] for j in range(max(len(text) - shingle_size + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        signatures[i] = ((np.outer(hashes, a) + b) % prime).min(axis=0)
+    return signatures
+
+def lsh_rows(num_perm, threshold):
+    # picks the rows per band whose S-curve threshold (1/bands)^(1/rows) is closest to the similarity threshold
+    options = [r for r in range(1, num_perm + 1) if num_perm % r == 0]
+    return min(options, key=lambda r: abs((1 / (num_perm // r)) ** (1 / r) - threshold))
+
+def minhash_groups(texts, threshold=0.8, num_perm=64):
+    """Groups near-duplicate texts whose estimated Jaccard similarity of shingles reaches the threshold.
+
+    Candidate pairs come from locality-sensitive hashing of the signature bands, so only texts that share
+    a band are compared. Groups are closed transitively.
+
+    Args:
+        texts (list[str]): documents.
+        threshold (float): estimated Jaccard similarity at or above which two texts are merged.
+        num_perm (int): MinHash signature length.
+    Returns:
+        Tuple of (representatives, groups) as in exact_groups().
+    """
+    signatures = minhash_signatures(texts, num_perm)
+    rows = lsh_rows(num_perm, threshold)
+    union_find = UnionFind(len(texts))
+    for band in range(num_perm // rows):
+        buckets = {}
+        for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            for j in members[1:]:
+                if np.mean(signatures[members[0]] == signatures[j]) >= threshold:
+                    union_find.union(members[0], j)
+    roots = union_find.roots()
+    groups = np.unique(roots, return_inverse=True)[1]
+    representatives = np.unique(groups, return_index=True)[1]
+    return representatives, groups
+
+def collapse_duplicates(texts, method='exact', threshold=0.8, num_perm=64):
+    """Collapses duplicate texts so each distinct document is embedded and clustered once.
+
+    Args:
+        texts (list[str]): documents.
+        method (str): 'none', 'exact' for identical normalised text, or 'minhash' to also merge near-duplicates.
+        threshold (float): similarity threshold for 'minhash'.
+        num_perm (int): signature length for 'minhash'.
+    Returns:
+        Tuple of (representatives, groups): position of the first text of each group,
+        and the group number of every text. Results computed for texts[representatives] are copied back
+        to every text with results[groups].
+    """
+    if method == 'none':
+        return np.arange(len(texts)), np.arange(len(texts))
+    if method not in ('exact', 'minhash'):
+        raise ValueError(f'Unknown dedup method {method}, choose from none, exact, minhash')
+    representatives, groups = exact_groups(texts)
+    if method == 'minhash':
+        # near-duplicates are only searched among the distinct texts
+        near_representatives, near_groups = minhash_groups([texts[i] for i in representatives], threshold, num_perm)
+        representatives, groups = representatives[near_representatives], near_groups[groups]
+    print(f'Collapsed {len(texts)} texts into {len(representatives)} distinct documents')
+    return representatives, groups
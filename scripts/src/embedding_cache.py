@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+
+def normalise_text(text):
+    # unicode normalisation and collapsed whitespace, so trivially different copies share one embedding
+    return ' '.join(unicodedata.normalize('NFKC', str(text)).split())
+
+class EmbeddingCache:
+    """Persistent store of sentence embeddings keyed by a hash of (model name, backend, normalised text).
+
+    Embeddings are kept in a raw row-major array on disk and read through a memory map, with a parallel
+    file of 20-byte SHA-1 keys as the id index. New rows are only ever appended, so the cache grows with
+    the number of distinct texts and never has to be rewritten.
+
+    Args:
+        folder (str): folder holding the cache files, created if missing.
+        model_name (str): name of the sentence-transformer model, part of every key.
+        backend (str): model backend, see src.embedding_engine.load_model(). Backends give slightly different
+            vectors, so each has its own keys. Keys of the default torch backend are the model name alone, as
+            they were before backends were added.
+        dtype (str): 'float32', or 'float16' to halve the size on disk.
+
+    Files:
+        meta.json: dimension and dtype of the stored vectors.
+        vectors.bin: embeddings, one row per key.
+        keys.bin: SHA-1 digests, one per row.
+    """
+    key_size = 20
+
+    def __init__(self, folder, model_name, dtype='float32', backend='torch'):
+        self.folder = folder
+        self.model_name = model_name if backend == 'torch' else f'{model_name}|{backend}'
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(folder, 'vectors.bin')
+        self.keys_path = os.path.join(folder, 'keys.bin')
+        self.meta_path = os.path.join(folder, 'meta.json')
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+        self.dim = None
+        if os.path.isfile(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            self.dim = meta['dim']
+            self.dtype = np.dtype(meta['dtype'])
+        self.index = self.load_index()
+
+    def load_index(self):
+        if (self.dim is None) or (not os.path.isfile(self.keys_path)):
+            return {}
+        with open(self.keys_path, 'rb') as f:
+            raw = f.read()
+        # rows are written before keys, so a key without a complete row is never indexed
+        rows = os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+        n = min(len(raw) // self.key_size, rows)
+        return {raw[i * self.key_size:(i + 1) * self.key_size]: i for i in range(n)}
+
+    def key(self, text):
+        return hashlib.sha1((self.model_name + '\x00' + normalise_text(text)).encode('utf-8')).digest()
+
+    def __len__(self):
+        return len(self.index)
+
+    def vectors(self):
+        """Returns a read-only memory map of all cached embeddings."""
+        if not self.index:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(len(self.index), self.dim))
+
+    def add(self, keys, embeddings):
+        """Appends embeddings for keys that are not cached yet.
+
+        Args:
+            keys (list[bytes]): keys from key().
+            embeddings (np.ndarray): one row per key.
+        """
+        embeddings = np.asarray(embeddings)
+        with self.lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                with open(self.meta_path, 'w') as f:
+                    json.dump({'dim': self.dim, 'dtype': self.dtype.name}, f)
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f'Embedding dimension {embeddings.shape[1]} does not match the cache dimension {self.dim}')
+
+            new_rows = [i for i, key in enumerate(keys) if key not in self.index]
+            if not new_rows:
+                return
+            # truncate first to drop anything left by an interrupted write, keeping rows and keys aligned
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(len(self.index) * self.dim * self.dtype.itemsize)
+                f.write(np.ascontiguousarray(embeddings[new_rows], dtype=self.dtype).tobytes())
+            with open(self.keys_path, 'ab') as f:
+                f.truncate(len(self.index) * self.key_size)
+                f.write(b''.join(keys[i] for i in new_rows))
+            for i in new_rows:
+                self.index[keys[i]] = len(self.index)
+
+    def get(self, text):
+        """Returns the cached embedding of a text as float32, or None if it is not cached. Nothing is encoded or added."""
+        row = self.index.get(self.key(text))
+        return None if row is None else np.asarray(self.vectors()[row], dtype=np.float32)
+
+    def encode(self, texts, encode_fn):
+        """Returns embeddings for texts, only encoding texts that are not in the cache.
+
+        Args:
+            texts (list[str]): documents to embed.
+            encode_fn (callable): takes a list of texts and returns an array of embeddings,
+                e.g. SentenceTransformer.encode.
+        Returns:
+            float32 np.ndarray with one row per text, in the order of texts.
+        """
+        keys = [self.key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if (key not in self.index) and (key not in missing):
+                missing[key] = text
+        print(f'Encoding {len(missing)} of {len(texts)} texts not found in the embedding cache')
+
+        if missing:
+            self.add(list(missing.keys()), encode_fn(list(missing.values())))
+
+        rows = np.fromiter((self.index[key] for key in keys), dtype=np.int64, count=len(keys))
+        return np.asarray(self.vectors()[rows], dtype=np.float32)
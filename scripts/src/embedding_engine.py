@@ -0,0 +1,105 @@
+import multiprocessing
+import numpy as np
+
+# model shared with forked worker processes, set by the parent before the pool starts
+shared_model = None
+
+def load_model(model_name, backend='torch'):
+    """Loads a sentence-transformer model for CPU inference.
+
+    Args:
+        model_name (str): sentence-transformers model name or path.
+        backend (str): 'torch', 'int8' for dynamic int8 quantisation of the linear layers,
+            or 'onnx' (requires sentence-transformers 3.2 or later with the onnx extras).
+    Returns:
+        SentenceTransformer model.
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend == 'onnx':
+        try:
+            return SentenceTransformer(model_name, device='cpu', backend='onnx')
+        except TypeError:
+            raise ValueError('The onnx backend requires sentence-transformers 3.2 or later')
+    model = SentenceTransformer(model_name, device='cpu')
+    if backend == 'int8':
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend != 'torch':
+        raise ValueError(f'Unknown embedding backend {backend}, choose from torch, int8, onnx')
+    return model
+
+def length_batches(texts, batch_size, tokenizer=None):
+    """Groups texts into batches of similar token length so little compute is spent on padding.
+
+    Args:
+        texts (list[str]): documents to embed.
+        batch_size (int): number of texts per batch.
+        tokenizer: optional Hugging Face tokenizer used to count tokens. Without it words are counted.
+    Returns:
+        List of np.ndarray of indices into texts, one per batch, ordered from shortest to longest.
+    """
+    if tokenizer is not None:
+        lengths = [len(ids) for ids in tokenizer(texts, add_special_tokens=False, truncation=True)['input_ids']]
+    else:
+        lengths = [len(text.split()) for text in texts]
+    order = np.argsort(lengths, kind='stable')
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+def init_worker(threads):
+    # one intra-op thread per worker by default, so the pool does not oversubscribe the cores
+    import torch
+    torch.set_num_threads(threads)
+
+def encode_batch(texts):
+    return shared_model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+
+class EmbeddingEngine:
+    """CPU embedding engine that encodes length-bucketed batches across a pool of worker processes.
+
+    The model is loaded once in the parent process and shared with the workers by forking, so each worker
+    does not load its own copy from disk. Outputs are returned in the original order of the texts.
+
+    Args:
+        model_name (str): sentence-transformers model name or path.
+        workers (int): number of worker processes. With 1, or where fork is unavailable, batches are
+            encoded in the current process.
+        batch_size (int): number of texts per batch.
+        backend (str): model backend, see load_model().
+        threads_per_worker (int): torch threads used by each worker.
+    """
+    def __init__(self, model_name, workers=1, batch_size=64, backend='torch', threads_per_worker=1):
+        self.model_name = model_name
+        self.model = load_model(model_name, backend)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.threads_per_worker = threads_per_worker
+
+    def encode(self, texts):
+        """Embeds texts.
+
+        Args:
+            texts (list[str]): documents to embed.
+        Returns:
+            float32 np.ndarray with one row per text, in the order of texts.
+        """
+        global shared_model
+        texts = [str(text) for text in texts]
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        batches = length_batches(texts, self.batch_size, getattr(self.model, 'tokenizer', None))
+        batch_texts = [[texts[i] for i in batch] for batch in batches]
+        print(f'Encoding {len(texts)} texts in {len(batches)} length-sorted batches with {self.workers} workers')
+
+        shared_model = self.model
+        if (self.workers > 1) and ('fork' in multiprocessing.get_all_start_methods()):
+            with multiprocessing.get_context('fork').Pool(self.workers, initializer=init_worker, initargs=(self.threads_per_worker,)) as pool:
+                results = pool.map(encode_batch, batch_texts, chunksize=1)
+        else:
+            results = [encode_batch(batch) for batch in batch_texts]
+
+        # restore the original order
+        embeddings = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+        for batch, result in zip(batches, results):
+            embeddings[batch] = result
+        return embeddings
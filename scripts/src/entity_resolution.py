@@ -0,0 +1,212 @@
+import os
+import re
+import json
+import unicodedata
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from src import schemas
+from src.dedup import UnionFind
+
+# company forms dropped from the end of a name, so 'Intel Corp' and 'INTEL CORPORATION' share a key
+LEGAL_SUFFIXES = {'inc', 'incorporated', 'ltd', 'limited', 'llc', 'llp', 'lp', 'plc', 'corp', 'corporation', 'co', 'company',
+                  'gmbh', 'ag', 'sa', 'nv', 'bv', 'pty', 'kk', 'srl', 'spa', 'oy', 'ab', 'as'}
+ABBREVIATIONS = {'univ': 'university', 'uni': 'university', 'inst': 'institute', 'intl': 'international', 'natl': 'national',
+                 'tech': 'technology', 'dept': 'department', 'ctr': 'center', 'centre': 'center', 'lab': 'laboratory', 'labs': 'laboratories'}
+
+def organisation_key(name):
+    """Normalises an organisation name to the key it is matched on.
+
+    Lower case without accents or punctuation, common abbreviations expanded and legal forms dropped.
+    """
+    text = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii').lower()
+    # dots are dropped rather than split on, so 'S.A.' becomes 'sa'
+    text = re.sub(r'[^a-z0-9]+', ' ', text.replace('.', '').replace('&', ' and '))
+    tokens = [ABBREVIATIONS.get(token, token) for token in text.split()]
+    while len(tokens) > 1 and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+    if len(tokens) > 1 and tokens[0] == 'the':
+        tokens.pop(0)
+    return ' '.join(tokens)
+
+def ngrams(key, n=3):
+    # character n-grams with the ends padded, so short keys still have several n-grams
+    padded = f' {key} '
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+class EntityIndex:
+    """Persistent mapping of organisation names to canonical entity IDs, updated incrementally.
+
+    Names are reduced to keys with organisation_key(). A new key is only compared with keys that share one of
+    its character n-grams (the blocking index), and matches on the Jaccard similarity of their n-gram sets.
+    Matches are closed transitively, so a new key that matches two entities merges them into the one with the
+    lower ID. Keys never change entity otherwise.
+
+    Args:
+        folder (str): folder holding names.parquet (one row per key and source) and state.json.
+        threshold (float): smallest Jaccard similarity of n-gram sets for two keys to match.
+        n (int): characters per n-gram.
+        max_block_size (int): n-grams shared by more keys than this, e.g. 'uni', are too common to block on.
+    """
+    def __init__(self, folder, threshold=0.8, n=3, max_block_size=1000):
+        self.folder = folder
+        self.threshold = threshold
+        self.n = n
+        self.max_block_size = max_block_size
+        self.names_path = os.path.join(folder, 'names.parquet')
+        self.state_path = os.path.join(folder, 'state.json')
+        if os.path.isfile(self.names_path):
+            self.names_df = schemas.read_parquet(self.names_path, 'entity_names')
+        else:
+            self.names_df = schemas.cast(pd.DataFrame(columns=schemas.schema('entity_names').names), 'entity_names')
+        self.state = {'next_id': 0, 'files': {}}
+        if os.path.isfile(self.state_path):
+            with open(self.state_path, 'r') as f:
+                self.state = json.load(f)
+        # the blocking index is built once here and extended with the keys of each update
+        self.keys, self.position, self.grams, self.key_entity = [], {}, [], []
+        self.postings = defaultdict(list)
+        self.members = defaultdict(list)
+        known_df = self.names_df.drop_duplicates('key')
+        self.add_keys(known_df['key'].to_list(), known_df['entity_id'].to_numpy(dtype=np.int64).tolist())
+
+    def add_keys(self, keys, entity_ids):
+        # appends keys with their entity IDs, -1 while unresolved, to the blocking index
+        for key, entity_id in zip(keys, entity_ids):
+            i = len(self.keys)
+            self.keys.append(key)
+            self.position[key] = i
+            self.grams.append(ngrams(key, self.n))
+            for gram in self.grams[i]:
+                self.postings[gram].append(i)
+            self.key_entity.append(entity_id)
+            if entity_id >= 0:
+                self.members[entity_id].append(i)
+
+    def entities(self):
+        # entity ID of every known key
+        return pd.Series(self.key_entity, index=self.keys, dtype=np.int64)
+
+    def match(self, start):
+        """Finds the pairs of keys that match, where at least one key of each pair is new.
+
+        Args:
+            start (int): position of the first new key, the keys added by the current update.
+        Returns:
+            List of (j, i) key positions with j < i and i new.
+        """
+        pairs = []
+        for i in range(start, len(self.keys)):
+            candidates = set()
+            for gram in self.grams[i]:
+                block = self.postings[gram]
+                if len(block) <= self.max_block_size:
+                    candidates.update(block)
+            # each new pair is scored once, from its later key
+            for j in candidates:
+                if j < i:
+                    shared = len(self.grams[i] & self.grams[j])
+                    if shared / (len(self.grams[i]) + len(self.grams[j]) - shared) >= self.threshold:
+                        pairs.append((j, i))
+        return pairs
+
+    def update(self, names, source):
+        """Adds mentions of organisation names from one source, resolving new names to entities.
+
+        Args:
+            names (pd.Series): organisation names, one per mention.
+            source (str): source of the mentions, e.g. 'GDELT'.
+        Returns:
+            Number of new keys.
+        """
+        names = names.dropna().astype(str)
+        mentions_df = pd.DataFrame({'name': names.to_numpy(), 'key': [organisation_key(name) for name in names]})
+        mentions_df = mentions_df.loc[mentions_df['key'] != '']
+        # the most frequent spelling of each key in the batch names it
+        counts_df = mentions_df.groupby(['key', 'name']).size().rename('mentions').reset_index().sort_values('mentions', ascending=False)
+        batch_df = counts_df.groupby('key', as_index=False).agg(name=('name', 'first'), mentions=('mentions', 'sum'))
+
+        new_keys = [key for key in batch_df['key'] if key not in self.position]
+        merged_ids = self.resolve(new_keys)
+        batch_df = batch_df.assign(source=source, entity_id=[self.key_entity[self.position[key]] for key in batch_df['key']])
+
+        # sum the mentions of keys already seen from this source
+        names_df = self.names_df
+        if merged_ids:
+            names_df = names_df.assign(entity_id=names_df['entity_id'].astype(np.int64).replace(merged_ids))
+        names_df = pd.concat([names_df, batch_df], ignore_index=True)
+        self.names_df = names_df.groupby(['key', 'source'], as_index=False, observed=True).agg(
+            entity_id=('entity_id', 'first'), name=('name', 'first'), mentions=('mentions', 'sum'))
+        return len(new_keys)
+
+    def resolve(self, new_keys):
+        """Assigns entity IDs to new keys, merging entities that a new key links.
+
+        Only the new keys and the entities of the known keys they match are unioned, every other entity is unchanged.
+
+        Returns:
+            Dictionary of merged entity ID to the entity ID it was merged into.
+        """
+        start = len(self.keys)
+        self.add_keys(new_keys, [-1] * len(new_keys))
+        # one node per new key and per known entity a new key matches
+        nodes = {}
+        def node(i):
+            label = ('key', i) if i >= start else ('entity', self.key_entity[i])
+            return nodes.setdefault(label, len(nodes))
+        for i in range(start, len(self.keys)):
+            node(i)
+        edges = [(node(j), node(i)) for j, i in self.match(start)]
+        union_find = UnionFind(len(nodes))
+        for a, b in edges:
+            union_find.union(a, b)
+        components = defaultdict(list)
+        for label, root in zip(nodes, union_find.roots()):
+            components[root].append(label)
+
+        # each set keeps the lowest entity ID among its known keys, or gets a new one
+        merged_ids, moved = {}, 0
+        for labels in components.values():
+            known_ids = [value for kind, value in labels if kind == 'entity']
+            if known_ids:
+                entity_id = min(known_ids)
+            else:
+                entity_id = self.state['next_id']
+                self.state['next_id'] += 1
+            for kind, value in labels:
+                if kind == 'key':
+                    self.key_entity[value] = entity_id
+                    self.members[entity_id].append(value)
+                elif value != entity_id:
+                    merged_ids[value] = entity_id
+                    for j in self.members.pop(value):
+                        self.key_entity[j] = entity_id
+                        self.members[entity_id].append(j)
+                        moved += 1
+        if moved:
+            print(f'{moved} names moved to a merged entity')
+        return merged_ids
+
+    def canonical(self):
+        """Returns one row per entity and source with the entity's most mentioned name.
+
+        Returns:
+            pd.DataFrame with entity_id, name, source and mentions columns.
+        """
+        totals = self.names_df.groupby(['entity_id', 'name'])['mentions'].sum().reset_index().sort_values('mentions', ascending=False)
+        names = totals.drop_duplicates('entity_id').set_index('entity_id')['name']
+        entities_df = self.names_df.groupby(['entity_id', 'source'], as_index=False, observed=True)['mentions'].sum()
+        return entities_df.assign(name=entities_df['entity_id'].map(names))[['entity_id', 'name', 'source', 'mentions']]
+
+    def is_processed(self, source, filename):
+        return filename in self.state['files'].get(source, [])
+
+    def mark_processed(self, source, filename):
+        self.state['files'].setdefault(source, []).append(filename)
+
+    def save(self):
+        # the state is swapped in after the names, so an interruption leaves the index as it was
+        os.makedirs(self.folder, exist_ok=True)
+        with schemas.atomic_write(self.state_path) as f:
+            json.dump(self.state, f)
+            schemas.write_parquet(self.names_df, self.names_path, 'entity_names')
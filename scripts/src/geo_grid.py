@@ -0,0 +1,100 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# web mercator tiles do not reach the poles
+MAX_LATITUDE = 85.05112878
+
+def tile_xy(latitude, longitude, zoom):
+    """Maps coordinates to web mercator tile columns and rows.
+
+    Args:
+        latitude (np.ndarray): latitudes in degrees.
+        longitude (np.ndarray): longitudes in degrees.
+        zoom (int): zoom level, the world is 2^zoom tiles across.
+    Returns:
+        Tuple of (x, y) np.ndarray of int64.
+    """
+    n = 2 ** zoom
+    lat = np.radians(np.clip(latitude, -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((longitude + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+def quadkeys(x, y, zoom):
+    """Returns the quadkey of each tile, one digit per zoom level so a cell's key starts with its parent's key."""
+    if zoom == 0:
+        return np.full(len(x), '', dtype=object)
+    shifts = np.arange(zoom - 1, -1, -1)
+    digits = ((x[:, None] >> shifts) & 1) + 2 * ((y[:, None] >> shifts) & 1)
+    # one byte per digit, viewed as fixed width strings
+    chars = np.ascontiguousarray((digits + ord('0')).astype(np.uint8))
+    return chars.view(f'S{zoom}').ravel().astype(str)
+
+def cell_centres(x, y, zoom):
+    # latitude and longitude of the centre of each tile
+    n = 2 ** zoom
+    longitude = (x + 0.5) / n * 360.0 - 180.0
+    latitude = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * (y + 0.5) / n))))
+    return latitude, longitude
+
+def grid_counts(locations_df, records_df, zooms):
+    """Counts location mentions per grid cell, technology and day at each zoom level.
+
+    Args:
+        locations_df (pd.DataFrame): locations dimension from gdelt_append with record_id, latitude and longitude.
+        records_df (pd.DataFrame): records with record_id, date (GDELT YYYYMMDDHHMMSS) and technology.
+        zooms (list[int]): zoom levels to aggregate at.
+    Returns:
+        pd.DataFrame with zoom, quadkey, latitude, longitude (cell centre), technology, date, mentions and
+        records (distinct articles) columns.
+    """
+    points_df = pd.DataFrame({'record_id': locations_df['record_id'].to_numpy(),
+                              'lat': pd.to_numeric(locations_df['latitude'], errors='coerce').to_numpy(),
+                              'lon': pd.to_numeric(locations_df['longitude'], errors='coerce').to_numpy()}).dropna()
+    points_df = points_df.merge(records_df[['record_id', 'date', 'technology']], on='record_id', how='inner')
+    points_df['date'] = pd.to_datetime(points_df['date'].astype(str), format='%Y%m%d%H%M%S', errors='coerce').dt.normalize()
+    lat, lon = points_df['lat'].to_numpy(), points_df['lon'].to_numpy()
+
+    counts = []
+    for zoom in zooms:
+        x, y = tile_xy(lat, lon, zoom)
+        cells_df = points_df[['record_id', 'technology', 'date']].assign(zoom=zoom, quadkey=quadkeys(x, y, zoom))
+        grouped = cells_df.groupby(['zoom', 'quadkey', 'technology', 'date'], observed=True)
+        zoom_df = pd.concat([grouped.size().rename('mentions'), grouped['record_id'].nunique().rename('records')], axis=1).reset_index()
+        # centres come from the first point of each cell, every point in a cell shares the same tile
+        keys = pd.Series(np.arange(len(x))).groupby(cells_df['quadkey'].to_numpy()).first()
+        centre_lat, centre_lon = cell_centres(x[keys.to_numpy()], y[keys.to_numpy()], zoom)
+        centres_df = pd.DataFrame({'quadkey': keys.index, 'latitude': centre_lat, 'longitude': centre_lon})
+        counts.append(zoom_df.merge(centres_df, on='quadkey', how='left'))
+    columns = ['zoom', 'quadkey', 'latitude', 'longitude', 'technology', 'date', 'mentions', 'records']
+    return pd.concat(counts, ignore_index=True)[columns] if counts else pd.DataFrame(columns=columns)
+
+def merge_grid(counts_df, filepath, batch):
+    """Adds new counts to the saved grid, summing cells already there, and writes it with compact types.
+
+    The names of the batches already added are kept in the file, so adding the same batch twice changes nothing.
+
+    Args:
+        counts_df (pd.DataFrame): output of grid_counts().
+        filepath (str): Parquet grid to update.
+        batch (str): name of the batch, e.g. the input file names.
+    Returns:
+        Number of rows in the merged grid, or None if the batch was already added.
+    """
+    import pyarrow.parquet as pq
+    from src import schemas
+    batches = []
+    if os.path.isfile(filepath):
+        metadata = pq.read_schema(filepath).metadata or {}
+        batches = json.loads(metadata.get(b'batches', b'[]'))
+        if batch in batches:
+            print(f'{batch} is already in {filepath}, skipped')
+            return None
+        counts_df = pd.concat([schemas.read_parquet(filepath, 'gdelt_grid'), counts_df], ignore_index=True)
+    counts_df = counts_df.assign(date=pd.to_datetime(counts_df['date']), latitude=counts_df['latitude'].astype(np.float32),
+                                 longitude=counts_df['longitude'].astype(np.float32))
+    counts_df = counts_df.groupby(['zoom', 'quadkey', 'technology', 'date'], as_index=False, observed=True).agg(
+        latitude=('latitude', 'first'), longitude=('longitude', 'first'), mentions=('mentions', 'sum'), records=('records', 'sum'))
+    return schemas.write_parquet(counts_df, filepath, 'gdelt_grid', metadata={'batches': json.dumps(batches + [batch])})
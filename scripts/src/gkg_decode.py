@@ -0,0 +1,95 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from src import schemas
+
+# V2Tone holds six tone measures and the word count of the article
+TONE_FIELDS = ['tone', 'positive_score', 'negative_score', 'polarity', 'activity_reference_density', 'self_group_reference_density']
+NUMBER_PATTERN = r'^[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?$'
+
+def to_number(strings, type):
+    # casts strings to numbers, anything that is not a number becomes null instead of failing the batch
+    strings = pc.utf8_trim_whitespace(strings)
+    return pc.if_else(pc.match_substring_regex(strings, NUMBER_PATTERN), strings, pa.scalar(None, pa.string())).cast(pa.float64()).cast(type, safe=False)
+
+def split_fields(column, delimiter):
+    """Splits every value of a delimited column into its fields, all in Arrow without a Python loop.
+
+    Returns:
+        pa.ListArray of strings, one list per row and null for missing values.
+    """
+    strings = pa.array(column, type=pa.string(), from_pandas=True)
+    # string columns backed by Arrow come back chunked, the record offsets below need one contiguous array
+    if isinstance(strings, pa.ChunkedArray):
+        strings = strings.combine_chunks()
+    return pc.split_pattern(strings, delimiter)
+
+def decode_tone(column):
+    """Decodes V2Tone into typed columns.
+
+    Args:
+        column (pd.Series): V2Tone strings, e.g. '-1.9,2.1,4.0,6.1,22.3,0.4,542'.
+    Returns:
+        Dictionary of column name to pa.Array: the six tone measures and word_count, typed as in the gkg_numeric schema.
+    """
+    fields = split_fields(column, ',')
+    # rows with fewer fields are padded with nulls rather than failing list_element
+    fields = pc.if_else(pc.greater_equal(pc.list_value_length(fields), len(TONE_FIELDS) + 1), fields, pa.scalar(None, fields.type))
+    schema = schemas.schema('gkg_numeric')
+    columns = {name: to_number(pc.list_element(fields, i), schema.field(name).type) for i, name in enumerate(TONE_FIELDS)}
+    columns['word_count'] = to_number(pc.list_element(fields, len(TONE_FIELDS)), schema.field('word_count').type)
+    return columns
+
+def decode_records(column, fields):
+    """Decodes a column of ';' separated records, each a delimited tuple, into a list of structs per row.
+
+    Args:
+        column (pd.Series): e.g. V2Counts 'KILL#12#people#...#1834;AFFECT#3#...' or Amounts '50,people,1209;'.
+        fields (list[tuple]): (name, position in the tuple, Arrow type, tuple delimiter) of the struct fields.
+    Returns:
+        pa.ListArray of structs, empty lists for rows without records.
+    """
+    records = split_fields(column, ';')
+    # flatten to one row per record, dropping the empty record after the trailing ';'
+    values = pc.list_flatten(records)
+    parents = pc.list_parent_indices(records)
+    keep = pc.greater(pc.utf8_length(values), 0)
+    values, parents = values.filter(keep), parents.filter(keep)
+    struct = pa.StructArray.from_arrays([decode_field(values, position, type, delimiter) for _, position, type, delimiter in fields],
+                                        names=[name for name, _, _, _ in fields])
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(parents.to_numpy(), minlength=len(records)))]).astype(np.int32)
+    return pa.ListArray.from_arrays(pa.array(offsets), struct)
+
+def decode_field(values, position, type, delimiter):
+    parts = pc.split_pattern(values, delimiter)
+    parts = pc.if_else(pc.greater(pc.list_value_length(parts), position), parts, pa.scalar(None, parts.type))
+    strings = pc.list_element(parts, position)
+    return strings if type == pa.string() else to_number(strings, type)
+
+def record_fields(column, positions, delimiter):
+    # struct fields of a list column of the gkg_numeric schema, with their position in the delimited tuple
+    struct = schemas.schema('gkg_numeric').field(column).type.value_type
+    return [(name, position, struct.field(name).type, delimiter) for name, position in positions.items()]
+
+def define_count_fields():
+    # V2Counts: type#count#object type#location type#location#country#ADM1#lat#lon#feature ID#character offset
+    return record_fields('counts', {'count_type': 0, 'count': 1, 'object_type': 2, 'char_offset': 10}, '#')
+
+def define_amount_fields():
+    # Amounts: amount,object,character offset
+    return record_fields('amounts', {'amount': 0, 'object': 1, 'char_offset': 2}, ',')
+
+def decode_gkg(gkg_df):
+    """Decodes the numeric GKG fields of a batch into a table, for the sidecar Parquet file saved at ingestion.
+
+    Args:
+        gkg_df (pd.DataFrame): GKG records with GKGRECORDID, DATE, V2Tone, V2Counts and Amounts.
+    Returns:
+        pa.Table with GKGRECORDID, DATE, the tone columns, and counts and amounts as lists of structs.
+    """
+    columns = {'GKGRECORDID': gkg_df['GKGRECORDID'].astype(str).to_numpy(dtype=object),
+               'DATE': pa.array(gkg_df['DATE'], type=pa.int64(), from_pandas=True)}
+    columns.update(decode_tone(gkg_df['V2Tone']))
+    columns['counts'] = decode_records(gkg_df['V2Counts'], define_count_fields())
+    columns['amounts'] = decode_records(gkg_df['Amounts'], define_amount_fields())
+    return pa.table(columns, schema=schemas.schema('gkg_numeric'))
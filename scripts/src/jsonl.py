@@ -0,0 +1,105 @@
+import io
+import os
+import json
+import gzip
+from src import schemas
+
+def open_jsonl(filepath, mode='rt', encoding='utf-8', errors='strict'):
+    """Opens a JSONL file for text reading or writing, compressed according to its extension.
+
+    Args:
+        filepath (str): path ending in .jsonl, .jsonl.gz or .jsonl.zst.
+        mode (str): 'rt' to read or 'wt' to write.
+        encoding (str): text encoding.
+        errors (str): how encoding errors are handled, see open().
+    Returns:
+        Text file object.
+
+    Writing or reading .zst files requires the zstandard package.
+    """
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, mode, encoding=encoding, errors=errors)
+    if filepath.endswith('.zst'):
+        import zstandard
+        if 'w' in mode:
+            stream = zstandard.ZstdCompressor().stream_writer(open(filepath, 'wb'), closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), closefd=True)
+        return io.TextIOWrapper(stream, encoding=encoding, errors=errors)
+    return open(filepath, mode, encoding=encoding, errors=errors)
+
+def read_jsonl(filepath, encoding='utf-8', errors='strict'):
+    """Yields the records of a JSONL file one line at a time."""
+    with open_jsonl(filepath, 'rt', encoding=encoding, errors=errors) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_response_records(response):
+    # yields ('record', dict) for each item of 'data' and ('meta', key, value) for top-level scalars
+    try:
+        import ijson
+    except ImportError:
+        # without an incremental parser the body is parsed once in memory
+        response_json = response.json()
+        for key, value in response_json.items():
+            if key != 'data':
+                yield ('meta', key, value)
+        for record in response_json.get('data', []):
+            yield ('record', record)
+        return
+
+    response.raw.decode_content = True
+    builder = None
+    for prefix, event, value in ijson.parse(response.raw, use_float=True):
+        if builder is None and prefix == 'data.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == 'data.item' and event == 'end_map':
+                yield ('record', builder.value)
+                builder = None
+        elif '.' not in prefix and event in ('number', 'string', 'boolean', 'null'):
+            yield ('meta', prefix, value)
+
+def write_response_jsonl(response, filepath, keep=None):
+    """Streams the records of a Lens search response into a JSONL file, one record per line.
+
+    The body is parsed incrementally as it arrives (when ijson is installed), so only one record is held
+    in memory at a time, and the paging metadata is captured in the same pass. The file is written under
+    a hidden temporary name and renamed once complete. Pages without records to write do not create a file.
+
+    Args:
+        response (requests.Response): response requested with stream=True.
+        filepath (str): output path, compressed according to its extension, see open_jsonl().
+        keep (callable): optional filter taking a record and returning False for records to leave out.
+    Returns:
+        Dict of the response's top-level fields (e.g. 'total', 'results', 'scroll_id') plus 'records', the
+        number of records in the page, 'written', the number of records written, and 'last_date_published'
+        and 'last_lens_id' of the last record in the page.
+    """
+    meta = {'last_date_published': None, 'last_lens_id': None}
+    records = 0
+    written = 0
+    # hidden temporary name keeps the extension, so the compression matches and cleaning scripts skip it
+    tmp_path = os.path.join(os.path.dirname(filepath), '.tmp_' + os.path.basename(filepath))
+    with schemas.atomic_write(filepath, 'wt', tmp_path=tmp_path, opener=open_jsonl) as f:
+        for item in iter_response_records(response):
+            if item[0] == 'record':
+                record = item[1]
+                records += 1
+                meta['last_date_published'] = record.get('date_published')
+                meta['last_lens_id'] = record.get('lens_id')
+                if (keep is not None) and (not keep(record)):
+                    continue
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write('\n')
+                written += 1
+            else:
+                meta[item[1]] = item[2]
+    # a page without kept records leaves no file
+    if written == 0:
+        os.remove(filepath)
+    meta['records'] = records
+    meta['written'] = written
+    return meta
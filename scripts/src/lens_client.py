@@ -0,0 +1,135 @@
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from src import metrics
+
+class TokenBucket:
+    """Thread-safe token bucket that paces requests to the licence's rate limit.
+
+    The bucket refills at rate_per_minute and is corrected by the rate-limit headers of each response,
+    so concurrent workers share one request budget.
+    """
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.fill_rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def acquire(self):
+        """Blocks until a request can be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+    def update(self, remaining=None, retry_after=None):
+        """Corrects the bucket from the server's view of the rate limit.
+
+        Args:
+            remaining (float): requests remaining in the current minute.
+            retry_after (float): seconds to wait before any further request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+def header_float(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class LensClient:
+    """Lens API client with a pooled HTTP session, shared rate limiting and retries.
+
+    Args:
+        authkey (str): Lens API token, loaded once and sent with every request.
+        rate_per_minute (int): requests per minute allowed by the licence.
+        max_retries (int): retries for 429, 5xx and connection errors before giving up.
+        backoff (float): base delay in seconds for the jittered exponential backoff.
+        pool_size (int): number of pooled connections, at least the number of concurrent workers.
+    """
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, authkey, rate_per_minute=50, max_retries=5, backoff=1.0, pool_size=10):
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': authkey, 'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.bucket = TokenBucket(rate_per_minute)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def post(self, url, data, **kwargs):
+        """Posts a request body, waiting for the rate limit and retrying transient failures.
+
+        Args:
+            url (str): search endpoint.
+            data (str): JSON request body.
+            **kwargs: passed to requests.Session.post, e.g. stream=True.
+        Returns:
+            requests.Response. After the last retry the failed response is returned for the caller to handle.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.post(url, data=data, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                metrics.record_http('POST', url, err.__class__.__name__, time.perf_counter() - start)
+                if attempt == self.max_retries:
+                    raise
+                print(f'Request failed ({err.__class__.__name__}), retrying')
+                time.sleep(self.backoff_delay(attempt))
+                continue
+
+            # latency to the response headers, streamed bodies are read by the caller
+            metrics.record_http('POST', url, response.status_code, time.perf_counter() - start)
+            retry_after = header_float(response.headers, 'x-rate-limit-retry-after-seconds')
+            self.bucket.update(header_float(response.headers, 'x-rate-limit-remaining-request-per-minute'),
+                               retry_after if response.status_code == 429 else None)
+
+            if (response.status_code not in self.retry_statuses) or (attempt == self.max_retries):
+                return response
+
+            delay = retry_after if retry_after is not None else self.backoff_delay(attempt)
+            print(f'Response {response.status_code}, retrying in {delay:.1f} seconds')
+            response.close()
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt):
+        # exponential backoff with full jitter, so concurrent workers do not retry in lockstep
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(authkey, rate_per_minute=50, max_retries=5, pool_size=10):
+    """Returns the shared LensClient for an API key, creating it on first use.
+
+    All threads in the process share one client, so they share one connection pool and one rate limit.
+    """
+    with clients_lock:
+        if authkey not in clients:
+            clients[authkey] = LensClient(authkey, rate_per_minute, max_retries, pool_size=pool_size)
+        return clients[authkey]
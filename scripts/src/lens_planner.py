@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+def split_date_range(start_d, end_d):
+    """Splits an inclusive date range into two halves.
+
+    Args:
+        start_d (str): start date as YYYY-MM-DD.
+        end_d (str): end date as YYYY-MM-DD.
+    Returns:
+        List of two (start_d, end_d) tuples, or None if the range is a single day and cannot be split.
+    """
+    start = date.fromisoformat(start_d)
+    end = date.fromisoformat(end_d)
+    if start >= end:
+        return None
+    mid = start + (end - start) // 2
+    return [(str(start), str(mid)), (str(mid + timedelta(days=1)), str(end))]
+
+def plan_windows(start_d, end_d, count_results, window_limit):
+    """Splits a date range into sub-windows that each return no more than window_limit results.
+
+    The range is bisected until the count of every window is under the limit, then adjacent windows
+    are merged back together while their combined count still fits.
+
+    Args:
+        start_d (str): start date as YYYY-MM-DD.
+        end_d (str): end date as YYYY-MM-DD.
+        count_results (callable): takes (start_d, end_d) and returns the total number of matching results,
+            e.g. from a count-only probe query.
+        window_limit (int): maximum number of results that can be paged through in one window.
+    Returns:
+        List of (start_d, end_d, total) tuples in date order. Windows without results are dropped.
+    """
+    windows = bisect_windows(start_d, end_d, count_results, window_limit)
+    return merge_windows(windows, window_limit)
+
+def bisect_windows(start_d, end_d, count_results, window_limit):
+    total = count_results(start_d, end_d)
+    if total == 0:
+        return []
+    if total <= window_limit:
+        return [(start_d, end_d, total)]
+    halves = split_date_range(start_d, end_d)
+    if halves is None:
+        # a single day cannot be split any further, it will be truncated at the limit
+        print(f'Warning: {total} results on {start_d} exceed the result window of {window_limit}')
+        return [(start_d, end_d, total)]
+    return bisect_windows(*halves[0], count_results, window_limit) + bisect_windows(*halves[1], count_results, window_limit)
+
+def merge_windows(windows, window_limit):
+    merged = []
+    for window in windows:
+        if merged and (merged[-1][2] + window[2] <= window_limit):
+            merged[-1] = (merged[-1][0], window[1], merged[-1][2] + window[2])
+        else:
+            merged.append(window)
+    return merged
+
+def fetch_windows(windows, fetch_window, max_workers=1):
+    """Fetches each window of a query plan, up to max_workers windows at a time.
+
+    Args:
+        windows (list[tuple]): (start_d, end_d, ...) tuples from plan_windows().
+        fetch_window (callable): takes (start_d, end_d), fetches and saves that window, returns its result.
+        max_workers (int): number of windows to fetch concurrently.
+    Returns:
+        List of fetch_window results in the same order as windows.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_window, window[0], window[1]) for window in windows]
+        return [future.result() for future in futures]
@@ -0,0 +1,104 @@
+import os
+import json
+from src import schemas
+
+class FileCheckpoint:
+    """Keeps a scroll checkpoint in its own JSON file.
+
+    Args:
+        checkpoint_path (str): path to the checkpoint file.
+
+    src.watermark.WatermarkStore offers the same load/save/clear interface for incremental runs.
+    """
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+
+    def load_checkpoint(self):
+        """Returns the saved checkpoint, or None if there is no checkpoint to resume from."""
+        if not os.path.isfile(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, 'r') as f:
+            return json.load(f)
+
+    def save_checkpoint(self, checkpoint):
+        with schemas.atomic_write(self.checkpoint_path) as f:
+            json.dump(checkpoint, f)
+
+    def clear_checkpoint(self):
+        if os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+def cursor_expired(response):
+    # an expired or unknown scroll cursor is reported as not found, gone, or a bad request that names the scroll;
+    # authorisation errors and other bad requests would fail again on the first page
+    if response.status_code in (404, 410):
+        return True
+    return response.status_code == 400 and any(word in response.text.lower() for word in ('scroll', 'expired', 'search context'))
+
+def scroll_pages(post_query, query, save_page, checkpoint, scroll='1m', max_limit=None):
+    """Pages through a Lens query with the scroll cursor, saving each page as it arrives.
+
+    After every saved page the cursor is checkpointed, so an interrupted run resumes from the next page.
+    If the saved cursor has expired the scroll is restarted from the first page, overwriting the pages
+    already saved under the same names. It is restarted at most once per call.
+
+    Args:
+        post_query (callable): takes a request body dict and returns the requests.Response.
+        query (dict): full Lens request body, including 'size' and 'include'. Any 'from' offset is ignored.
+        save_page (callable): takes (response, page_number), saves the page and returns its metadata
+            (see src.jsonl.write_response_jsonl) with 'records', 'total' and 'scroll_id'.
+        checkpoint: object with load_checkpoint(), save_checkpoint(dict) and clear_checkpoint(),
+            e.g. FileCheckpoint. The checkpoint is cleared once the scroll completes.
+        scroll (str): how long the server keeps the cursor alive between requests, e.g. '1m'.
+        max_limit (int): stop once this many results have been saved.
+    Returns:
+        Final checkpoint dict with 'fetched', the number of results saved, and the date_published and
+        lens_id of the last record. None if a request failed.
+    """
+    first_body = {key: value for key, value in query.items() if key != 'from'}
+    first_body['scroll'] = scroll
+    empty = {'scroll_id': None, 'page': 0, 'fetched': 0, 'total': None, 'last_date_published': None, 'last_lens_id': None}
+
+    position = checkpoint.load_checkpoint()
+    if position is None:
+        position = dict(empty)
+    else:
+        print(f"Resuming scroll from page {position['page']} ({position['fetched']} results saved)")
+
+    restarted = False
+    while True:
+        if position['scroll_id'] is None:
+            body = first_body
+        else:
+            body = {'scroll_id': position['scroll_id'], 'scroll': scroll, 'include': query.get('include', [])}
+        response = post_query(body)
+
+        if response.status_code != 200:
+            if (position['scroll_id'] is not None) and (not restarted) and cursor_expired(response):
+                # the cursor is no longer valid, start the scroll again
+                print(f"Scroll cursor rejected ({response.status_code}), restarting from the first page")
+                position = dict(empty)
+                restarted = True
+                continue
+            print("Error: " + str(response.status_code))
+            print(response.text)
+            return None
+
+        meta = save_page(response, position['page'])
+        if meta['records'] == 0:
+            break
+
+        position = {'scroll_id': meta['scroll_id'],
+                    'page': position['page'] + 1,
+                    'fetched': position['fetched'] + meta['records'],
+                    'total': meta['total'],
+                    'last_date_published': meta['last_date_published'],
+                    'last_lens_id': meta['last_lens_id']}
+        checkpoint.save_checkpoint(position)
+
+        limit = position['total'] if max_limit is None else min(position['total'], max_limit)
+        if position['fetched'] >= limit:
+            break
+
+    checkpoint.clear_checkpoint()
+    return position
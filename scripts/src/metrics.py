@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from datetime import datetime
+
+# run being recorded by this process, set by run_metrics()
+current_run = None
+
+def peak_rss_mb():
+    # peak resident memory of this process and of its finished child processes, None where it cannot be read
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2**20
+        except (ImportError, AttributeError):
+            return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 2**20 if os.uname().sysname == 'Darwin' else 2**10
+    return max(own, children) / scale
+
+def cpu_seconds():
+    # user and system time of this process and its finished child processes
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+class StageMetrics:
+    """Counters of one stage or sub-step. Stages running in other threads have their own counters.
+
+    thread_cpu_seconds is the CPU time of the thread that ran the stage. The process_ readings are taken for the
+    whole process, so they include other stages running at the same time and worker processes.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall_seconds = 0.0
+        self.thread_cpu_seconds = 0.0
+        self.process_cpu_seconds = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.process_peak_rss_mb = None
+        self.error = None
+
+    def to_dict(self):
+        return dict(vars(self))
+
+class RunMetrics:
+    """Collects metrics for one run of an entry point and writes them out when the run finishes.
+
+    Args:
+        name (str): name of the run, usually the script name.
+        folder (str): folder the metrics files are written to.
+        formats (list[str]): 'json' for one file per run, 'prom' for a Prometheus textfile collector file
+            that is replaced on every run.
+        profiler (str): 'none', 'cprofile' or 'pyinstrument' (requires pyinstrument).
+        profile_stages (list[str]): top-level stages to profile, '*' for all of them.
+    """
+    def __init__(self, name, folder, formats=('json',), profiler='none', profile_stages=()):
+        self.name = name
+        self.folder = folder
+        self.formats = list(formats)
+        self.profiler = profiler
+        self.profile_stages = list(profile_stages)
+        self.started = datetime.now()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = cpu_seconds()
+        self.start_thread_cpu = time.thread_time()
+        self.stages = []
+        self.http = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.totals = StageMetrics(name)
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        # innermost stage of the calling thread, or the run totals outside any stage
+        stack = self.stack()
+        return stack[-1] if stack else self.totals
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self.stack()
+        metrics = StageMetrics('/'.join([s.name for s in stack] + [name]))
+        profiler = self.start_profiler(name) if not stack else None
+        stack.append(metrics)
+        start_wall, start_thread_cpu, start_cpu = time.perf_counter(), time.thread_time(), cpu_seconds()
+        try:
+            yield metrics
+        except BaseException as err:
+            metrics.error = repr(err)
+            raise
+        finally:
+            metrics.wall_seconds = time.perf_counter() - start_wall
+            metrics.thread_cpu_seconds = time.thread_time() - start_thread_cpu
+            metrics.process_cpu_seconds = cpu_seconds() - start_cpu
+            metrics.process_peak_rss_mb = peak_rss_mb()
+            stack.pop()
+            if profiler is not None:
+                self.stop_profiler(profiler, name)
+            with self.lock:
+                self.stages.append(metrics)
+                # counts roll up into the enclosing stage so run totals add up
+                parent = stack[-1] if stack else self.totals
+                for field in ('rows_in', 'rows_out', 'bytes_read', 'bytes_written'):
+                    setattr(parent, field, getattr(parent, field) + getattr(metrics, field))
+
+    def start_profiler(self, name):
+        if (self.profiler == 'none') or not (('*' in self.profile_stages) or (name in self.profile_stages)):
+            return None
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+        try:
+            profiler.start() if self.profiler == 'pyinstrument' else profiler.enable()
+        except (RuntimeError, ValueError):
+            # another stage in this process is already being profiled
+            return None
+        return profiler
+
+    def stop_profiler(self, profiler, name):
+        os.makedirs(self.folder, exist_ok=True)
+        filepath = os.path.join(self.folder, f"{self.name}_{name}_{self.started:%Y%m%d%H%M%S}")
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+            with open(filepath + '.html', 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(filepath + '.prof')
+
+    def record_http(self, method, url, status, seconds):
+        with self.lock:
+            self.http.append({'method': method, 'url': url, 'status': status, 'seconds': seconds})
+
+    def http_summary(self):
+        import numpy as np
+        latencies = np.array([request['seconds'] for request in self.http])
+        by_status = {}
+        for request in self.http:
+            by_status[str(request['status'])] = by_status.get(str(request['status']), 0) + 1
+        summary = {'requests': len(self.http), 'by_status': by_status}
+        if len(latencies):
+            summary.update({'latency_mean': float(latencies.mean()), 'latency_p50': float(np.percentile(latencies, 50)),
+                            'latency_p95': float(np.percentile(latencies, 95)), 'latency_max': float(latencies.max())})
+        return summary
+
+    def summary(self):
+        self.totals.wall_seconds = time.perf_counter() - self.start_wall
+        self.totals.thread_cpu_seconds = time.thread_time() - self.start_thread_cpu
+        self.totals.process_cpu_seconds = cpu_seconds() - self.start_cpu
+        self.totals.process_peak_rss_mb = peak_rss_mb()
+        return {'run': self.name, 'started': self.started.isoformat(timespec='seconds'), **self.totals.to_dict(),
+                'stages': [stage.to_dict() for stage in self.stages], 'http': self.http_summary()}
+
+    def write(self):
+        """Writes the metrics files and returns the summary dict."""
+        summary = self.summary()
+        os.makedirs(self.folder, exist_ok=True)
+        if 'json' in self.formats:
+            with open(os.path.join(self.folder, f"{self.name}_{self.started:%Y%m%d%H%M%S}.json"), 'w') as f:
+                json.dump(summary, f, indent=2)
+        if 'prom' in self.formats:
+            write_prometheus(summary, os.path.join(self.folder, f'{self.name}.prom'))
+        return summary
+
+def write_prometheus(summary, filepath):
+    # Prometheus textfile collector format, written to a temporary file and swapped in so it is never read half written
+    lines = []
+    run = summary['run']
+    records = [dict(summary, name='total')] + summary['stages']
+    for field, help_text in [('wall_seconds', 'Wall clock time'), ('thread_cpu_seconds', 'CPU time of the thread that ran the stage'),
+                             ('process_cpu_seconds', 'CPU time of the whole process and its child processes while the stage ran'),
+                             ('rows_in', 'Rows read'), ('rows_out', 'Rows written'), ('bytes_read', 'Bytes read'),
+                             ('bytes_written', 'Bytes written'), ('process_peak_rss_mb', 'Peak resident memory of the whole process in MiB')]:
+        lines.append(f'# HELP pipeline_stage_{field} {help_text}')
+        lines.append(f'# TYPE pipeline_stage_{field} gauge')
+        for record in records:
+            if record[field] is not None:
+                lines.append(f'pipeline_stage_{field}{{run="{run}",stage="{record["name"]}"}} {record[field]}')
+    lines.append('# HELP pipeline_http_requests HTTP requests by status')
+    lines.append('# TYPE pipeline_http_requests gauge')
+    for status, count in summary['http']['by_status'].items():
+        lines.append(f'pipeline_http_requests{{run="{run}",status="{status}"}} {count}')
+    if 'latency_p95' in summary['http']:
+        lines.append('# TYPE pipeline_http_latency_seconds gauge')
+        for quantile in ('p50', 'p95', 'max'):
+            lines.append(f'pipeline_http_latency_seconds{{run="{run}",quantile="{quantile}"}} {summary["http"]["latency_" + quantile]}')
+    from src import schemas
+    with schemas.atomic_write(filepath) as f:
+        f.write('\n'.join(lines) + '\n')
+
+@contextlib.contextmanager
+def run_metrics(name, config_file='../config.ini'):
+    """Records metrics for the code run inside the block and writes them out at the end, also on failure.
+
+    Settings are read from the [METRICS] section of config.ini. Nested calls, e.g. a script run by the
+    pipeline, record into the outer run.
+    """
+    global current_run
+    if current_run is not None:
+        with current_run.stage(name):
+            yield current_run
+        return
+    import configparser
+    settings = configparser.ConfigParser(inline_comment_prefixes="#")
+    settings.read(config_file)
+    config = settings['METRICS'] if settings.has_section('METRICS') else {}
+    current_run = RunMetrics(name, config.get('metrics_folder', '../data/meta/metrics/'),
+                             formats=[f.strip() for f in config.get('formats', 'json').split(',') if f.strip()],
+                             profiler=config.get('profiler', 'none'),
+                             profile_stages=[s.strip() for s in config.get('profile_stages', '*').split(',') if s.strip()])
+    try:
+        yield current_run
+    finally:
+        run, current_run = current_run, None
+        summary = run.write()
+        print(f"{name} took {summary['wall_seconds']:.1f}s wall, {summary['process_cpu_seconds']:.1f}s CPU, peak memory {summary['process_peak_rss_mb'] or 0:.0f} MiB")
+
+### Helpers that record into the current run and do nothing outside one ###
+def stage(name):
+    return current_run.stage(name) if current_run is not None else contextlib.nullcontext(StageMetrics(name))
+
+def add_rows(rows_in=0, rows_out=0):
+    # outside a stage the counts go to the run totals, which threads share
+    if current_run is not None:
+        metrics = current_run.current()
+        with current_run.lock:
+            metrics.rows_in += int(rows_in)
+            metrics.rows_out += int(rows_out)
+
+def add_bytes(read=None, written=None):
+    # takes byte counts or file paths
+    if current_run is not None:
+        metrics = current_run.current()
+        read = os.path.getsize(read) if isinstance(read, (str, os.PathLike)) else int(read or 0)
+        written = os.path.getsize(written) if isinstance(written, (str, os.PathLike)) else int(written or 0)
+        with current_run.lock:
+            metrics.bytes_read += read
+            metrics.bytes_written += written
+
+def record_http(method, url, status, seconds):
+    if current_run is not None:
+        current_run.record_http(method, url, status, seconds)
@@ -0,0 +1,193 @@
+import os
+import glob
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src import metrics, schemas
+
+class Stage:
+    """One step of the pipeline.
+
+    Args:
+        name (str): unique stage name.
+        run (callable): takes a dict of the results of the stages it depends on, keyed by stage name, and
+            returns its own result. A dependency that was skipped has no result in the dict, so stages must be
+            able to fall back to reading their inputs from disk.
+        deps (list[str]): names of the stages that must finish first.
+        inputs (list[str]): glob patterns of the files the stage reads.
+        code (list[str]): source files the stage runs, relative to the scripts folder.
+        config_sections (list[str]): config.ini sections the stage depends on.
+        params (dict): any other values that change what the stage does, e.g. a date range.
+        exclusive (bool): run the stage on its own, e.g. when it starts its own worker processes.
+    """
+    def __init__(self, name, run, deps=(), inputs=(), code=(), config_sections=(), params=None, exclusive=False):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.code = list(code)
+        self.config_sections = list(config_sections)
+        self.params = params or {}
+        self.exclusive = exclusive
+
+def hash_files(patterns):
+    # fingerprints files by path, size and modification time, which is enough to notice new or rewritten files
+    digest = hashlib.sha1()
+    for pattern in patterns:
+        for filepath in sorted(glob.glob(pattern)):
+            if os.path.isfile(filepath):
+                stat = os.stat(filepath)
+                digest.update(f'{filepath}\x00{stat.st_size}\x00{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+def hash_code(filepaths):
+    digest = hashlib.sha1()
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            digest.update(hashlib.sha1(f.read()).digest())
+    return digest.hexdigest()
+
+def fingerprint(stage, settings, dep_fingerprints):
+    """Returns a hash of everything that determines the output of a stage.
+
+    Args:
+        stage (Stage): stage to fingerprint.
+        settings (ConfigParser): parsed config.ini.
+        dep_fingerprints (dict): fingerprints of the stages it depends on.
+    Returns:
+        Hex digest string.
+    """
+    config = {section: dict(settings[section]) for section in stage.config_sections}
+    parts = {'inputs': hash_files(stage.inputs), 'code': hash_code(stage.code), 'config': config,
+             'params': stage.params, 'deps': [dep_fingerprints.get(dep) for dep in stage.deps]}
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class Pipeline:
+    """Runs stages in dependency order, skipping stages whose fingerprint has not changed since they last succeeded.
+
+    Independent stages run concurrently on a thread pool, and the result of each stage is handed to the
+    stages that depend on it in memory.
+
+    Args:
+        stages (list[Stage]): stages of the pipeline.
+        settings (ConfigParser): parsed config.ini, read once for every stage.
+        state_path (str): JSON file holding the fingerprint of the last successful run of each stage.
+        max_workers (int): most stages running at once.
+    """
+    def __init__(self, stages, settings, state_path='../data/meta/pipeline_state.json', max_workers=4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.settings = settings
+        self.state_path = state_path
+        self.max_workers = max_workers
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f'Stage {stage.name} depends on unknown stage {dep}')
+        self.order = self.topological_order()
+
+    def topological_order(self):
+        order, visiting, done = [], set(), set()
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f'Pipeline has a cycle through stage {name}')
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.remove(name)
+            done.add(name)
+            order.append(name)
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def load_state(self):
+        if not os.path.isfile(self.state_path):
+            return {}
+        with open(self.state_path, 'r') as f:
+            return json.load(f)
+
+    def save_state(self, state):
+        with schemas.atomic_write(self.state_path) as f:
+            json.dump(state, f, indent=2)
+
+    def select(self, targets):
+        # the target stages and everything they depend on
+        selected = set()
+        def visit(name):
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage {name}')
+            if name not in selected:
+                selected.add(name)
+                for dep in self.stages[name].deps:
+                    visit(dep)
+        for name in targets:
+            visit(name)
+        return selected
+
+    def run_stage(self, stage, upstream):
+        # each stage is timed in the metrics of the current run, see src.metrics
+        with metrics.stage(stage.name):
+            return stage.run(upstream)
+
+    def run(self, targets=None, force=False):
+        """Runs the pipeline.
+
+        Args:
+            targets (list[str]): stages to run along with their dependencies. Runs every stage if None.
+            force (bool): run stages even if their fingerprint is unchanged.
+        Returns:
+            Dict of stage name to status: 'ran', 'skipped', 'failed' or 'blocked' (a dependency failed).
+        """
+        selected = set(self.order) if targets is None else self.select(targets)
+        state = self.load_state()
+        pending = [name for name in self.order if name in selected]
+        status, results, fingerprints, running = {}, {}, {}, {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if any(status.get(dep) in ('failed', 'blocked') for dep in stage.deps if dep in selected):
+                        status[name] = 'blocked'
+                        pending.remove(name)
+                        print(f'[{name}] blocked by a failed dependency')
+                        continue
+                    if any((dep in selected) and (dep not in status) for dep in stage.deps):
+                        continue
+                    # exclusive stages wait for the pool to drain and hold it until they finish
+                    if any(self.stages[other].exclusive for other in running.values()):
+                        break
+                    if stage.exclusive and running:
+                        break
+                    pending.remove(name)
+                    fingerprints[name] = fingerprint(stage, self.settings, fingerprints)
+                    if (not force) and (state.get(name, {}).get('fingerprint') == fingerprints[name]):
+                        status[name] = 'skipped'
+                        print(f'[{name}] unchanged, skipped')
+                        continue
+                    print(f'[{name}] running')
+                    upstream = {dep: results[dep] for dep in stage.deps if dep in results}
+                    running[executor.submit(self.run_stage, stage, upstream)] = name
+                    if stage.exclusive:
+                        break
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as err:
+                        status[name] = 'failed'
+                        print(f'[{name}] failed: {err!r}')
+                        continue
+                    status[name] = 'ran'
+                    # inputs written by the stage itself are part of what the next run compares against
+                    state[name] = {'fingerprint': fingerprint(self.stages[name], self.settings, fingerprints)}
+                    fingerprints[name] = state[name]['fingerprint']
+                    self.save_state(state)
+                    print(f'[{name}] done')
+        return status
@@ -0,0 +1,236 @@
+import os
+import contextlib
+from functools import lru_cache
+import pyarrow as pa
+
+def category():
+    # low cardinality strings, e.g. country codes, are stored as dictionary indices and read as pandas categoricals
+    return pa.dictionary(pa.int32(), pa.string())
+
+def define_gkg_header(mode='all'):
+    # GDELT GKG column names, 'all' for every column of the raw files and 'usecols' for the columns gdelt_ingestion keeps
+    if mode=='all':
+        return ['GKGRECORDID','DATE','SourceCollectionIdentifier','SourceCommonName',\
+                'DocumentIdentifier', 'Counts', 'V2Counts', 'Themes', 'V2Themes', 'Locations', \
+                'V2Locations','Persons','V2Persons','Organizations','V2Organizations','V2Tone',\
+                'Dates','GCAM','SharingImage','RelatedImages','SocialImageEmbeds',\
+                'SocialVideoEmbeds','Quotations','AllNames','Amounts','TranslationInfo','Extras']
+    elif mode=='usecols':
+        return ['GKGRECORDID','DATE','SourceCollectionIdentifier','SourceCommonName',\
+                'DocumentIdentifier','Counts','V2Counts','V2Locations','V2Persons',\
+                'V2Organizations','V2Tone','Dates','SharingImage','RelatedImages','SocialImageEmbeds',\
+                'SocialVideoEmbeds','Quotations','AllNames','Amounts','TranslationInfo','Extras']
+    else:
+        return
+
+def define_gkg_fields():
+    # GDELT GKG columns that are not free text, every other column of the raw and filtered GKG files is a string
+    return {'DATE': pa.int64(), 'SourceCollectionIdentifier': pa.int8(), 'SourceCommonName': category()}
+
+@lru_cache(maxsize=None)
+def define_schemas():
+    """Defines the Arrow schema of every table the pipeline reads or writes.
+
+    The schemas are built once and shared by every caller, so the returned dictionary must not be changed.
+
+    Returns:
+        Dictionary of table name to pyarrow.Schema.
+    """
+    from src.gkg_decode import TONE_FIELDS
+    gkg_fields = define_gkg_fields()
+    count_type = pa.struct([('count_type', pa.string()), ('count', pa.int64()), ('object_type', pa.string()), ('char_offset', pa.int32())])
+    amount_type = pa.struct([('amount', pa.float64()), ('object', pa.string()), ('char_offset', pa.int32())])
+    return {
+        # GDELT: raw and filtered GKG files, the numeric sidecar from gdelt_ingestion and the dashboard tables from gdelt_append
+        'gkg': pa.schema([(name, gkg_fields.get(name, pa.string())) for name in define_gkg_header('all')]),
+        'gkg_numeric': pa.schema([('GKGRECORDID', pa.string()), ('DATE', pa.int64())] + [(name, pa.float32()) for name in TONE_FIELDS] +
+                                 [('word_count', pa.int32()), ('counts', pa.list_(count_type)), ('amounts', pa.list_(amount_type))]),
+        'gdelt_records': pa.schema([('record_id', pa.string()), ('date', pa.int64()), ('domain', category()), ('url', pa.string()),
+                                    ('technology', category())]),
+        'gdelt_locations': pa.schema([('record_id', pa.string()), ('location_type', pa.int8()), ('location_name', pa.string()),
+                                      ('country_code', category()), ('adm1_code', category()), ('adm2_code', pa.string()),
+                                      ('latitude', pa.float32()), ('longitude', pa.float32()), ('feature_id', pa.string()),
+                                      ('text_position', pa.int32()), ('extra', pa.string())]),
+        'gdelt_organisations': pa.schema([('record_id', pa.string()), ('org_name', pa.string()), ('text_position', pa.int32())]),
+        'gdelt_persons': pa.schema([('record_id', pa.string()), ('person_name', pa.string()), ('text_position', pa.int32())]),
+        'gdelt_names': pa.schema([('record_id', pa.string()), ('name', pa.string()), ('text_position', pa.int32())]),
+        'gdelt_grid': pa.schema([('zoom', pa.int8()), ('quadkey', pa.string()), ('latitude', pa.float32()), ('longitude', pa.float32()),
+                                 ('technology', category()), ('date', pa.date32()), ('mentions', pa.int32()), ('records', pa.int32())]),
+        # Lens: processed patents from patent_cleaning and journals from journal_cleaning
+        'patent_data': pa.schema([('lens_id', pa.string()), ('jurisdiction', category()), ('patent_id', pa.string()),
+                                  ('date_published', pa.date32()), ('title', pa.string()), ('abstract', pa.string())]),
+        'patent_classifications': pa.schema([('lens_id', pa.string()), ('patent_id', pa.string()), ('classification', category())]),
+        'patent_parties': pa.schema([('lens_id', pa.string()), ('patent_id', pa.string()), ('residence', category()), ('name', pa.string())]),
+        'journals': pa.schema([('lens_id', pa.string()), ('title', pa.string()), ('abstract', pa.string()), ('date_published', pa.date32()),
+                               ('fields_of_study', pa.list_(pa.string())), ('keywords', pa.list_(pa.string())), ('author', pa.string()),
+                               ('institution', pa.string()), ('country_code', category()), ('country', category())]),
+        # rollups, topics and organisations
+        'country_rollup': pa.schema([('tech', category()), ('country_code', category()), ('month', pa.date32()), ('count', pa.int32()),
+                                     ('gdp_billion_usd', pa.float32()), ('count_per_billion_gdp', pa.float32())]),
+        'topic_rollup': pa.schema([('topic_number', pa.int16()), ('tech', pa.int8()), ('month', pa.date32()),
+                                   ('jurisdiction', category()), ('count', pa.int32())]),
+        # the document key column, lens_id or GKGRECORDID, is added in front by topic_modelling.topic_docs_table()
+        'topic_docs': pa.schema([('topic_number', pa.int16()), ('topic_probabilities', pa.float32())]),
+        'entity_names': pa.schema([('key', pa.string()), ('source', category()), ('entity_id', pa.int32()), ('name', pa.string()),
+                                   ('mentions', pa.int64())]),
+        'organisations': pa.schema([('entity_id', pa.int32()), ('name', pa.string()), ('source', category()), ('mentions', pa.int64())]),
+        # syndication index from gdelt_syndication, clusters of records reporting the same article and the link of each record
+        'syndication_clusters': pa.schema([('cluster_id', pa.int64()), ('representative_id', pa.string()), ('simhash', pa.uint64()),
+                                           ('last_date', pa.int64()), ('records', pa.int32())]),
+        'syndication_links': pa.schema([('record_id', pa.string()), ('cluster_id', pa.int64()), ('representative_id', pa.string()),
+                                        ('url_key', pa.string()), ('match', category())])}
+
+# table read from the files of each source by tech_filter and topic_modelling
+SOURCE_TABLES = {'GDELT': 'gkg', 'LENS_API.PATENTS': 'patent_data', 'LENS_API.JOURNALS': 'journals'}
+
+def schema(name):
+    """Returns the Arrow schema of a table, see define_schemas()."""
+    schemas = define_schemas()
+    if name not in schemas:
+        raise ValueError(f'No schema defined for table {name}, choose from {", ".join(schemas)}')
+    return schemas[name]
+
+def pandas_dtype(type):
+    """Maps an Arrow type to the pandas dtype a column of the type is held in.
+
+    Strings are Arrow backed, integers are nullable so missing values do not turn them into float64, and
+    dictionaries become categoricals. Returns None for types pandas converts well by default, e.g. floats and dates.
+    """
+    import pandas as pd
+    if pa.types.is_string(type) or pa.types.is_large_string(type):
+        return pd.StringDtype('pyarrow')
+    if pa.types.is_integer(type):
+        return {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(),
+                pa.uint64(): pd.UInt64Dtype()}.get(type)
+    if pa.types.is_boolean(type):
+        return pd.BooleanDtype()
+    return None
+
+def pandas_dtypes(name):
+    # dtype argument for pd.read_csv, columns missing from a file are ignored by pandas
+    dtypes = {}
+    for field in schema(name):
+        if pa.types.is_dictionary(field.type):
+            dtypes[field.name] = 'category'
+        elif pa.types.is_floating(field.type):
+            dtypes[field.name] = field.type.to_pandas_dtype()
+        elif pandas_dtype(field.type) is not None:
+            dtypes[field.name] = pandas_dtype(field.type)
+    return dtypes
+
+def cast(df, name):
+    """Converts the columns of a DataFrame that are in a table's schema to their pandas dtypes.
+
+    Numbers parsed from text that are not numbers become missing values. Columns not in the schema are kept as they are.
+
+    Args:
+        df (pd.DataFrame): table data, e.g. GKG fields split from text.
+        name (str): table name, see define_schemas().
+    Returns:
+        pd.DataFrame with the same columns.
+    """
+    import pandas as pd
+    dtypes = pandas_dtypes(name)
+    columns = {}
+    for field in schema(name):
+        if field.name not in df.columns:
+            continue
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            columns[field.name] = pd.to_numeric(df[field.name], errors='coerce').astype(dtypes[field.name])
+        elif pa.types.is_date(field.type) or pa.types.is_timestamp(field.type):
+            columns[field.name] = pd.to_datetime(df[field.name], errors='coerce')
+        elif field.name in dtypes:
+            columns[field.name] = df[field.name].astype(dtypes[field.name])
+    return df.assign(**columns)
+
+def to_table(df, name, metadata=None):
+    """Converts a DataFrame to an Arrow table with a table's schema.
+
+    Columns of the schema missing from the DataFrame are null, columns not in the schema are dropped.
+
+    Args:
+        df (pd.DataFrame): table data.
+        name (str): table name, see define_schemas().
+        metadata (dict): optional key value pairs saved with the schema.
+    Returns:
+        pyarrow.Table.
+    """
+    table_schema = schema(name)
+    df = cast(df.reindex(columns=table_schema.names), name)
+    if metadata is not None:
+        table_schema = table_schema.with_metadata(metadata)
+    return pa.Table.from_pandas(df, schema=table_schema, preserve_index=False)
+
+def write_parquet(df, filepath, name, metadata=None):
+    """Writes a DataFrame to Parquet with a table's schema.
+
+    The file is swapped in whole, see atomic_write().
+
+    Returns:
+        Number of rows written.
+    """
+    return write_table(to_table(df, name, metadata), filepath)
+
+def write_table(table, filepath):
+    """Writes an Arrow table to Parquet through a temporary file that is swapped in, see atomic_write().
+
+    Returns:
+        Number of rows written.
+    """
+    import pyarrow.parquet as pq
+    with atomic_write(filepath, 'wb') as f:
+        pq.write_table(table, f)
+    return table.num_rows
+
+@contextlib.contextmanager
+def atomic_write(filepath, mode='w', tmp_path=None, opener=open, **kwargs):
+    """Opens a temporary file to write, and swaps it in for filepath once the block finishes.
+
+    An interruption never leaves a partial file, and an error in the block leaves filepath as it was.
+
+    Args:
+        filepath (str): file to write.
+        mode (str): 'w' for text or 'wb' for binary.
+        tmp_path (str): optional temporary file, filepath + '.tmp' by default.
+        opener (callable): opens the temporary file, e.g. src.jsonl.open_jsonl for compressed files.
+        kwargs: passed to opener, e.g. encoding.
+    Yields:
+        File object.
+    """
+    tmp_path = tmp_path or filepath + '.tmp'
+    f = opener(tmp_path, mode, **kwargs)
+    try:
+        yield f
+    except BaseException:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    f.close()
+    os.replace(tmp_path, filepath)
+
+def read_parquet(filepath, name, columns=None):
+    """Reads a Parquet file, or a folder of Parquet parts, into a DataFrame with a table's dtypes.
+
+    Files written before a column's type was narrowed are cast on read. Columns not in the schema are kept as they are.
+
+    Args:
+        filepath (str): Parquet file or folder.
+        name (str): table name, see define_schemas().
+        columns (list[str]): optional columns to read.
+    Returns:
+        pd.DataFrame.
+    """
+    import pyarrow.parquet as pq
+    fields = {field.name: field.type for field in schema(name)}
+    table = pq.read_table(filepath, columns=columns)
+    table = pa.table({col: table[col].cast(fields[col]) if col in fields else table[col] for col in table.column_names})
+    return table.to_pandas(types_mapper=pandas_dtype)
+
+def read_csv(filepath, name, **kwargs):
+    """Reads a CSV file with a table's dtypes, other arguments are passed to pd.read_csv.
+
+    Returns:
+        pd.DataFrame.
+    """
+    import pandas as pd
+    return pd.read_csv(filepath, dtype=pandas_dtypes(name), **kwargs)
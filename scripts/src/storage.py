@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+
+class LocalSink:
+    """Keeps files on the local drive only. Every script saves locally first, so there is nothing to upload."""
+    def upload(self, filepath, folder):
+        return
+
+class GDriveSink:
+    """Uploads files into Google Drive folders.
+
+    Args:
+        cred_file (str): path to the user credentials file, see src.google_drive.create_gdrive_client().
+        settings (ConfigParser): parsed config.ini, holding the folder IDs.
+    """
+    def __init__(self, cred_file, settings):
+        self.cred_file = cred_file
+        self.settings = settings
+        self.client = None
+        self.lock = threading.Lock()
+
+    def upload(self, filepath, folder):
+        from src.google_drive import create_gdrive_client, upload_file
+        # authenticate once for every upload of the run
+        with self.lock:
+            if self.client is None:
+                self.client = create_gdrive_client(self.cred_file)
+        # a (config section, key) pair names a folder ID in config.ini, a string is the folder ID itself
+        folder_id = self.settings[folder[0]][folder[1]] if isinstance(folder, tuple) else folder
+        upload_file(self.client, folder_id, filepath)
+
+class AzureBlobSink:
+    """Uploads files into an Azure Blob Storage container (requires azure-storage-blob).
+
+    Blobs are named by the path of the file under the data folder, e.g. raw/patents/<file>, so the container
+    mirrors the local layout. The default connection string points at the Azurite emulator.
+
+    Args:
+        connection_string (str): storage account connection string.
+        container (str): container name, created if it does not exist.
+        data_folder (str): local data folder that blob names are relative to.
+    """
+    def __init__(self, connection_string, container, data_folder='../data/'):
+        from azure.storage.blob import BlobServiceClient
+        from azure.core.exceptions import ResourceExistsError
+        self.data_folder = data_folder
+        self.container = BlobServiceClient.from_connection_string(connection_string).get_container_client(container)
+        try:
+            self.container.create_container()
+        except ResourceExistsError:
+            pass
+
+    def blob_name(self, filepath):
+        return os.path.relpath(filepath, self.data_folder).replace(os.sep, '/')
+
+    def upload(self, filepath, folder):
+        with open(filepath, 'rb') as f:
+            self.container.upload_blob(self.blob_name(filepath), f, overwrite=True)
+
+class WriteBehindQueue:
+    """Uploads files from background threads so the script carries on computing while uploads drain.
+
+    Files must not change after they are queued, until wait() returns for them. Failed uploads are retried with
+    a growing wait, and files that still fail are reported by flush().
+
+    Args:
+        sink: LocalSink, GDriveSink or AzureBlobSink.
+        workers (int): upload threads.
+        retries (int): attempts per file after the first one.
+    """
+    def __init__(self, sink, workers=4, retries=3):
+        self.sink = sink
+        self.retries = retries
+        self.queue = queue.Queue()
+        self.failed = []
+        self.uploaded = 0
+        self.lock = threading.Lock()
+        # number of queued or in-flight uploads of each file, see wait()
+        self.pending = {}
+        self.done = threading.Condition(self.lock)
+        # daemon threads, the queue is drained by flush() at exit rather than by joining the threads
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, filepath, folder):
+        with self.lock:
+            self.pending[filepath] = self.pending.get(filepath, 0) + 1
+        self.queue.put((filepath, folder))
+
+    def wait(self, filepath):
+        # blocks until no upload of the file is queued or in flight
+        with self.lock:
+            self.done.wait_for(lambda: filepath not in self.pending)
+
+    def work(self):
+        while True:
+            filepath, folder = self.queue.get()
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        self.sink.upload(filepath, folder)
+                        with self.lock:
+                            self.uploaded += 1
+                        break
+                    except Exception as err:
+                        if attempt == self.retries:
+                            with self.lock:
+                                self.failed.append((filepath, repr(err)))
+                        else:
+                            time.sleep(2 ** attempt)
+            finally:
+                with self.lock:
+                    self.pending[filepath] -= 1
+                    if not self.pending[filepath]:
+                        del self.pending[filepath]
+                    self.done.notify_all()
+                self.queue.task_done()
+
+    def flush(self):
+        """Waits for every queued upload to finish.
+
+        Returns:
+            List of (filepath, error) for the files that could not be uploaded.
+        """
+        self.queue.join()
+        with self.lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+def create_sink(save_option, settings):
+    if save_option == 'gdrive':
+        return GDriveSink(settings['GDRIVE']['credentials'], settings)
+    if save_option == 'azure':
+        # an environment variable keeps real account keys out of config.ini
+        connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING', settings['AZURE']['connection_string'])
+        return AzureBlobSink(connection_string, settings['AZURE']['container'],
+                             os.path.dirname(os.path.normpath(settings['DEFAULT']['raw_data_folder'])))
+    return LocalSink()
+
+### One queue per save option, shared by every script in the process ###
+queues = {}
+queues_lock = threading.Lock()
+
+def get_queue(save_option, config_file='../config.ini'):
+    import ast
+    import configparser
+    with queues_lock:
+        if save_option not in queues:
+            settings = configparser.ConfigParser(inline_comment_prefixes="#")
+            settings.read(config_file)
+            if save_option not in ast.literal_eval(settings['DEFAULT']['valid_save_options']):
+                raise ValueError(f'Invalid save option {save_option}, see valid_save_options in config.ini')
+            if not queues:
+                atexit.register(flush)
+            queues[save_option] = WriteBehindQueue(create_sink(save_option, settings), workers=int(settings['STORAGE']['upload_workers']),
+                                                   retries=int(settings['STORAGE']['upload_retries']))
+        return queues[save_option]
+
+def save(filepath, folder, save_option):
+    """Queues a locally saved file for upload to the storage chosen by save_option.
+
+    Args:
+        filepath (str): path of the local file.
+        folder (tuple or str): (config section, key) of the Google Drive folder ID, e.g. ('GDRIVE.RAWDATA.FOLDER_IDS', 'patent_data'),
+            or the folder ID itself. Azure uses the path of the file under the data folder instead.
+        save_option (str): 'local', 'gdrive' or 'azure'. None keeps the file local.
+    """
+    if save_option in (None, 'local'):
+        return
+    get_queue(save_option).put(filepath, folder)
+
+def wait(filepaths):
+    """Waits for the queued uploads of some files, so they can be changed again, e.g. appended to.
+
+    Unlike flush(), other uploads carry on and failures are left for flush() to report.
+
+    Args:
+        filepaths (list[str]): paths of the local files, as passed to save().
+    """
+    for upload_queue in list(queues.values()):
+        for filepath in filepaths:
+            upload_queue.wait(filepath)
+
+def flush():
+    """Waits for every queued upload, runs at exit so a script only finishes once its uploads have drained.
+
+    Returns:
+        Number of files that could not be uploaded.
+    """
+    failed = 0
+    for save_option, upload_queue in list(queues.items()):
+        if upload_queue.queue.unfinished_tasks:
+            print(f'Waiting for {upload_queue.queue.unfinished_tasks} uploads to {save_option}')
+        for filepath, err in upload_queue.flush():
+            print(f'Upload of {filepath} to {save_option} failed: {err}', file=sys.stderr)
+            failed += 1
+        if upload_queue.uploaded:
+            print(f'{upload_queue.uploaded} files saved to {save_option}')
+            upload_queue.uploaded = 0
+    return failed
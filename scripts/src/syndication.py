@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import hashlib
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import numpy as np
+import pandas as pd
+from src import schemas
+
+# query parameters that track the referrer rather than select the article
+TRACKING_PARAMS = re.compile(r'^(utm_.*|fbclid|gclid|dclid|ocid|cmpid|smid|mc_cid|mc_eid|ito|ref|src|source|share|rss|cmp|__twitter_impression)$')
+MOBILE_HOSTS = re.compile(r'^(www\d*|m|mobile|amp)\.')
+AMP_SUFFIX = re.compile(r'(/amp|\.amp|/index\.html?|/)+$')
+ENTITY_NAME = re.compile(r'([^;,]+),\d+')
+
+def canonical_url(url):
+    """Reduces a URL to the key of the page it points to.
+
+    The scheme, 'www.', mobile and AMP hosts and paths, trailing slashes, fragments and tracking parameters are
+    dropped, and the remaining query parameters are sorted, so the copies of one page found under different URLs
+    share a key.
+
+    Returns:
+        str, empty for missing URLs.
+    """
+    if not isinstance(url, str) or not url.strip():
+        return ''
+    parts = urlsplit(url.strip())
+    host = MOBILE_HOSTS.sub('', (parts.hostname or '').lower())
+    path = AMP_SUFFIX.sub('', parts.path)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query) if not TRACKING_PARAMS.match(key.lower()))
+    return host + path + ('?' + urlencode(query) if query else '')
+
+def record_features(persons, organisations, quotations, shingle_size=3):
+    """Collects the features a record's signature is made of: the people and organisations it names, and
+    the word shingles of its quotes.
+
+    Args:
+        persons (str): V2Persons, e.g. 'Alex Morgan,120;Sam Lee,804'.
+        organisations (str): V2Organizations in the same format.
+        quotations (str): Quotations, '#' separated 'offset|length|verb|quote' tuples.
+        shingle_size (int): words per quote shingle.
+    Returns:
+        Set of str.
+    """
+    features = set()
+    for field in (persons, organisations):
+        if isinstance(field, str):
+            features.update('e:' + name.strip().lower() for name in ENTITY_NAME.findall(field))
+    if isinstance(quotations, str):
+        for quote in quotations.split('#'):
+            words = re.findall(r'\w+', quote.split('|')[-1].lower())
+            features.update('q:' + ' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1))
+    return features
+
+def simhash(features):
+    """Computes the 64 bit SimHash of a set of features, records sharing most features differ in few bits.
+
+    Returns:
+        int.
+    """
+    if not features:
+        return 0
+    hashes = np.array([int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                       for feature in features], dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    # a bit is set where more features set it than not
+    weights = 2 * bits.sum(axis=0, dtype=np.int64) - len(hashes)
+    return int(np.sum(np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))[weights > 0]))
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def seconds(dates):
+    # GDELT dates (YYYYMMDDHHMMSS) as seconds since the epoch
+    dates = pd.to_datetime(pd.Series(dates).astype(str), format='%Y%m%d%H%M%S', errors='coerce')
+    return dates.to_numpy(dtype='datetime64[s]').astype(np.int64).tolist()
+
+def bands(signature, n_bands):
+    # splits the 64 bits into n_bands slices, signatures within n_bands - 1 bits of each other share at least one slice
+    width = -(-64 // n_bands)
+    return [(band, (signature >> (band * width)) & ((1 << width) - 1)) for band in range(n_bands)]
+
+class SyndicationIndex:
+    """Persistent clusters of GDELT records that report the same article, updated incrementally.
+
+    A record joins the cluster of an earlier record with the same canonical URL, or failing that the cluster whose
+    SimHash of named people, organisations and quote shingles is nearest, if it is within max_distance bits and
+    the cluster was last seen within window_days. Candidate clusters come from the bands of the signature, so a
+    record is only compared with clusters that share one band. Otherwise it starts a new cluster and represents it.
+
+    Args:
+        folder (str): folder holding clusters.parquet, one link table part per input file in links/ and state.json.
+        max_distance (int): most bits two signatures may differ in to be the same article.
+        window_days (float): days after a cluster was last seen that copies are still matched to it.
+        min_features (int): records with fewer features are only matched on their URL.
+    """
+    def __init__(self, folder, max_distance=3, window_days=7, min_features=3):
+        self.folder = folder
+        self.max_distance = max_distance
+        self.window = int(window_days * 86400)
+        self.min_features = min_features
+        self.clusters_path = os.path.join(folder, 'clusters.parquet')
+        self.links_folder = os.path.join(folder, 'links')
+        self.state_path = os.path.join(folder, 'state.json')
+        self.state = {'files': [], 'clusters': 0}
+        if os.path.isfile(self.state_path):
+            with open(self.state_path, 'r') as f:
+                self.state = json.load(f)
+        # clusters added by an interrupted run are not in the state and are dropped
+        if os.path.isfile(self.clusters_path):
+            clusters_df = schemas.read_parquet(self.clusters_path, 'syndication_clusters').iloc[:self.state['clusters']]
+        else:
+            clusters_df = schemas.cast(pd.DataFrame(columns=schemas.schema('syndication_clusters').names), 'syndication_clusters')
+        self.representatives = clusters_df['representative_id'].astype(str).to_list()
+        self.signatures = [int(value) for value in clusters_df['simhash'].to_numpy(dtype=np.uint64)]
+        self.last_seen = list(seconds(clusters_df['last_date']))
+        self.records = clusters_df['records'].to_numpy(dtype=np.int64).tolist()
+        self.urls = {}
+        for filename in self.state['files']:
+            links_df = schemas.read_parquet(self.links_path(filename), 'syndication_links', columns=['url_key', 'cluster_id'])
+            self.urls.update(zip(links_df['url_key'], links_df['cluster_id'].to_numpy(dtype=np.int64).tolist()))
+        self.urls.pop('', None)
+        self.n_bands = max_distance + 1
+        self.blocks = {}
+        for cluster_id, signature in enumerate(self.signatures):
+            self.add_block(cluster_id, signature)
+
+    def links_path(self, filename):
+        return os.path.join(self.links_folder, filename.split('.')[0] + '.parquet')
+
+    def is_processed(self, filename):
+        return filename in self.state['files']
+
+    def add_block(self, cluster_id, signature):
+        if signature:
+            for key in bands(signature, self.n_bands):
+                self.blocks.setdefault(key, []).append(cluster_id)
+
+    def nearest(self, signature, seen):
+        # the nearest cluster seen within the window, None if no cluster is within max_distance
+        best = None
+        candidates = {cluster_id for key in bands(signature, self.n_bands) for cluster_id in self.blocks.get(key, [])}
+        # sorted so ties go to the oldest cluster
+        for cluster_id in sorted(candidates):
+            if abs(seen - self.last_seen[cluster_id]) <= self.window:
+                distance = hamming(signature, self.signatures[cluster_id])
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (cluster_id, distance)
+        return None if best is None else best[0]
+
+    def add(self, gkg_df):
+        """Assigns the records of a batch to clusters, in order of publication.
+
+        Args:
+            gkg_df (pd.DataFrame): GKG records with GKGRECORDID, DATE, DocumentIdentifier, V2Persons,
+                V2Organizations and Quotations.
+        Returns:
+            pd.DataFrame link table with record_id, cluster_id, representative_id, url_key and match ('representative',
+            'url' or 'simhash') columns.
+        """
+        gkg_df = gkg_df.drop_duplicates('GKGRECORDID').sort_values(['DATE', 'GKGRECORDID'])
+        record_ids = gkg_df['GKGRECORDID'].astype(str).to_list()
+        seen = seconds(gkg_df['DATE'])
+        url_keys = [canonical_url(url) for url in gkg_df['DocumentIdentifier'].astype(object)]
+        features = [record_features(persons, organisations, quotations) for persons, organisations, quotations in
+                    zip(gkg_df['V2Persons'].astype(object), gkg_df['V2Organizations'].astype(object), gkg_df['Quotations'].astype(object))]
+
+        cluster_ids, matches = np.empty(len(record_ids), dtype=np.int64), []
+        for i, record_id in enumerate(record_ids):
+            signature = simhash(features[i]) if len(features[i]) >= self.min_features else 0
+            cluster_id, match = self.urls.get(url_keys[i]), 'url'
+            if (cluster_id is None) and signature:
+                cluster_id, match = self.nearest(signature, seen[i]), 'simhash'
+            if cluster_id is None:
+                cluster_id, match = len(self.signatures), 'representative'
+                self.representatives.append(record_id)
+                self.signatures.append(signature)
+                self.last_seen.append(seen[i])
+                self.records.append(0)
+                self.add_block(cluster_id, signature)
+            self.last_seen[cluster_id] = max(self.last_seen[cluster_id], seen[i])
+            self.records[cluster_id] += 1
+            if url_keys[i]:
+                self.urls.setdefault(url_keys[i], cluster_id)
+            cluster_ids[i] = cluster_id
+            matches.append(match)
+        return pd.DataFrame({'record_id': record_ids, 'cluster_id': cluster_ids,
+                             'representative_id': [self.representatives[cluster_id] for cluster_id in cluster_ids],
+                             'url_key': url_keys, 'match': matches})
+
+    def clusters(self):
+        """Returns one row per cluster with its representative, signature, last publication date and number of records."""
+        last_date = pd.to_datetime(np.asarray(self.last_seen, dtype='datetime64[s]')).strftime('%Y%m%d%H%M%S').astype(np.int64)
+        return pd.DataFrame({'cluster_id': np.arange(len(self.signatures)), 'representative_id': self.representatives,
+                             'simhash': np.asarray(self.signatures, dtype=np.uint64), 'last_date': last_date, 'records': self.records})
+
+    def save(self, filename, links_df):
+        # the state is written last, so an interruption leaves the index as it was before the file
+        os.makedirs(self.links_folder, exist_ok=True)
+        schemas.write_parquet(links_df, self.links_path(filename), 'syndication_links')
+        schemas.write_parquet(self.clusters(), self.clusters_path, 'syndication_clusters')
+        self.state['files'].append(filename)
+        self.state['clusters'] = len(self.signatures)
+        with schemas.atomic_write(self.state_path) as f:
+            json.dump(self.state, f)
+
+def drop_copies(gkg_df, folder, filename):
+    """Keeps the records of a GKG file that represent their cluster, dropping syndicated copies of earlier records.
+
+    Files that have not been through gdelt_syndication are returned unchanged.
+
+    Args:
+        gkg_df (pd.DataFrame): GKG records of the file.
+        folder (str): syndication index folder.
+        filename (str): name of the raw GKG file.
+    Returns:
+        pd.DataFrame.
+    """
+    links_path = os.path.join(folder, 'links', filename.split('.')[0] + '.parquet')
+    if not os.path.isfile(links_path):
+        print(f'No syndication links for {filename}, keeping every record')
+        return gkg_df
+    links_df = schemas.read_parquet(links_path, 'syndication_links', columns=['record_id', 'match'])
+    copies = links_df.loc[links_df['match'] != 'representative', 'record_id']
+    print(f'Dropping {len(copies)} syndicated copies from {len(gkg_df)} records')
+    return gkg_df.loc[~gkg_df['GKGRECORDID'].astype(str).isin(copies)]
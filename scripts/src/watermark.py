@@ -0,0 +1,105 @@
+import os
+import json
+import threading
+from src import schemas
+
+class WatermarkStore:
+    """Per-source store of the last ingested Lens record and the checkpoint of the run in progress.
+
+    The watermark is the (date_published, lens_id) of the newest record ingested. Results are sorted by
+    date_published then lens_id, so an incremental run re-queries from the watermark date and drops any
+    record at or before the watermark. The checkpoint records how far the current run got (page offset
+    or scroll cursor) so a failed run resumes exactly where it stopped.
+
+    Args:
+        source (str): name of the source, e.g. 'patents' or 'journals'.
+        folder (str): folder holding one JSON file per source.
+    """
+    def __init__(self, source, folder='../data/meta/watermarks/'):
+        self.filepath = os.path.join(folder, source + '.json')
+        self.lock = threading.Lock()
+        self.state = self.load()
+        self.run = None
+
+    def load(self):
+        if not os.path.isfile(self.filepath):
+            return {'date_published': None, 'lens_id': None, 'checkpoint': None}
+        with open(self.filepath, 'r') as f:
+            return json.load(f)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        with schemas.atomic_write(self.filepath) as f:
+            json.dump(self.state, f, indent=2)
+
+    def resume_range(self, start_d, end_d):
+        """Returns the date range the next run should query.
+
+        An unfinished run is resumed with its original range. Otherwise the range starts from the watermark
+        date, or from start_d if nothing has been ingested yet.
+
+        Args:
+            start_d (str): start date as YYYY-MM-DD for the first run of this source.
+            end_d (str): end date as YYYY-MM-DD.
+        Returns:
+            Tuple of (start_d, end_d).
+        """
+        checkpoint = self.state['checkpoint']
+        if checkpoint is not None:
+            print(f"Resuming unfinished run from {checkpoint['start_d']} to {checkpoint['end_d']}")
+            return checkpoint['start_d'], checkpoint['end_d']
+        if self.state['date_published'] is not None:
+            return self.state['date_published'], end_d
+        return start_d, end_d
+
+    def begin(self, mode, start_d, end_d):
+        """Sets the run that checkpoints belong to.
+
+        Args:
+            mode (str): paging mode, 'offset' or 'scroll'.
+            start_d (str): start date of the query.
+            end_d (str): end date of the query.
+        """
+        self.run = {'mode': mode, 'start_d': start_d, 'end_d': end_d}
+
+    def is_new(self, record):
+        """Returns True if a record sorts after the watermark."""
+        if self.state['date_published'] is None:
+            return True
+        key = (str(record.get('date_published', ''))[:10], record.get('lens_id', ''))
+        return key > (self.state['date_published'], self.state['lens_id'])
+
+    def load_checkpoint(self):
+        """Returns the checkpoint of the current run, or None if it has no checkpoint."""
+        checkpoint = self.state['checkpoint']
+        if (checkpoint is None) or (self.run is None):
+            return None
+        if any(checkpoint[key] != value for key, value in self.run.items()):
+            return None
+        return checkpoint['position']
+
+    def save_checkpoint(self, position):
+        """Saves how far the current run got, e.g. the next page offset or the scroll cursor."""
+        with self.lock:
+            self.state['checkpoint'] = dict(self.run, position=position)
+            self.save()
+
+    def clear_checkpoint(self):
+        with self.lock:
+            self.state['checkpoint'] = None
+            self.save()
+
+    def advance(self, date_published, lens_id):
+        """Moves the watermark to the newest record of a completed run and clears its checkpoint.
+
+        Args:
+            date_published (str): date of the last record ingested, None if the run found no records.
+            lens_id (str): lens_id of the last record ingested.
+        """
+        with self.lock:
+            if date_published is not None:
+                key = (str(date_published)[:10], lens_id)
+                if (self.state['date_published'] is None) or (key > (self.state['date_published'], self.state['lens_id'])):
+                    self.state['date_published'], self.state['lens_id'] = key
+            self.state['checkpoint'] = None
+            self.save()
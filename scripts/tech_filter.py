@@ -1,19 +1,15 @@
 ### MAIN PROGRAM ###
-def main(source, input_filename, output_filename, save_option):
+def main(source, input_filename, output_filename, save_option, df=None, settings=None):
     ### Initialise ###
     # import libraries
     import os, ast
     import configparser
-    import pandas as pd
-    from src.google_drive import create_gdrive_client, upload_file
+    from src import metrics, schemas, storage
     from src.regex import define_tech_terms, add_regex_pattern
-    config_file = '../config.ini'
-    # read settings from config file
-    settings = configparser.ConfigParser(inline_comment_prefixes="#")
-    settings.read(config_file)
-    ##load gdrive data
-    gdrive_cred_file = settings['GDRIVE']['credentials']
-    
+    # read settings from config file, unless the pipeline passed in the settings it read
+    if settings is None:
+        settings = configparser.ConfigParser(inline_comment_prefixes="#")
+        settings.read('../config.ini')
 
     # initialise regex patterns
     tech_terms = define_tech_terms()
@@ -23,24 +19,38 @@ def main(source, input_filename, output_filename, save_option):
     input_filepath = os.path.join(settings['DEFAULT']['processed_data_folder'], settings[source]['subfolder'], input_filename)
     if(source == 'GDELT'):
         input_filepath = os.path.join(settings['DEFAULT']['raw_data_folder'], settings[source]['subfolder'], input_filename)
-    print(f'Reading file {input_filepath}')
-    # read CSV or parquet based on file extension
+    # read CSV or parquet based on file extension, unless the data was handed over in memory
     file_extension = input_filename.split('.')[1].lower()
-    if file_extension=='csv':
-        df = pd.read_csv(input_filepath)
+    table = schemas.SOURCE_TABLES[source]
+    if df is not None:
+        print(f'Using data passed in for {input_filepath}')
+        df = schemas.cast(df, table)
+    elif file_extension=='csv':
+        print(f'Reading file {input_filepath}')
+        df = schemas.read_csv(input_filepath, table)
+        metrics.add_bytes(read=input_filepath)
     elif file_extension=='parquet':
-        df = pd.read_parquet(input_filepath)
+        print(f'Reading file {input_filepath}')
+        df = schemas.read_parquet(input_filepath, table)
+        metrics.add_bytes(read=input_filepath)
     else:
         raise ValueError('Input file must be a CSV or parquet')
+    metrics.add_rows(rows_in=len(df))
+    # syndicated copies of an article are counted once, by the record that represents their cluster
+    if source == 'GDELT':
+        from src.syndication import drop_copies
+        df = drop_copies(df, settings['SYNDICATION']['index_folder'], input_filename)
     # combine text columns
     input_cols = ast.literal_eval(settings[source]['filter_text_fields'])
+    # missing values are left out, Arrow backed strings would otherwise make the whole combined text missing
     df['combined_text'] = ''
     for col in input_cols:
-        df['combined_text'] = df['combined_text'] + ' ' + df[col].astype(str)
+        df['combined_text'] = df['combined_text'] + ' ' + df[col].astype('string').fillna('')
     # regex match
-    for tech in tech_terms:
-        print(f'Regex matching for {tech["tech"]}')
-        df[tech['tech']] = df['combined_text'].str.contains(tech['regex'], na=False)
+    with metrics.stage('regex'):
+        for tech in tech_terms:
+            print(f'Regex matching for {tech["tech"]}')
+            df[tech['tech']] = df['combined_text'].str.contains(tech['regex'], na=False)
     # get list of output columns
     output_cols = [tech['tech'] for tech in tech_terms]
     # filter dataframe
@@ -55,19 +65,29 @@ def main(source, input_filename, output_filename, save_option):
     print(f'Saving filtered data as {output_filepath}')
     # save as CSV
     filtered_df.to_csv(output_filepath)
+    metrics.add_rows(rows_out=len(filtered_df))
+    metrics.add_bytes(written=output_filepath)
 
-    ### Save data as CSV in Google Drive ###
-    if (save_option == 'gdrive'):
-        gdrive_folder_id = settings['GDRIVE.FILTERED.FOLDER_IDS'][source]
-        # authenticate and create Google Drive client
-        gdrive = create_gdrive_client(gdrive_cred_file)
-        # upload file to Google Drive
-        upload_file(gdrive, gdrive_folder_id, output_filepath)
-        print('Data saved in Google Drive')
-    if (save_option == 'azure'):
-        print('Save to Azure has not been configured. Action skipped')
+    ### Upload to Google Drive or Azure in the background ###
+    storage.save(output_filepath, ('GDRIVE.FILTERED.FOLDER_IDS', source), save_option)
 
-    return
+    ### Add the file to the technology x country x month rollup ###
+    # patents count applicant residence, journals the country of the last author's institution
+    if source in ('LENS_API.PATENTS', 'LENS_API.JOURNALS'):
+        from src.country_rollup import country_counts, merge_rollup
+        with metrics.stage('country_rollup'):
+            if source == 'LENS_API.PATENTS':
+                applicants_df = schemas.read_parquet(input_filepath.replace('_data.parquet', '_applicants.parquet'), 'patent_parties', columns=['lens_id', 'residence'])
+                # patent_cleaning saves a missing residence as null, 'NA' is Namibia
+                country_df = applicants_df.dropna(subset=['residence']).merge(filtered_df, on='lens_id')
+                country_col = 'residence'
+            else:
+                country_df, country_col = filtered_df, 'country_code'
+            rollup_filepath = os.path.join(settings['DEFAULT']['dashboard_data_folder'], settings[source]['subfolder'].strip('/') + '_country_rollup.parquet')
+            merge_rollup(country_counts(country_df, 'lens_id', country_col, 'date_published', output_cols), rollup_filepath, input_filename)
+            storage.save(rollup_filepath, ('GDRIVE.FILTERED.FOLDER_IDS', source), save_option)
+
+    return filtered_df
 
 ### SCRIPT TO RUN WHEN CALLED STANDALONE ###
 if __name__=='__main__':
@@ -81,4 +101,6 @@ if __name__=='__main__':
     args = parser.parse_args()
 
     # run main
-    main(args.source, args.input_filename, args.output_filename, args.save)
\ No newline at end of file
+    from src.metrics import run_metrics
+    with run_metrics('tech_filter'):
+        main(args.source, args.input_filename, args.output_filename, args.save)
\ No newline at end of file
@@ -1,96 +1,459 @@
-### MAIN PROGRAM ###
-def main(source, input_filename, output_filename, save_option):
-    # import libraries
-    import pandas as pd
-    from bertopic import BERTopic
-    from sentence_transformers import SentenceTransformer
-    from hdbscan import HDBSCAN
-    from bertopic.representation import KeyBERTInspired
-    from sklearn.feature_extraction.text import CountVectorizer
-    import pickle
-    import glob, os
-    import configparser
+### SUB-FUNCTIONS ###
+def define_tech_cols():
+    return ['quantum', 'semiconductors', 'cell-based meats', 'hydrogen power', 'personalised medicine']
 
-    # get config settings
-    config_file = '../config.ini'
-    settings = configparser.ConfigParser(inline_comment_prefixes="#")
-    settings.read(config_file)
+def label_tech(df):
+    # numbers the strongest technology match of each record, using the same numbering for every corpus
+    tech_cols = define_tech_cols()
+    return df[tech_cols].idxmax(1).map({tech: i + 1 for i, tech in enumerate(tech_cols)})
 
-    modelling_path = '../data/modelling/'
+def define_corpora():
+    return {'LENS_API.PATENTS': {'name': 'patent_title', 'loader': load_patent_docs, 'text': 'title', 'key': 'lens_id', 'region': 'jurisdiction',
+                                 'min_cluster_size': 150, 'nr_topics': 'auto'},
+            'LENS_API.JOURNALS': {'name': 'journal_abstract', 'loader': load_journal_docs, 'text': 'abstract_cleaned', 'key': 'lens_id', 'region': 'country_code',
+                                  'min_cluster_size': 50, 'nr_topics': None},
+            'GDELT': {'name': 'gdelt_title', 'loader': load_gdelt_docs, 'text': 'title', 'key': 'GKGRECORDID', 'region': None,
+                      'min_cluster_size': 150, 'nr_topics': 'auto'}}
+
+def load_patent_docs(settings):
+    # loads the processed patents and joins the technology labels from the filtered data
+    import glob
+    import pandas as pd
+    from src import schemas
 
-    ### Input data ###
     # load full dataset
     full_df = pd.DataFrame()
     path = settings['DEFAULT']['processed_data_folder'] + settings['LENS_API.PATENTS']['subfolder'] + '*_data.parquet'
     files = glob.glob(path)
     for file in files:
-        df = pd.read_parquet(file)
+        df = schemas.read_parquet(file, 'patent_data')
         full_df = pd.concat([full_df, df])
-    full_df['lens_id'] = full_df['lens_id'].astype('string')
 
     # load labelled data
     labelled_df = pd.DataFrame()
     path = settings['DEFAULT']['filtered_data_folder'] + settings['LENS_API.PATENTS']['subfolder'] + '*_data_filtered.csv'
     files = glob.glob(path)
     for file in files:
-        df = pd.read_csv(file)
+        df = schemas.read_csv(file, 'patent_data')
         labelled_df = pd.concat([labelled_df, df])
 
-    labelled_df['tech'] = labelled_df[['quantum', 'semiconductors', 'cell-based meats', 'hydrogen power', 'personalised medicine']].idxmax(1)
-    labelled_df['tech'] = pd.factorize(labelled_df['tech'])[0] + 1
-    labelled_df['lens_id'] = labelled_df['lens_id'].astype('string')
+    labelled_df['tech'] = label_tech(labelled_df)
     # join labels to full dataset
     joined_df = full_df.set_index('lens_id').join(labelled_df.set_index('lens_id'), rsuffix='_join', how='left')
     joined_df['tech'] = joined_df['tech'].fillna(-1)
+    return joined_df
 
-    # create doc text and target classes lists 
-    docs = joined_df['title'].to_list()
-    target_classes = joined_df['tech'].astype('int').to_list()
+def load_journal_docs(settings):
+    # loads the cleaned journal articles, joins the technology labels and cleans the abstracts for topic modelling
+    import glob
+    import pandas as pd
+    from src import schemas
 
-    ### Define topic model ###
+    # load full dataset
+    path = settings['DEFAULT']['processed_data_folder'] + settings['LENS_API.JOURNALS']['subfolder'] + '*.parquet'
+    full_df = pd.concat([schemas.read_parquet(file, 'journals') for file in glob.glob(path)])
+
+    # load labelled data
+    path = settings['DEFAULT']['filtered_data_folder'] + settings['LENS_API.JOURNALS']['subfolder'] + '*_filtered.csv'
+    labelled_df = pd.concat([schemas.read_csv(file, 'journals') for file in glob.glob(path)])
+    labelled_df['tech'] = label_tech(labelled_df)
+    # join labels to full dataset
+    joined_df = full_df.set_index('lens_id').join(labelled_df.set_index('lens_id')[['tech']], how='left')
+    joined_df['tech'] = joined_df['tech'].fillna(-1)
+
+    # clean abstract text for topic modelling, dropping markup and empty abstracts
+    joined_df['abstract_cleaned'] = joined_df['abstract'].str.replace(r'(?<=\<)(.*?)(?=\>)|>|<|\r|\n', '', regex=True)
+    joined_df['abstract_cleaned'] = joined_df['abstract_cleaned'].str.replace(r'\s+', ' ', regex=True).str.strip()
+    return joined_df.loc[joined_df['abstract_cleaned'].notna() & (joined_df['abstract_cleaned'] != 'Null.') & (joined_df['abstract_cleaned'] != '')]
+
+def load_gdelt_docs(settings):
+    # loads the filtered GDELT records and uses the page title from the Extras field as the document text
+    import glob
+    import pandas as pd
+    from src import schemas
+
+    path = settings['DEFAULT']['filtered_data_folder'] + settings['GDELT']['subfolder'] + '*_filtered.csv'
+    cols = ['GKGRECORDID', 'DATE', 'Extras'] + define_tech_cols()
+    joined_df = pd.concat([schemas.read_csv(file, 'gkg', usecols=cols) for file in glob.glob(path)])
+    joined_df['tech'] = label_tech(joined_df)
+    joined_df['date_published'] = pd.to_datetime(joined_df['DATE'].astype(str), format='%Y%m%d%H%M%S', errors='coerce')
+    joined_df['title'] = joined_df['Extras'].str.extract(r'<PAGE_TITLE>(.*?)</PAGE_TITLE>', expand=False).str.strip()
+    joined_df = joined_df.drop(columns=['Extras']).drop_duplicates('GKGRECORDID').set_index('GKGRECORDID')
+    return joined_df.loc[joined_df['title'].notna() & (joined_df['title'] != '')]
+
+def define_topic_model(sentence_model, min_cluster_size=150, nr_topics='auto'):
+    from bertopic import BERTopic
+    from hdbscan import HDBSCAN
+    from bertopic.representation import KeyBERTInspired
     # define model components
-    sentence_model = SentenceTransformer("all-MiniLM-L6-v2")
-    hdbscan_model = HDBSCAN(min_cluster_size=150, prediction_data=True)
+    hdbscan_model = HDBSCAN(min_cluster_size=min_cluster_size, prediction_data=True)
     representation_model = KeyBERTInspired()
     # define topic model
-    topic_model = BERTopic(embedding_model=sentence_model, hdbscan_model=hdbscan_model, representation_model=representation_model,
-                        top_n_words=10, nr_topics='auto', calculate_probabilities=False)
-    
+    return BERTopic(embedding_model=sentence_model, hdbscan_model=hdbscan_model, representation_model=representation_model,
+                    top_n_words=10, nr_topics=nr_topics, calculate_probabilities=False)
+
+def assignment_quality(topic_model, topics, embeddings, min_similarity):
+    """Summarises how well documents fit the topics they were assigned to.
+
+    Models loaded from safetensors assign by similarity to the topic embeddings and never return the outlier
+    topic -1, so documents less similar to their topic than min_similarity also count as outliers. That keeps
+    the outlier rate of incremental runs comparable with the full fit.
+
+    Args:
+        topic_model (BERTopic): fitted or loaded topic model.
+        topics (list[int]): assigned topic per document.
+        embeddings (np.ndarray): document embeddings.
+        min_similarity (float): cosine similarity to the topic embedding below which a document is an outlier.
+    Returns:
+        Dict with the number of documents, the outlier rate and the mean cosine similarity between
+        each non-outlier document and its topic embedding.
+    """
+    import numpy as np
+    topics = np.asarray(topics)
+    assigned = topics != -1
+    similarity = np.zeros(len(topics))
+    if assigned.any():
+        # topic embeddings start with the outlier topic when the model has one
+        offset = int(-1 in set(topic_model.get_topic_info()['Topic']))
+        topic_embeddings = np.asarray(topic_model.topic_embeddings_)[topics[assigned] + offset]
+        doc_embeddings = embeddings[assigned]
+        similarity[assigned] = np.sum(doc_embeddings * topic_embeddings, axis=1) / (
+            np.linalg.norm(doc_embeddings, axis=1) * np.linalg.norm(topic_embeddings, axis=1))
+    outliers = ~assigned | (similarity < min_similarity)
+    return {'docs': int(len(topics)), 'outlier_rate': float(outliers.mean()) if len(topics) else 0.0,
+            'mean_similarity': float(similarity[~outliers].mean()) if (~outliers).any() else 0.0}
+
+def drift_report(baseline, new, settings):
+    # compares new assignments with the quality of the full fit and flags when a refit is worth running
+    drift_threshold = float(settings['TOPIC_MODELLING']['drift_threshold'])
+    refit_fraction = float(settings['TOPIC_MODELLING']['refit_fraction'])
+    similarity_drop = baseline['mean_similarity'] - new['mean_similarity']
+    outlier_increase = new['outlier_rate'] - baseline['outlier_rate']
+    new_fraction = new['docs'] / max(baseline['docs'], 1)
+    return {'baseline': baseline, 'new': new,
+            'similarity_drop': similarity_drop, 'outlier_increase': outlier_increase, 'new_fraction': new_fraction,
+            'refit_recommended': bool((similarity_drop > drift_threshold) or (outlier_increase > drift_threshold) or (new_fraction > refit_fraction))}
+
+def topic_docs_table(corpus, joined_df, topics, probs):
+    # one row per document keyed by its id, the document fields stay in the processed data
+    import numpy as np
+    import pyarrow as pa
+    from src import schemas
+    schema = schemas.schema('topic_docs').insert(0, pa.field(corpus['key'], pa.string()))
+    return pa.table({corpus['key']: pa.array(joined_df.index.astype(str), pa.string()),
+                     'topic_number': np.asarray(topics), 'topic_probabilities': np.asarray(probs)}, schema=schema)
+
+def topic_rollup(corpus, joined_df, topics):
+    """Counts documents per topic, technology, month and jurisdiction.
+
+    Args:
+        corpus (dict): corpus definition from define_corpora().
+        joined_df (pd.DataFrame): documents with 'tech' and 'date_published' columns.
+        topics (list[int]): assigned topic per document.
+    Returns:
+        pd.DataFrame with topic_number, tech, month, jurisdiction and count columns.
+    """
+    import numpy as np
+    import pandas as pd
+    dates = pd.to_datetime(joined_df['date_published'], errors='coerce').to_numpy()
+    rollup_df = pd.DataFrame({'topic_number': np.asarray(topics, dtype=np.int16),
+                              'tech': joined_df['tech'].to_numpy().astype(np.int8),
+                              'month': dates.astype('datetime64[M]').astype('datetime64[s]'),
+                              'jurisdiction': joined_df[corpus['region']].to_numpy() if corpus['region'] else None})
+    return rollup_df.groupby(['topic_number', 'tech', 'month', 'jurisdiction'], dropna=False, observed=True).size().rename('count').reset_index()
+
+def write_rollup(rollup_df, filepath):
+    # writes the rollup with compact types, months as dates
+    from src import schemas
+    schemas.write_parquet(rollup_df, filepath, 'topic_rollup')
+
+def dedup_documents(settings, texts):
+    # collapses duplicate texts with the method set in config, see src.dedup.collapse_duplicates
+    from src.dedup import collapse_duplicates
+    return collapse_duplicates(texts, method=settings['TOPIC_MODELLING']['dedup'],
+                               threshold=float(settings['TOPIC_MODELLING']['minhash_threshold']),
+                               num_perm=int(settings['TOPIC_MODELLING']['minhash_perm']))
+
+def stratified_sample(joined_df, fraction, min_per_stratum, random_state=0):
+    """Draws a sample stratified by technology label and publication year.
+
+    Args:
+        joined_df (pd.DataFrame): documents with 'tech' and 'date_published' columns.
+        fraction (float): fraction of each stratum to sample.
+        min_per_stratum (int): smallest number of documents sampled from a stratum, small strata are kept whole.
+        random_state (int): seed for a reproducible sample.
+    Returns:
+        Sorted np.ndarray of row positions in the sample.
+    """
+    import numpy as np
+    import pandas as pd
+    strata_df = pd.DataFrame({'tech': joined_df['tech'].to_numpy(),
+                              'year': pd.to_datetime(joined_df['date_published'], errors='coerce').dt.year.to_numpy()})
+    positions = []
+    for _, group in strata_df.groupby(['tech', 'year'], dropna=False):
+        n = min(len(group), max(min_per_stratum, int(round(len(group) * fraction))))
+        positions.append(group.sample(n=n, random_state=random_state).index.to_numpy())
+    return np.sort(np.concatenate(positions))
+
+# model shared with forked worker processes, set by transform_batches() before the pool starts. The lock keeps
+# corpora modelled in parallel threads from swapping the model while a pool forks
+import threading
+shared_topic_model = None
+shared_topic_model_lock = threading.Lock()
+
+def transform_batch(batch):
+    # runs in a forked worker, which has its own copy of the model set by transform_batches()
+    import numpy as np
+    docs, embeddings = batch
+    topics, probs = shared_topic_model.transform(docs, embeddings)
+    return np.asarray(topics), np.asarray(probs)
+
+def transform_batches(topic_model, docs, embeddings, batch_size, workers):
+    # assigns topics batch by batch across forked worker processes, each with its own copy of the model,
+    # since a BERTopic model is not safe to share between threads
+    global shared_topic_model
+    import multiprocessing
+    import numpy as np
+    batches = [(docs[start:start + batch_size], embeddings[start:start + batch_size]) for start in range(0, len(docs), batch_size)]
+    if not batches:
+        return np.empty(0, dtype=int), np.empty(0)
+    with shared_topic_model_lock:
+        shared_topic_model = topic_model
+        try:
+            if (workers > 1) and (len(batches) > 1) and ('fork' in multiprocessing.get_all_start_methods()):
+                with multiprocessing.get_context('fork').Pool(min(workers, len(batches))) as pool:
+                    results = pool.map(transform_batch, batches, chunksize=1)
+            else:
+                results = [transform_batch(batch) for batch in batches]
+        finally:
+            shared_topic_model = None
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+def sample_quality_report(settings, corpus, topic_model, docs, embeddings, target_classes, random_state=0):
+    """Compares the sample-fitted model with a model fitted on all of a reference subset.
+
+    Returns:
+        Dict with the adjusted Rand index and normalised mutual information between the two assignments
+        of the reference subset, and the number of topics and outlier rate of each.
+    """
+    import numpy as np
+    from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+    reference_size = min(int(settings['TOPIC_MODELLING']['reference_size']), len(docs))
+    reference = np.sort(np.random.default_rng(random_state).choice(len(docs), size=reference_size, replace=False))
+    reference_docs = [docs[i] for i in reference]
+
+    # full fit on the reference subset
+    reference_model = define_topic_model(topic_model.embedding_model, corpus['min_cluster_size'], corpus['nr_topics'])
+    full_topics, _ = reference_model.fit_transform(reference_docs, embeddings[reference], y=[target_classes[i] for i in reference])
+    # sample model predictions for the same documents
+    sample_topics, _ = topic_model.transform(reference_docs, embeddings[reference])
+
+    full_topics = np.asarray(full_topics)
+    sample_topics = np.asarray(sample_topics)
+    return {'reference_docs': int(reference_size),
+            'adjusted_rand_index': float(adjusted_rand_score(full_topics, sample_topics)),
+            'normalized_mutual_info': float(normalized_mutual_info_score(full_topics, sample_topics)),
+            'full_fit': {'topics': int(len(set(full_topics) - {-1})), 'outlier_rate': float((full_topics == -1).mean())},
+            'sample_fit': {'topics': int(len(set(sample_topics) - {-1})), 'outlier_rate': float((sample_topics == -1).mean())}}
+
+### MAIN PROGRAM ###
+def fit_topics(settings, corpus, joined_df, embedding_engine, embedding_cache, sample=False):
+    """Fits the topic model of one corpus and writes every output table.
+
+    With sample=True the model is fitted on a sample stratified by technology and year, the remaining
+    documents are assigned in parallel batches with approximate prediction, and a quality report compares
+    the result with a full fit on a reference subset.
+    Duplicate titles are collapsed first and the topic of each group is copied to all of its members.
+    """
+    import os, json, shutil
+    import numpy as np
+    import pandas as pd
+    import pyarrow.parquet as pq
+    from src import metrics
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    modelling_path = settings['TOPIC_MODELLING']['modelling_folder']
+    model_name = settings['TOPIC_MODELLING']['embedding_model']
+
+    # collapse duplicate titles, each distinct title is embedded and clustered once
+    representatives, groups = dedup_documents(settings, joined_df[corpus['text']].to_list())
+    unique_df = joined_df.iloc[representatives]
+    # create doc text and target classes lists
+    docs = unique_df[corpus['text']].astype('str').to_list()
+    target_classes = unique_df['tech'].astype('int').to_list()
+
+    ### Define topic model ###
+    sentence_model = embedding_engine.model
+    topic_model = define_topic_model(sentence_model, corpus['min_cluster_size'], corpus['nr_topics'])
+
     ### Run topic modelling ###
-    # compute embeddings
-    embeddings = sentence_model.encode(docs, show_progress_bar=True)
-    # store as pickle file
-    with open(os.path.join(modelling_path,'patent_title_embeddings'), 'wb') as f:
-        pickle.dump(embeddings, f)
-    # fit and transform model
-    topics, probs = topic_model.fit_transform(docs, embeddings, y=target_classes)
-    # represent topics
+    # compute embeddings, only texts missing from the embedding cache are encoded
+    with metrics.stage('embed'):
+        embeddings = embedding_cache.encode(docs, embedding_engine.encode)
     vectorizer_model = CountVectorizer(stop_words="english", ngram_range=(1, 2))
-    topic_model.update_topics(docs, vectorizer_model=vectorizer_model)
+    if sample:
+        # fit on a stratified sample
+        fit_positions = stratified_sample(unique_df, float(settings['TOPIC_MODELLING']['sample_fraction']), int(settings['TOPIC_MODELLING']['sample_min_per_stratum']))
+        fit_docs = [docs[i] for i in fit_positions]
+        print(f'Fitting topic model on a sample of {len(fit_positions)} of {len(docs)} documents')
+        fitted_topics, fitted_probs = topic_model.fit_transform(fit_docs, embeddings[fit_positions], y=[target_classes[i] for i in fit_positions])
+        topic_model.update_topics(fit_docs, vectorizer_model=vectorizer_model)
+        # assign the rest with approximate prediction
+        rest_positions = np.setdiff1d(np.arange(len(docs)), fit_positions)
+        rest_topics, rest_probs = transform_batches(topic_model, [docs[i] for i in rest_positions], embeddings[rest_positions],
+                                                    int(settings['TOPIC_MODELLING']['assign_batch_size']), int(settings['TOPIC_MODELLING']['assign_workers']))
+        topics = np.empty(len(docs), dtype=int)
+        probs = np.empty(len(docs), dtype=float)
+        topics[fit_positions], probs[fit_positions] = fitted_topics, fitted_probs
+        topics[rest_positions], probs[rest_positions] = rest_topics, rest_probs
+        topics = topics.tolist()
+        # compare with a full fit on a reference subset
+        with open(os.path.join(modelling_path,f"{corpus['name']}_sample_report.json"), 'w') as f:
+            json.dump(sample_quality_report(settings, corpus, topic_model, docs, embeddings, target_classes), f, indent=2)
+    else:
+        # fit and transform model
+        topics, probs = topic_model.fit_transform(docs, embeddings, y=target_classes)
+        # represent topics
+        topic_model.update_topics(docs, vectorizer_model=vectorizer_model)
     # save model
-    topic_model.save(os.path.join(modelling_path,'patent_title_model'), serialization='safetensors', save_ctfidf=True, save_embedding_model=sentence_model)
-    # save outputs
-    with open(os.path.join(modelling_path,'patent_title_topics'), 'wb') as f:
-        pickle.dump(topics, f)
-    with open(os.path.join(modelling_path,'patent_title_probs'), 'wb') as f:
-        pickle.dump(probs, f)
+    topic_model.save(os.path.join(modelling_path,f"{corpus['name']}_model"), serialization='safetensors', save_ctfidf=True, save_embedding_model=model_name)
+    # save the assignment quality of the full fit as the baseline for drift checks
+    with open(os.path.join(modelling_path,f"{corpus['name']}_baseline.json"), 'w') as f:
+        json.dump(assignment_quality(topic_model, topics, embeddings, float(settings['TOPIC_MODELLING']['outlier_similarity'])), f, indent=2)
+    # copy the topic of each distinct title to all of its duplicates
+    topics = np.asarray(topics)[groups]
+    probs = np.asarray(probs)[groups]
 
     ### Output data ###
-    # create a topic docs dataframe
-    topic_docs_df = joined_df.copy()
-    topic_docs_df['topic_number'] = topics
-    topic_docs_df['topic_probabilities'] = probs
-    # save as csv
-    topic_docs_df.to_csv('../data/dashboard/patent_title_topic_docs.csv')
-    
-    # create a topic names dataframe
+    dashboard_path = settings['DEFAULT']['dashboard_data_folder']
+    # topic docs are a folder of parquet parts, incremental runs add a part per run
+    docs_path = os.path.join(dashboard_path, f"{corpus['name']}_topic_docs")
+    shutil.rmtree(docs_path, ignore_errors=True)
+    os.makedirs(docs_path)
+    pq.write_table(topic_docs_table(corpus, joined_df, topics, probs), os.path.join(docs_path, 'part-0.parquet'))
+    # precomputed counts for the dashboard
+    write_rollup(topic_rollup(corpus, joined_df, topics), os.path.join(dashboard_path, f"{corpus['name']}_topic_rollup.parquet"))
+
+    # create a topic names dataframe, sizes count every document rather than the distinct titles the model was fitted on
     topic_names_df = topic_model.get_topic_info()
+    topic_names_df['Count'] = topic_names_df['Topic'].map(pd.Series(topics).value_counts()).fillna(0).astype(int)
     top_terms = (topic_model.get_topics().values())
     topic_names_df['topic_terms'] = [[pair[0] for pair in topic] for topic in top_terms]
     topic_names_df['term_probabilities'] = [[float(pair[1]) for pair in topic] for topic in top_terms]
-    # save as csv and display
-    topic_names_df.to_csv('../data/dashboard/patent_title_topic_names.csv')
-    topic_names_df
+    # save as csv
+    topic_names_df.to_csv(os.path.join(dashboard_path, f"{corpus['name']}_topic_names.csv"))
+
+    return
+
+def assign_new_topics(settings, corpus, joined_df, embedding_engine, embedding_cache):
+    """Assigns topics to documents that are not in the topic outputs yet, using the saved topic model.
+
+    The model is not refitted. New rows are added to the topic docs table as a new part, the topic counts and
+    the rollup are updated, and a drift report compares the new assignments with the full fit.
+    """
+    import os, json, glob
+    import numpy as np
+    import pandas as pd
+    import pyarrow.parquet as pq
+    from bertopic import BERTopic
+    from src import schemas
+
+    modelling_path = settings['TOPIC_MODELLING']['modelling_folder']
+    dashboard_path = settings['DEFAULT']['dashboard_data_folder']
+    docs_path = os.path.join(dashboard_path, f"{corpus['name']}_topic_docs")
+    names_filepath = os.path.join(dashboard_path, f"{corpus['name']}_topic_names.csv")
+    rollup_filepath = os.path.join(dashboard_path, f"{corpus['name']}_topic_rollup.parquet")
+
+    ### Identify new documents ###
+    assigned_ids = pd.read_parquet(docs_path, columns=[corpus['key']])[corpus['key']]
+    new_df = joined_df.loc[~joined_df.index.isin(assigned_ids)]
+    print(f"{len(new_df)} new documents to assign for {corpus['name']}")
+    if len(new_df) == 0:
+        return
+
+    ### Assign topics with the saved model ###
+    # models saved with safetensors assign by similarity to the topic embeddings, pickled models use approximate_predict
+    topic_model = BERTopic.load(os.path.join(modelling_path,f"{corpus['name']}_model"), embedding_model=embedding_engine.model)
+    representatives, groups = dedup_documents(settings, new_df[corpus['text']].to_list())
+    docs = new_df[corpus['text']].iloc[representatives].astype('str').to_list()
+    embeddings = embedding_cache.encode(docs, embedding_engine.encode)
+    unique_topics, unique_probs = topic_model.transform(docs, embeddings)
+    topics = np.asarray(unique_topics)[groups]
+    probs = np.asarray(unique_probs)[groups]
+
+    ### Append to output data ###
+    part = len(glob.glob(os.path.join(docs_path, 'part-*.parquet')))
+    pq.write_table(topic_docs_table(corpus, new_df, topics, probs), os.path.join(docs_path, f'part-{part}.parquet'))
+    # add the new counts to the rollup
+    rollup_df = pd.concat([schemas.read_parquet(rollup_filepath, 'topic_rollup'), topic_rollup(corpus, new_df, topics)])
+    rollup_df['month'] = pd.to_datetime(rollup_df['month'])
+    write_rollup(rollup_df.groupby(['topic_number', 'tech', 'month', 'jurisdiction'], dropna=False, observed=True)['count'].sum().reset_index(), rollup_filepath)
+    # update topic sizes
+    topic_names_df = pd.read_csv(names_filepath, index_col=0)
+    new_counts = pd.Series(topics).value_counts()
+    topic_names_df['Count'] = topic_names_df['Count'] + topic_names_df['Topic'].map(new_counts).fillna(0).astype(int)
+    topic_names_df.to_csv(names_filepath)
+
+    ### Drift check ###
+    with open(os.path.join(modelling_path,f"{corpus['name']}_baseline.json"), 'r') as f:
+        baseline = json.load(f)
+    report = drift_report(baseline, assignment_quality(topic_model, unique_topics, embeddings, float(settings['TOPIC_MODELLING']['outlier_similarity'])), settings)
+    with open(os.path.join(modelling_path,f"{corpus['name']}_drift.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Mean topic similarity {report['new']['mean_similarity']:.3f} (full fit {baseline['mean_similarity']:.3f}), "
+          f"outlier rate {report['new']['outlier_rate']:.3f} (full fit {baseline['outlier_rate']:.3f})")
+    if report['refit_recommended']:
+        print('Warning: topic drift is high, a full refit is recommended (run with --mode fit)')
+
+    return
+
+def run_corpus(settings, corpus, joined_df, embedding_engine, embedding_cache, mode):
+    from src import metrics
+    print(f"Topic modelling {corpus['name']} ({len(joined_df)} documents, mode {mode})")
+    with metrics.stage(corpus['name']):
+        metrics.add_rows(rows_in=len(joined_df))
+        if mode == 'incremental':
+            assign_new_topics(settings, corpus, joined_df, embedding_engine, embedding_cache)
+        else:
+            fit_topics(settings, corpus, joined_df, embedding_engine, embedding_cache, sample=(mode == 'sample'))
+
+def main(sources, save_option, mode='fit', parallel=False, settings=None):
+    # import libraries
+    import configparser
+    from concurrent.futures import ThreadPoolExecutor
+    from src.embedding_cache import EmbeddingCache
+    from src.embedding_engine import EmbeddingEngine
+
+    # read settings from config file, unless the pipeline passed in the settings it read
+    if settings is None:
+        settings = configparser.ConfigParser(inline_comment_prefixes="#")
+        settings.read('../config.ini')
+    model_name = settings['TOPIC_MODELLING']['embedding_model']
+    corpora = define_corpora()
+
+    ### Input data ###
+    inputs = [(corpora[source], corpora[source]['loader'](settings)) for source in sources]
+
+    ### Embedding model and cache ###
+    # loaded once and shared by every corpus
+    embedding_engine = EmbeddingEngine(model_name, workers=int(settings['TOPIC_MODELLING']['embedding_workers']),
+                                       batch_size=int(settings['TOPIC_MODELLING']['embedding_batch_size']),
+                                       backend=settings['TOPIC_MODELLING']['embedding_backend'])
+    embedding_cache = EmbeddingCache(settings['TOPIC_MODELLING']['embedding_cache'], model_name, settings['TOPIC_MODELLING']['embedding_dtype'],
+                                     backend=settings['TOPIC_MODELLING']['embedding_backend'])
+
+    if parallel and len(inputs) > 1:
+        # encode the texts of all corpora in one pass, so the corpora running side by side only read from the cache
+        # and the encoding worker pool is never forked from a threaded process
+        texts = [text for corpus, joined_df in inputs for text in joined_df[corpus['text']].astype('str').to_list()]
+        embedding_cache.encode(texts, embedding_engine.encode)
+        with ThreadPoolExecutor(max_workers=len(inputs)) as executor:
+            futures = [executor.submit(run_corpus, settings, corpus, joined_df, embedding_engine, embedding_cache, mode) for corpus, joined_df in inputs]
+            for future in futures:
+                future.result()
+    else:
+        for corpus, joined_df in inputs:
+            run_corpus(settings, corpus, joined_df, embedding_engine, embedding_cache, mode)
 
     return
 
@@ -99,9 +462,13 @@ if __name__=='__main__':
     # input arguments
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('--source', help='choose from GDELT, LENS_API.PATENTS, LENS_API.JOURNALS')
+    parser.add_argument('--source', nargs='+', default=['LENS_API.PATENTS'], choices=['GDELT', 'LENS_API.PATENTS', 'LENS_API.JOURNALS'], help='one or more sources to model, choose from GDELT, LENS_API.PATENTS, LENS_API.JOURNALS')
     parser.add_argument('--save', default=None, type=str, help = "value determines how the data will be saved. See config.ini for default and valid options")
+    parser.add_argument('--mode', default='fit', choices=['fit', 'sample', 'incremental'], help = "fit refits the topic model on the full corpus, sample fits on a stratified sample and predicts the rest, incremental assigns topics to new documents with the saved model")
+    parser.add_argument('--parallel', action='store_true', help='model the sources concurrently after encoding all of their texts in one pass')
     args = parser.parse_args()
 
     # run main
-    main(args.source, args.save)
\ No newline at end of file
+    from src.metrics import run_metrics
+    with run_metrics('topic_modelling'):
+        main(args.source, args.save, args.mode, args.parallel)